@@ -28,9 +28,11 @@ from lica.tabulate import paging
 
 from .. import __version__
 from .util import parser as prs
+from .util.misc import export_zip
 
 from ..controller.batch import Controller as BatchController
 from ..controller.exporter import Controller as Exporter
+from ..controller.incremental import Controller as Incremental
 from ..dao import engine
 
 # ----------------
@@ -96,8 +98,13 @@ async def cli_batch_view(args: Namespace) -> None:
 
 
 async def cli_batch_export(args: Namespace) -> None:
-    if args.all:
-        exporter = Exporter(base_dir=args.base_dir, filename_prefix="all")
+    if args.incremental:
+        log.info("exporting new sessions to directory %s", args.base_dir)
+        nrows = await Incremental(base_dir=args.base_dir, fmt=args.format).run()
+        for kind, n in nrows.items():
+            log.info("%d new %s rows", n, kind)
+    elif args.all:
+        exporter = Exporter(base_dir=args.base_dir, filename_prefix="all", fmt=args.format)
         log.info("exporting to directory %s", args.base_dir)
         summaries = await exporter.query_summaries()
         # This is not necessary in a CLI application, just to show how it should be done in a GUI
@@ -114,21 +121,17 @@ async def cli_batch_export(args: Namespace) -> None:
             t1 = batch.end_tstamp.strftime("%Y%m%d")
             filename_preffix = f"from_{t0}_to_{t1}"
             base_dir = os.path.join(args.base_dir, filename_preffix)
-            log.info("exporting to directory %s", base_dir)
-            os.makedirs(base_dir, exist_ok=True)
+            if not args.zip_direct:
+                log.info("exporting to directory %s", base_dir)
+                os.makedirs(base_dir, exist_ok=True)
             exporter = Exporter(
                 base_dir=base_dir,
                 filename_prefix=filename_preffix,
                 begin_tstamp=batch.begin_tstamp,
                 end_tstamp=batch.end_tstamp,
+                fmt=args.format,
             )
-            summaries = await exporter.query_summaries()
-            await asyncio.to_thread(exporter.export_summaries, summaries)
-            rounds = await exporter.query_rounds()
-            await asyncio.to_thread(exporter.export_rounds, rounds)
-            samples = await exporter.query_samples()
-            await asyncio.to_thread(exporter.export_samples, samples)
-            zip_file_path = await asyncio.to_thread(exporter.pack)
+            zip_file_path = await export_zip(exporter, args)
             if not args.email:
                 log.info("Not sending email for this batch")
                 return
@@ -184,8 +187,8 @@ def add_args(parser: ArgumentParser):
     p.set_defaults(func=cli_batch_orphan)
     p = subparser.add_parser(
         "export",
-        parents=[prs.odir(), prs.expor()],
-        help="Export calibration batch to CSV files",
+        parents=[prs.odir(), prs.expor(), prs.efmt(), prs.zipo()],
+        help="Export calibration batch to CSV, Parquet or Arrow files",
     )
     p.set_defaults(func=cli_batch_export)
 
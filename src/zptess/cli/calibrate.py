@@ -13,7 +13,7 @@ import asyncio
 import statistics
 from datetime import timedelta
 from argparse import Namespace, ArgumentParser
-from typing import Sequence, Mapping
+from typing import Any, Sequence, Mapping
 
 # -------------------
 # Third party imports
@@ -23,7 +23,7 @@ from pubsub import pub
 
 from lica.sqlalchemy import sqa_logging
 from lica.asyncio.cli import execute
-from lica.asyncio.photometer import Role, Message
+from lica.asyncio.photometer import Role
 
 from zptessdao.constants import CentralTendency
 
@@ -34,8 +34,19 @@ from zptessdao.constants import CentralTendency
 
 from .. import __version__
 from .util import parser as prs
-from .util.misc import log_phot_info, update_zp
-from ..controller.photometer import VolatileCalibrator, PersistentCalibrator, Event, RoundStatsType
+from .util.misc import log_phot_info, update_zp, log_profile, metrics_exporters
+from ..controller.photometer import (
+    VolatileCalibrator,
+    PersistentCalibrator,
+    MultiCalibrator,
+    Event,
+    RoundStatsType,
+    Reading,
+    Journal,
+    Profiler,
+    Metrics,
+    VirtualClock,
+)
 from ..controller.batch import Controller as BatchController
 from ..dao import engine
 from ..mpl import plot
@@ -54,13 +65,16 @@ HALF_SECOND = timedelta(seconds=0.5)
 
 # get the module logger
 log = logging.getLogger(__name__.split(".")[-1])
+controller = None
+# Kept across the controller creation, so that it can be exported all along
+metrics = Metrics()
 
 # ------------------
 # Auxiliar functions
 # ------------------
 
 
-def on_reading(role: Role, reading: Message) -> None:
+def on_reading(role: Role, reading: Reading) -> None:
     global controller
     log = logging.getLogger(role.tag())
     current = len(controller.buffer(role))
@@ -73,14 +87,15 @@ def on_reading(role: Role, reading: Message) -> None:
 def on_round(current: int, mag_diff: float, zero_point: float, stats: RoundStatsType) -> None:
     global controller
     zp_abs = controller.zp_abs
-    nrounds = controller.nrounds
+    # Rounds may stop earlier than this when adapting to the ZP convergence
+    nrounds = controller.nrounds if controller.tolerance is None else controller.max_rounds
     phot_info = controller.phot_info
-    central = controller.central
+    central = controller.robust or controller.central
     zp_fict = controller.zp_fict
     log.info("=" * 74)
     log.info(
         "%-10s %02d/%02d: New ZP = %0.2f = \u0394(ref-test) Mag (%0.2f) + ZP Abs (%0.2f)",
-        "ROUND",
+        "ROUND" if current > 0 else "PROVISIONAL",
         current,
         nrounds,
         zero_point,
@@ -90,8 +105,8 @@ def on_round(current: int, mag_diff: float, zero_point: float, stats: RoundStats
     for role in (Role.REF, Role.TEST):
         tag = role.tag()
         name = phot_info[role]["name"]
-        Ti = controller.ring[role][0]["tstamp"]
-        Tf = controller.ring[role][-1]["tstamp"]
+        Ti = controller.ring[role][0].tstamp
+        Tf = controller.ring[role][-1].tstamp
         T = (Tf - Ti).total_seconds()
         Ti = (Ti + HALF_SECOND).strftime("%H:%M:%S")
         Tf = (Tf + HALF_SECOND).strftime("%H:%M:%S")
@@ -126,6 +141,7 @@ def on_summary(
     best_zero_point_method: CentralTendency,
     final_zero_point: float,
     overlapping_windows: Mapping[Role, Sequence[float | None]],
+    stop_reason: str | None,
 ) -> None:
     global controller
     log.info("#" * 74)
@@ -161,8 +177,10 @@ def on_summary(
     )
     log.info("REF. rounds overlap \u0394T = %s", overlapping_windows[Role.REF])
     log.info("TEST rounds overlap \u0394T = %s", overlapping_windows[Role.TEST])
-    log.info("REF. unique samples: %d", len(controller.unique_samples(Role.REF)))
-    log.info("TEST unique samples: %d", len(controller.unique_samples(Role.TEST)))
+    log.info("REF. unique samples: %d", controller.nsamples(Role.REF))
+    log.info("TEST unique samples: %d", controller.nsamples(Role.TEST))
+    if stop_reason is not None:
+        log.info("Rounds stopped: %s", stop_reason)
     log.info("#" * 74)
 
 
@@ -176,10 +194,8 @@ def on_summary(
 # -------------------
 
 
-async def cli_calib_test(args: Namespace) -> None:
-    global controller
-
-    ref_params = {
+def get_ref_params(args: Namespace) -> Mapping[str, Any]:
+    return {
         "model": args.ref_model,
         "sensor": args.ref_sensor,
         "endpoint": args.ref_endpoint,
@@ -187,43 +203,196 @@ async def cli_calib_test(args: Namespace) -> None:
         "log_level": logging.DEBUG if args.ref_raw_message else logging.INFO,
         "strict": args.ref_strict,
     }
-    test_params = {
-        "model": args.test_model,
-        "sensor": args.test_sensor,
-        "endpoint": args.test_endpoint,
-        "old_proto": args.test_old_proto,
-        "log_level": logging.DEBUG if args.test_raw_message else logging.INFO,
-        "strict": args.test_strict,
-    }
-    common_params = {
+
+
+def plotting(args: Namespace) -> bool:
+    return any(getattr(args, name, False) for name in ("plot_histo", "plot_samples", "plot_both"))
+
+
+def get_common_params(args: Namespace) -> Mapping[str, Any]:
+    return {
         "buffer": args.buffer,
+        "ring": args.ring,
         "persist": args.persist,
+        "bulk": args.bulk,
+        "stream": args.stream,
         "update": args.update,
         "central": args.central,
+        "robust": args.robust,
+        "kappa": args.kappa,
+        "trim": args.trim,
         "period": args.period,
         "zp_fict": args.zp_fict,
         "zp_offset": args.zp_offset,
         "rounds": args.rounds,
+        "tolerance": args.converge,
+        "stable": args.stable,
+        "max_rounds": args.max_rounds,
+        "provisional": args.provisional,
+        "precision": args.precision,
         "author": " ".join(args.author) if args.author else None,
+        "journal": args.journal,
+        "plot": plotting(args),
     }
-    if args.persist:
-        controller = PersistentCalibrator(
-            ref_params=ref_params, test_params=test_params, common_params=common_params
+
+
+async def cli_calib_test(args: Namespace) -> None:
+    global controller
+
+    ref_params = get_ref_params(args)
+    test_params = {
+        "model": args.test_model,
+        "sensor": args.test_sensor,
+        "endpoint": args.test_endpoint,
+        "old_proto": args.test_old_proto,
+        "log_level": logging.DEBUG if args.test_raw_message else logging.INFO,
+        "strict": args.test_strict,
+    }
+    common_params = get_common_params(args)
+    await build_controller(args, ref_params, test_params, common_params)
+    if args.info:
+        log.info("Only displaying info. Stopping here.")
+        return
+    final_zero_point = await controller.calibrate()
+    await post_calibration(args, final_zero_point)
+
+
+async def cli_calib_resume(args: Namespace) -> None:
+    ref_params, test_params, common_params = Journal.params(args.journal)
+    common_params["update"] = args.update
+    common_params["plot"] = plotting(args)
+    await build_controller(args, ref_params, test_params, common_params)
+    final_zero_point = await controller.resume(args.journal)
+    await post_calibration(args, final_zero_point)
+
+
+async def cli_calib_multi(args: Namespace) -> None:
+    global controller
+
+    if len(set(args.test_endpoint)) < len(args.test_endpoint):
+        # Also two simulated photometers with the same unit would be the same photometer
+        raise ValueError("The same test photometer endpoint is given more than once")
+    test_params = [
+        {
+            "model": args.test_model,
+            "sensor": args.test_sensor,
+            "endpoint": endpoint,
+            "old_proto": None,
+            "log_level": logging.DEBUG if args.test_raw_message else logging.INFO,
+            "strict": args.test_strict,
+        }
+        for endpoint in args.test_endpoint
+    ]
+    common_params = get_common_params(args)
+    if common_params["persist"]:
+        await check_batch(args)
+    multi = MultiCalibrator(
+        ref_params=get_ref_params(args),
+        test_params=test_params,
+        common_params=common_params,
+        clock=VirtualClock() if args.virtual_clock else None,
+    )
+    if args.profile_pipeline:
+        multi.profiler = Profiler()
+    multi.metrics = metrics
+    # Only for the pipeline profile report at exit
+    controller = multi
+    await multi.init()
+    try:
+        await log_phot_info(multi, Role.REF)
+        async with asyncio.TaskGroup() as tg:
+            for calibrator in multi.calibrators:
+                tg.create_task(log_phot_info(calibrator, Role.TEST))
+    except* Exception as eg:
+        for e in eg.exceptions:
+            if args.trace:
+                log.exception(e)
+            else:
+                log.error(e)
+        raise RuntimeError("Could't continue execution, check errors above")
+    if args.info:
+        log.info("Only displaying info. Stopping here.")
+        return
+    results = await multi.calibrate()
+    # Failed calibrations have already been reported
+    calibrated = [
+        (calibrator, result)
+        for calibrator, result in zip(multi.calibrators, results)
+        if not isinstance(result, Exception)
+    ]
+    log.info("#" * 74)
+    for calibrator, final_zero_point in calibrated:
+        name = calibrator.phot_info[Role.TEST]["name"]
+        log.info(
+            "Session = %s, %-9s ZP list is %s, Final TEST ZP = %0.2f",
+            calibrator.meas_session.strftime("%Y-%m-%dT%H:%M:%S"),
+            name,
+            [round(zp, 2) for zp in calibrator.zero_points],
+            final_zero_point,
         )
-        open_batch = await (BatchController()).is_open()
-        if not open_batch:
-            if args.no_batch:
-                log.warn("Persistent calibration without an open batch")
+    log.info("#" * 74)
+    for calibrator, final_zero_point in calibrated:
+        name = calibrator.phot_info[Role.TEST]["name"]
+        try:
+            if args.update:
+                await update_zp(calibrator, final_zero_point)
             else:
-                raise RuntimeError("Persistent calibration without an open batch")
+                msg = f"Zero Point {final_zero_point:.2f} not saved to {Role.TEST} {name}"
+                log.info(msg)
+                await calibrator.not_updated(final_zero_point, msg)
+        except Exception as e:
+            if args.trace:
+                log.exception(e)
+            else:
+                log.error("Saving the Zero Point of %s: %s", name, e)
+    if plotting(args):
+        for calibrator, _ in calibrated:
+            plot_calibration(args, calibrator)
+    if len(calibrated) < len(results):
+        raise RuntimeError(
+            f"{len(results) - len(calibrated)} of {len(results)} calibrations failed"
+        )
+
+
+async def check_batch(args: Namespace) -> None:
+    open_batch = await (BatchController()).is_open()
+    if not open_batch:
+        if args.no_batch:
+            log.warn("Persistent calibration without an open batch")
         else:
-            batch = await (BatchController()).get_open()
-            log.info("Logging results to a database. Current batch is %s", batch)
+            raise RuntimeError("Persistent calibration without an open batch")
+    else:
+        batch = await (BatchController()).get_open()
+        log.info("Logging results to a database. Current batch is %s", batch)
+
 
+async def build_controller(
+    args: Namespace,
+    ref_params: Mapping[str, Any],
+    test_params: Mapping[str, Any],
+    common_params: Mapping[str, Any],
+) -> None:
+    """Creates and initializes the global controller, contacting both photometers"""
+    global controller
+    clock = VirtualClock() if args.virtual_clock else None
+    if common_params["persist"]:
+        controller = PersistentCalibrator(
+            ref_params=ref_params,
+            test_params=test_params,
+            common_params=common_params,
+            clock=clock,
+        )
+        await check_batch(args)
     else:
         controller = VolatileCalibrator(
-            ref_params=ref_params, test_params=test_params, common_params=common_params
+            ref_params=ref_params,
+            test_params=test_params,
+            common_params=common_params,
+            clock=clock,
         )
+    if args.profile_pipeline:
+        controller.profiler = Profiler()
+    controller.metrics = metrics
     pub.subscribe(on_reading, Event.READING)
     pub.subscribe(on_round, Event.ROUND)
     pub.subscribe(on_summary, Event.SUMMARY)
@@ -240,20 +409,25 @@ async def cli_calib_test(args: Namespace) -> None:
             else:
                 log.error(e)
         raise RuntimeError("Could't continue execution, check errors above")
-    if args.info:
-        log.info("Only displaying info. Stopping here.")
-        return
-    final_zero_point = await controller.calibrate()
+
+
+async def post_calibration(args: Namespace, final_zero_point: float) -> None:
+    global controller
     if args.update:
         await update_zp(controller, final_zero_point)
     else:
         msg = f"Zero Point {final_zero_point:.2f} not saved to {Role.TEST} {controller.phot_info[Role.TEST]['name']}"
         log.info(msg)
         await controller.not_updated(final_zero_point, msg)
-    ref_freqs = [msg["freq"] for msg in controller.unique_samples(Role.REF)]
-    ref_tstamps = [msg["tstamp"] for msg in controller.unique_samples(Role.REF)]
-    tst_freqs = [msg["freq"] for msg in controller.unique_samples(Role.TEST)]
-    tst_tstamps = [msg["tstamp"] for msg in controller.unique_samples(Role.TEST)]
+    if plotting(args):
+        plot_calibration(args, controller)
+
+
+def plot_calibration(args: Namespace, controller: VolatileCalibrator) -> None:
+    ref_freqs = [reading.freq for reading in controller.unique_samples(Role.REF)]
+    ref_tstamps = [reading.tstamp for reading in controller.unique_samples(Role.REF)]
+    tst_freqs = [reading.freq for reading in controller.unique_samples(Role.TEST)]
+    tst_tstamps = [reading.tstamp for reading in controller.unique_samples(Role.TEST)]
     ref_name = controller.phot_info[Role.REF]["name"]
     tst_name = controller.phot_info[Role.TEST]["name"]
     decimals = 2 if statistics.mean(ref_freqs) > 3 else 3
@@ -307,23 +481,73 @@ def add_args(parser: ArgumentParser):
         parents=[
             prs.info(),
             prs.stats(),
+            prs.rob(),
+            prs.conv(),
+            prs.prov(),
             prs.upd(),
             prs.persist(),
             prs.buf(),
+            prs.jdir(),
             prs.author(),
             prs.ref(),
             prs.test(),
+            prs.vclk(),
             prs.no_bat(),
             prs.ploto(),
+            prs.prof(),
+            prs.metr(),
         ],
         help="Calibrate test photometer",
     )
     p.set_defaults(func=cli_calib_test)
+    p = subparser.add_parser(
+        "resume",
+        parents=[
+            prs.jrnl(),
+            prs.upd(),
+            prs.vclk(),
+            prs.no_bat(),
+            prs.ploto(),
+            prs.prof(),
+            prs.metr(),
+        ],
+        help="Resume an interrupted calibration from its journal",
+    )
+    p.set_defaults(func=cli_calib_resume)
+    p = subparser.add_parser(
+        "multi",
+        parents=[
+            prs.info(),
+            prs.stats(),
+            prs.rob(),
+            prs.conv(),
+            prs.prov(),
+            prs.upd(),
+            prs.persist(),
+            prs.buf(),
+            prs.jdir(),
+            prs.author(),
+            prs.ref(),
+            prs.tests(),
+            prs.vclk(),
+            prs.no_bat(),
+            prs.ploto(),
+            prs.prof(),
+            prs.metr(),
+        ],
+        help="Calibrate several test photometers at once against the reference photometer",
+    )
+    p.set_defaults(func=cli_calib_multi)
 
 
 async def cli_main(args: Namespace) -> None:
     sqa_logging(args)
-    await args.func(args)
+    try:
+        async with metrics_exporters(args, metrics):
+            await args.func(args)
+    finally:
+        if getattr(args, "profile_pipeline", False) and controller is not None:
+            log_profile(controller.profiler)
     await engine.dispose()
 
 
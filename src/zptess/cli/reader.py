@@ -19,8 +19,6 @@ from datetime import datetime, timezone
 # Third party imports
 # -------------------
 
-import aiohttp
-
 from lica.sqlalchemy import sqa_logging
 from lica.asyncio.cli import execute
 from lica.asyncio.photometer import Role
@@ -30,11 +28,12 @@ from lica.asyncio.photometer import Role
 # -------------
 
 from .. import __version__
-from ..controller.photometer import Reader
+from ..controller.photometer import Reader, Profiler
 from .util import parser as prs
-from .util.misc import log_phot_info, log_messages, log_and_exit
+from .util.misc import log_phot_info, log_messages, log_and_exit, log_profile
 from ..dao import engine
 from ..mpl import plot
+from ..lazy import lazy_import
 
 # ----------------
 # Module constants
@@ -49,6 +48,8 @@ DESCRIPTION = "TESS-W Reader tool"
 # get the module logger
 log = logging.getLogger(__name__.split(".")[-1])
 controller = None
+# Only loaded when the test photometer info is read through HTTP
+aiohttp = lazy_import("aiohttp")
 
 # ------------------
 # Auxiliar functions
@@ -78,6 +79,8 @@ async def cli_read_ref(args: Namespace) -> None:
     controller = Reader(
         ref_params=ref_params,
     )
+    if args.profile_pipeline:
+        controller.profiler = Profiler()
     try:
         await controller.init()
         await log_phot_info(controller, Role.REF)
@@ -117,6 +120,8 @@ async def cli_read_test(args: Namespace) -> None:
     controller = Reader(
         test_params=test_params,
     )
+    if args.profile_pipeline:
+        controller.profiler = Profiler()
     try:
         await controller.init()
         await log_phot_info(controller, Role.TEST)
@@ -164,6 +169,8 @@ async def cli_read_both(args: Namespace) -> None:
         ref_params=ref_params,
         test_params=test_params,
     )
+    if args.profile_pipeline:
+        controller.profiler = Profiler()
     try:
         await controller.init()
         async with asyncio.TaskGroup() as tg:
@@ -233,19 +240,27 @@ def add_args(parser: ArgumentParser):
     subparser = parser.add_subparsers(dest="command", required=True)
     p = subparser.add_parser(
         "ref",
-        parents=[prs.info(), prs.nmsg(), prs.ref(), prs.ploto(), prs.tag()],
+        parents=[prs.info(), prs.nmsg(), prs.ref(), prs.ploto(), prs.tag(), prs.prof()],
         help="Read reference photometer",
     )
     p.set_defaults(func=cli_read_ref)
     p = subparser.add_parser(
         "test",
-        parents=[prs.info(), prs.nmsg(), prs.test(), prs.ploto(), prs.tag()],
+        parents=[prs.info(), prs.nmsg(), prs.test(), prs.ploto(), prs.tag(), prs.prof()],
         help="Read test photometer",
     )
     p.set_defaults(func=cli_read_test)
     p = subparser.add_parser(
         "both",
-        parents=[prs.info(), prs.nmsg(), prs.ref(), prs.test(), prs.ploto(), prs.tag()],
+        parents=[
+            prs.info(),
+            prs.nmsg(),
+            prs.ref(),
+            prs.test(),
+            prs.ploto(),
+            prs.tag(),
+            prs.prof(),
+        ],
         help="read both photometers",
     )
     p.set_defaults(func=cli_read_both)
@@ -253,7 +268,11 @@ def add_args(parser: ArgumentParser):
 
 async def cli_main(args: Namespace) -> None:
     sqa_logging(args)
-    await args.func(args)
+    try:
+        await args.func(args)
+    finally:
+        if args.profile_pipeline and controller is not None:
+            log_profile(controller.profiler)
     await engine.dispose()
 
 
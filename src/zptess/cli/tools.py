@@ -8,6 +8,7 @@
 # System wide imports
 # -------------------
 
+import sys
 import asyncio
 import logging
 from datetime import datetime
@@ -26,8 +27,15 @@ from lica.asyncio.cli import execute
 
 from .. import __version__
 from .util import parser as prs
+from .util.misc import export_zip
 from ..dao import engine
 from ..controller.exporter import Controller as Exporter
+from ..controller.recalibrator import Controller as Recalibrator
+from ..controller.benchmark import Controller as Benchmark
+from ..controller.ringbench import Controller as RingBenchmark, TOLERANCE
+from ..controller.readingbench import Controller as ReadingBenchmark
+from ..controller import importtime
+from ..controller.photometer import RingType
 
 
 # ----------------
@@ -77,16 +85,11 @@ async def cli_session_export(args: Namespace) -> None:
         begin_tstamp=args.session,
         end_tstamp=args.session,
         filename_prefix="session",
+        fmt=args.format,
     )
     N = await exporter.query_nsummaries()
     if N > 0:
-        summaries = await exporter.query_summaries()
-        await asyncio.to_thread(exporter.export_summaries, summaries)
-        rounds = await exporter.query_rounds()
-        await asyncio.to_thread(exporter.export_rounds, rounds)
-        samples = await exporter.query_samples()
-        await asyncio.to_thread(exporter.export_samples, samples)
-        zip_file_path = await asyncio.to_thread(exporter.pack)
+        zip_file_path = await export_zip(exporter, args)
         log.info("zipped file in  %s", zip_file_path)
     else:
         log.warn("No calibration session found for %s", args.session)
@@ -101,6 +104,7 @@ async def cli_session_count(args: Namespace) -> None:
         begin_tstamp=args.since,
         end_tstamp=args.until,
         filename_prefix="count",
+        fmt=args.format,
     )
     N = await exporter.query_nsummaries(mode=args.mode)
     log.info("%d calibrations made between %s and %s", N, args.since, args.until)
@@ -113,20 +117,177 @@ async def cli_session_count(args: Namespace) -> None:
     return
 
 
+async def cli_session_recalibrate(args: Namespace) -> None:
+    args.since = args.since or this_year(args.since)
+    args.until = args.until or next_year(args.until)
+    common_params = {
+        "buffer": args.buffer,
+        "ring": args.ring,
+        "central": args.central,
+        "robust": args.robust,
+        "kappa": args.kappa,
+        "trim": args.trim,
+        "period": args.period,
+        "zp_fict": args.zp_fict,
+        "zp_offset": args.zp_offset,
+        "rounds": args.rounds,
+    }
+    recalibrator = Recalibrator(
+        base_dir=args.output_dir,
+        filename_prefix=f"{args.since.strftime('%Y%m%d')}_{args.until.strftime('%Y%m%d')}",
+        begin_tstamp=args.since,
+        end_tstamp=args.until,
+        common_params=common_params,
+        workers=args.workers,
+        chunk_size=args.chunk,
+    )
+    sessions = await recalibrator.query_sessions()
+    log.info("%d calibrations made between %s and %s", len(sessions), args.since, args.until)
+    if not sessions:
+        return
+    rows = await recalibrator.recalibrate(sessions)
+    failed = sum(1 for row in rows if row[-1] is not None)
+    if failed:
+        log.warn("%d sessions could not be recalibrated", failed)
+    csv_path = await asyncio.to_thread(recalibrator.export, rows)
+    log.info("comparison written to %s", csv_path)
+
+
+async def cli_session_benchmark(args: Namespace) -> None:
+    args.since = args.since or this_year(args.since)
+    args.until = args.until or next_year(args.until)
+    benchmark = Benchmark(begin_tstamp=args.since, end_tstamp=args.until, repeat=args.repeat)
+    sessions = await benchmark.query_sessions()
+    log.info("%d calibrations made between %s and %s", len(sessions), args.since, args.until)
+    if not sessions:
+        return
+    result = await asyncio.to_thread(benchmark.run, sessions)
+    for name, timing in result["timings"].items():
+        log.info("%-14s: %.1f \u00b5s per session", name, timing * 1e6)
+        mismatches = result["mismatches"].get(name)
+        if mismatches:
+            log.error("%-14s: differs from reference in %d sessions", name, mismatches)
+    if not any(result["mismatches"].values()):
+        log.info("Same summary statistics for all %d sessions", result["sessions"])
+
+
+async def cli_ring_benchmark(args: Namespace) -> None:
+    benchmark = RingBenchmark(
+        nsamples=args.samples,
+        capacity=args.buffer,
+        stride=args.stride,
+        central=args.central,
+        robust=args.robust,
+        repeat=args.repeat,
+    )
+    result = await asyncio.to_thread(benchmark.run)
+    log.info("%d readings, %d round statistics", result["samples"], result["rounds"])
+    reference = result["timings"][RingType.DEQUE]
+    for ring_type, timing in result["timings"].items():
+        log.info(
+            "%-7s: %.2f \u00b5s per reading, x%.1f",
+            ring_type,
+            timing * 1e6 / result["samples"],
+            reference / timing,
+        )
+        mismatches = result["mismatches"][ring_type]
+        if mismatches:
+            log.error(
+                "%-7s: differs from deque beyond %g in %d rounds", ring_type, TOLERANCE, mismatches
+            )
+    if not any(result["mismatches"].values()):
+        log.info("Same round statistics within %g for all ring buffers", TOLERANCE)
+
+
+async def cli_reading_benchmark(args: Namespace) -> None:
+    benchmark = ReadingBenchmark(
+        rounds=args.rounds,
+        capacity=args.buffer,
+        stride=args.stride,
+        repeat=args.repeat,
+    )
+    result = await asyncio.to_thread(benchmark.run)
+    log.info("%d readings, %d rounds", result["readings"], result["rounds"])
+    for name, memory in result["memory"].items():
+        log.info(
+            "%-13s: %.0f KiB retained, rounds %.1f ms, memberships %.1f ms",
+            name,
+            memory / 1024,
+            result["snapshots"][name] * 1e3,
+            result["memberships"][name] * 1e3,
+        )
+    counts = set(result["counts"].values())
+    if len(counts) == 1:
+        unique, links = counts.pop()
+        log.info("Same %d unique samples and %d round links for all records", unique, links)
+    else:
+        log.error("Unique samples and round links differ: %s", result["counts"])
+
+
+async def cli_importtime(args: Namespace) -> None:
+    controller = importtime.Controller(
+        modules=args.module or importtime.MODULES, repeat=args.repeat, top=args.top
+    )
+    results = await asyncio.to_thread(controller.run)
+    failed = False
+    for result in results:
+        log.info("%-22s: %.0f ms", result["module"], result["total"] * 1e3)
+        for name, cumulative in result["heaviest"]:
+            log.info("    %-40s %7.1f ms", name, cumulative * 1e3)
+        if result["eager"]:
+            log.warning("%s imports eagerly: %s", result["module"], ", ".join(result["eager"]))
+        if args.budget is not None and result["total"] * 1e3 > args.budget:
+            log.error("%s exceeds the %.0f ms import budget", result["module"], args.budget)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
 def add_args(parser: ArgumentParser):
     subparser = parser.add_subparsers(dest="command", required=True)
     p = subparser.add_parser(
         "single",
-        parents=[prs.sess(), prs.bdir()],
-        help="Export a single calibration session to CSV files",
+        parents=[prs.sess(), prs.bdir(), prs.efmt(), prs.zipo()],
+        help="Export a single calibration session to CSV, Parquet or Arrow files",
     )
     p.set_defaults(func=cli_session_export)
     p = subparser.add_parser(
         "count",
-        parents=[prs.trange(), prs.bdir(), prs.mode(), prs.detailed()],
+        parents=[prs.trange(), prs.bdir(), prs.mode(), prs.detailed(), prs.efmt()],
         help="Count number of calibrations from a given time range",
     )
     p.set_defaults(func=cli_session_count)
+    p = subparser.add_parser(
+        "recalibrate",
+        parents=[prs.trange(), prs.odir(), prs.stats(), prs.rob(), prs.buf(), prs.pool()],
+        help="Recalibrate stored sessions from a given time range and compare zero points",
+    )
+    # Round statistics are vectorised with the NumPy ring buffer
+    p.set_defaults(func=cli_session_recalibrate, ring=RingType.NUMPY)
+    p = subparser.add_parser(
+        "benchmark",
+        parents=[prs.trange(), prs.rept()],
+        help="Compare vectorised and reference summary statistics on stored sessions",
+    )
+    p.set_defaults(func=cli_session_benchmark)
+    p = subparser.add_parser(
+        "ring-benchmark",
+        parents=[prs.ringb(), prs.rept()],
+        help="Compare the ring buffer implementations on the same synthetic readings",
+    )
+    p.set_defaults(func=cli_ring_benchmark, repeat=5)
+    p = subparser.add_parser(
+        "reading-benchmark",
+        parents=[prs.readb(), prs.rept()],
+        help="Compare the Reading record with the former dict based UniqueReading",
+    )
+    p.set_defaults(func=cli_reading_benchmark, repeat=5)
+    p = subparser.add_parser(
+        "importtime",
+        parents=[prs.budget(), prs.rept()],
+        help="Measure the command line entry points import time, best of several runs",
+    )
+    p.set_defaults(func=cli_importtime, repeat=5)
 
 
 async def cli_main(args: Namespace) -> None:
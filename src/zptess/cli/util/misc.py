@@ -16,7 +16,8 @@ import contextlib
 import statistics
 
 from logging import Logger
-from typing import Any
+from argparse import Namespace
+from typing import Any, AsyncIterator
 
 # -------------------
 # Third party imports
@@ -28,7 +29,8 @@ from lica.asyncio.photometer import Role
 # local imports
 # -------------
 
-from ...controller.photometer import Controller
+from ...controller.photometer import Controller, Profiler, Metrics, MetricsServer, MetricsDump
+from ...controller.exporter import Controller as Exporter, COMPRESSION
 
 
 def mag(zp: float, freq_offset: float, freq: float):
@@ -67,6 +69,51 @@ def log_msgs_stats(msgs: list[dict[str, Any], ...], controller: Controller, role
 
 
 
+@contextlib.asynccontextmanager
+async def metrics_exporters(args: Namespace, metrics: Metrics) -> AsyncIterator[None]:
+    """Exports the metrics while running the command, when asked for"""
+    exporters = list()
+    if getattr(args, "metrics_port", None) is not None:
+        exporters.append(MetricsServer(metrics, args.metrics_port))
+    if getattr(args, "metrics_file", None) is not None:
+        exporters.append(MetricsDump(metrics, args.metrics_file, args.metrics_period))
+    for exporter in exporters:
+        await exporter.start()
+    try:
+        yield
+    finally:
+        for exporter in exporters:
+            await exporter.stop()
+
+
+async def export_zip(exporter: Exporter, args: Namespace) -> str:
+    """Exports to the ZIP file straight or through the CSV files, as asked for"""
+    if args.zip_direct:
+        return await exporter.export_zip(COMPRESSION[args.compression or "deflated"])
+    return await exporter.export(COMPRESSION[args.compression or "stored"])
+
+
+def log_profile(profiler: Profiler) -> None:
+    log = logging.getLogger("profile")
+    rows = profiler.report()
+    if not rows:
+        log.info("No readings pipeline latencies recorded")
+        return
+    log.info("-" * 66)
+    log.info("%-5s %-10s %8s %12s %12s %12s", "ROLE", "STAGE", "COUNT", "P50 [ms]", "P99 [ms]", "MAX [ms]")
+    for row in rows:
+        log.info(
+            "%-5s %-10s %8d %12.3f %12.3f %12.3f",
+            row["role"].tag() if row["role"] is not None else "ALL",
+            row["stage"],
+            row["count"],
+            row["p50"] / 1e6,
+            row["p99"] / 1e6,
+            row["max"] / 1e6,
+        )
+    log.info("-" * 66)
+
+
 async def log_phot_info(controller: Controller, role: Role) -> None:
     log = logging.getLogger(role.tag())
     phot_info = await controller.info(role)
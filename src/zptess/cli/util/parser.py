@@ -16,7 +16,7 @@ from argparse import ArgumentParser
 # Third-party library imports
 # ----------------------------
 
-from lica.validators import vdir, vdate
+from lica.validators import vdir, vfile, vdate
 from lica.asyncio.photometer import Model as PhotModel, Sensor
 from zptessdao.constants import CentralTendency, Calibration
 
@@ -25,7 +25,19 @@ from zptessdao.constants import CentralTendency, Calibration
 # local imports
 # -------------
 
-from .validator import vendpoint
+from .validator import (
+    vendpoint,
+    vtrim,
+    vkappa,
+    vperiod,
+    vconverge,
+    vrounds,
+    vprovisional,
+    vprecision,
+)
+from ...controller.photometer.types import RingType, Robust
+from ...controller.exporter import COMPRESSION
+from ...controller.columnar import Format
 
 
 def bdir() -> ArgumentParser:
@@ -76,6 +88,38 @@ def buf() -> ArgumentParser:
         default=None,
         help="Circular buffer size (default %(default)s)",
     )
+    parser.add_argument(
+        "-k",
+        "--ring",
+        type=RingType,
+        default=RingType.SORTED,
+        choices=RingType,
+        help="Circular buffer implementation (default %(default)s)",
+    )
+    return parser
+
+
+def jdir() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-j",
+        "--journal",
+        type=vdir,
+        default=None,
+        metavar="<Dir>",
+        help="Directory for the crash recovery journal (default %(default)s)",
+    )
+    return parser
+
+
+def jrnl() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "journal",
+        type=vfile,
+        metavar="<File>",
+        help="Journal file of the interrupted calibration",
+    )
     return parser
 
 
@@ -99,6 +143,18 @@ def persist() -> ArgumentParser:
         action="store_true",
         help="Store calibration results in database (default %(default)s)",
     )
+    parser.add_argument(
+        "--bulk",
+        default=False,
+        action="store_true",
+        help="Use multi-row INSERTs when storing rounds and samples (default %(default)s)",
+    )
+    parser.add_argument(
+        "--stream",
+        default=False,
+        action="store_true",
+        help="Store each round as soon as it is taken (default %(default)s)",
+    )
     return parser
 
 
@@ -254,6 +310,52 @@ def test() -> ArgumentParser:
     return parser
 
 
+def tests() -> ArgumentParser:
+    """Several test photometers parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-tE",
+        "--test-endpoint",
+        type=vendpoint,
+        nargs="+",
+        required=True,
+        metavar="<test endpoint>",
+        help="Test photometer endpoints, one per test photometer. "
+        "Simulated ones need a unit each, as in sim:json:1:<unit>",
+    )
+    parser.add_argument(
+        "-tM",
+        "--test-model",
+        type=PhotModel,
+        default=None,
+        choices=PhotModel,
+        help="Test photometers model, defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-tS",
+        "--test-sensor",
+        type=Sensor,
+        default=None,
+        choices=Sensor,
+        help="Test photometers sensor, defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-tR",
+        "--test-raw-message",
+        action="store_true",
+        default=False,
+        help="Log raw messages, defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-tT",
+        "--test-strict",
+        action="store_true",
+        default=False,
+        help="Strict samples rejection by timestamp difference, defaults to %(default)s",
+    )
+    return parser
+
+
 def stats() -> ArgumentParser:
     """Statistics parser options"""
     parser = ArgumentParser(add_help=False)
@@ -300,6 +402,137 @@ def stats() -> ArgumentParser:
     return parser
 
 
+def conv() -> ArgumentParser:
+    """Adaptive number of rounds parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--converge",
+        type=vconverge,
+        default=None,
+        metavar="<float>",
+        help="Stop rounds once the best ZP is stable within this tolerance, "
+        "defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--stable",
+        type=vrounds,
+        default=None,
+        metavar="<K>",
+        help="Consecutive stable rounds needed to stop, defaults to 3",
+    )
+    parser.add_argument(
+        "--max-rounds",
+        type=vrounds,
+        default=None,
+        metavar="<N>",
+        help="Maximum number of rounds when not converging, not less than the rounds, "
+        "defaults to twice the rounds",
+    )
+    return parser
+
+
+def prov() -> ArgumentParser:
+    """Provisional statistics parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--provisional",
+        type=vprovisional,
+        default=None,
+        metavar="<N>",
+        help="Provisional statistics while filling buffers from N >= 2 samples on, "
+        "defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--precision",
+        type=vprecision,
+        default=None,
+        metavar="<mag>",
+        help="First round once the provisional ZP standard error is below this "
+        "and the buffers are half filled, "
+        "defaults to 0.005",
+    )
+    return parser
+
+
+def rob() -> ArgumentParser:
+    """Robust central tendency parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--robust",
+        type=Robust,
+        default=None,
+        choices=Robust,
+        help="Outlier rejecting central tendency estimator, instead of --central, "
+        "defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--kappa",
+        type=vkappa,
+        default=None,
+        metavar="<float>",
+        help="Sigma clipping threshold in standard deviations, defaults to 3",
+    )
+    parser.add_argument(
+        "--trim",
+        type=vtrim,
+        default=None,
+        metavar="<fraction>",
+        help="Fraction trimmed at each end for the trimmed mean, defaults to 0.1",
+    )
+    return parser
+
+
+def prof() -> ArgumentParser:
+    """Readings pipeline profiling parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--profile-pipeline",
+        default=False,
+        action="store_true",
+        help="Log the readings pipeline latencies per stage on exit",
+    )
+    return parser
+
+
+def metr() -> ArgumentParser:
+    """Metrics export parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        metavar="<port>",
+        help="Serve Prometheus metrics on http://localhost:<port>/metrics, defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        metavar="<File>",
+        help="Dump the metrics periodically to this JSON file, defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--metrics-period",
+        type=vperiod,
+        default=10,
+        metavar="<sec.>",
+        help="Metrics JSON file dump period, defaults to %(default)s",
+    )
+    return parser
+
+
+def vclk() -> ArgumentParser:
+    """Simulated time parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--virtual-clock",
+        action="store_true",
+        default=False,
+        help="Run on simulated time, with no real waits. Only for sim: photometers",
+    )
+    return parser
+
+
 def no_bat() -> ArgumentParser:
     parser = ArgumentParser(add_help=False)
     parser.add_argument(
@@ -383,6 +616,13 @@ def expor() -> ArgumentParser:
     )
     ex1.add_argument("-l", "--latest", action="store_true", help="latest closed batch")
     ex1.add_argument("-a", "--all", action="store_true", help="all closed batches")
+    ex1.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="only sessions not yet exported, into monthly partitions, "
+        "with every updated summary rather than the latest per photometer",
+    )
     parser.add_argument("-d", "--base-dir", type=vdir, default=".", help="Base dir for the export")
     parser.add_argument("-e", "--email", action="store_true", help="Send results by email")
     parser.add_argument(
@@ -394,6 +634,176 @@ def expor() -> ArgumentParser:
     return parser
 
 
+def efmt() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=Format,
+        choices=Format,
+        default=Format.CSV,
+        help="Export file format, Parquet and Arrow need pyarrow (default %(default)s)",
+    )
+    return parser
+
+
+def zipo() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-z",
+        "--zip-direct",
+        action="store_true",
+        help="Stream the CSV rows straight into the ZIP file, without intermediate CSV files",
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=tuple(COMPRESSION),
+        default=None,
+        help="ZIP file compression, defaults to deflated with --zip-direct, stored otherwise."
+        " Not every unzip tool reads bzip2 or lzma",
+    )
+    return parser
+
+
+def pool() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        metavar="<N>",
+        help="Number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--chunk",
+        type=int,
+        default=8,
+        metavar="<N>",
+        help="Sessions per worker task, defaults to %(default)s",
+    )
+    return parser
+
+
+def rept() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=10,
+        metavar="<N>",
+        help="Benchmark repetitions (default %(default)s)",
+    )
+    return parser
+
+
+def ringb() -> ArgumentParser:
+    """Ring buffers benchmark parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-n",
+        "--samples",
+        type=int,
+        default=20000,
+        metavar="<N>",
+        help="Synthetic readings fed to each ring buffer (default %(default)s)",
+    )
+    parser.add_argument(
+        "-b",
+        "--buffer",
+        type=int,
+        default=75,
+        metavar="<N>",
+        help="Circular buffer size (default %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--stride",
+        type=int,
+        default=5,
+        metavar="<N>",
+        help="Readings between round statistics (default %(default)s)",
+    )
+    parser.add_argument(
+        "-C",
+        "--central",
+        type=CentralTendency,
+        default=CentralTendency.MEDIAN,
+        choices=CentralTendency,
+        help="central tendency estimator (default %(default)s)",
+    )
+    parser.add_argument(
+        "--robust",
+        type=Robust,
+        default=None,
+        choices=Robust,
+        help="Outlier rejecting central tendency estimator, instead of --central",
+    )
+    return parser
+
+
+def readb() -> ArgumentParser:
+    """Reading records benchmark parser options"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-R",
+        "--rounds",
+        type=int,
+        default=10,
+        metavar="<N>",
+        help="Calibration rounds (default %(default)s)",
+    )
+    parser.add_argument(
+        "-b",
+        "--buffer",
+        type=int,
+        default=1000,
+        metavar="<N>",
+        help="Circular buffer size, i.e. samples per round (default %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--stride",
+        type=int,
+        default=250,
+        metavar="<N>",
+        help="Readings between rounds (default %(default)s)",
+    )
+    return parser
+
+
+def budget() -> ArgumentParser:
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-m",
+        "--module",
+        type=str,
+        nargs="+",
+        default=None,
+        metavar="<MODULE>",
+        help="Modules to import, defaults to the command line entry points",
+    )
+    parser.add_argument(
+        "-b",
+        "--budget",
+        type=float,
+        default=None,
+        metavar="<ms>",
+        help="Fails when any module takes longer to import, in milliseconds",
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        type=int,
+        default=10,
+        metavar="<N>",
+        help="Heaviest imports listed per module (default %(default)s)",
+    )
+    return parser
+
+
 def trange() -> ArgumentParser:
     parser = ArgumentParser(add_help=False)
     parser.add_argument(
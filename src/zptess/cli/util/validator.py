@@ -4,6 +4,7 @@ import argparse
 
 from ...constants import SERIAL_PORT_PREFIX, TEST_SERIAL_PORT, TEST_BAUD
 from ...constants import TEST_IP, TEST_TCP_PORT, TEST_UDP_PORT
+from ...controller.photometer.simulator import SIM_UNITS
 
 
 def valid_ip_address(ip: str):
@@ -35,11 +36,15 @@ def vendpoint(
     serial::<baud>
     serial:<serial_port>
     serial:<serial_port>:<baud>
+    sim
+    sim:<json|old>
+    sim:<json|old>:<rate>
+    sim:<json|old>:<rate>:<unit>
 
     """
     parts = [elem.strip() for elem in value.split(":")]
     length = len(parts)
-    if length < 1 or length > 3:
+    if length < 1 or length > (4 if parts[0] == "sim" else 3):
         raise argparse.ArgumentTypeError("Invalid endpoint format {0}".format(value))
     proto = parts[0]
     if proto == "tcp":
@@ -84,6 +89,98 @@ def vendpoint(
             ip = str(default_ip)
             port = parts[2]
         result = proto + ":" + ip + ":" + port
+    elif proto == "sim":
+        fmt = parts[1] if length > 1 and parts[1] != "" else "json"
+        rate = parts[2] if length > 2 and parts[2] != "" else "1"
+        unit = parts[3] if length > 3 and parts[3] != "" else "1"
+        if fmt not in ("json", "old"):
+            raise argparse.ArgumentTypeError("Invalid simulated payload format {0}".format(fmt))
+        try:
+            valid_rate = float(rate) > 0
+        except ValueError:
+            valid_rate = False
+        if not valid_rate:
+            raise argparse.ArgumentTypeError("Invalid simulated reading rate {0}".format(rate))
+        if not (unit.isdigit() and 1 <= int(unit) <= SIM_UNITS):
+            raise argparse.ArgumentTypeError("Invalid simulated photometer unit {0}".format(unit))
+        result = proto + ":" + fmt + ":" + rate + ":" + unit
     else:
         raise argparse.ArgumentTypeError("Invalid endpoint prefix {0}".format(parts[0]))
     return result
+
+
+def vtrim(value: str) -> float:
+    """Fraction trimmed at each end of the samples, in [0, 0.5)"""
+    try:
+        result = float(value)
+    except ValueError:
+        result = -1
+    if not 0 <= result < 0.5:
+        raise argparse.ArgumentTypeError("Invalid trimmed fraction {0}".format(value))
+    return result
+
+
+def vkappa(value: str) -> float:
+    """Sigma clipping threshold in standard deviations, strictly positive"""
+    try:
+        result = float(value)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        raise argparse.ArgumentTypeError("Invalid sigma clipping threshold {0}".format(value))
+    return result
+
+
+def vperiod(value: str) -> float:
+    """Period in seconds, strictly positive"""
+    try:
+        result = float(value)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        raise argparse.ArgumentTypeError("Invalid period {0}".format(value))
+    return result
+
+
+def vconverge(value: str) -> float:
+    """Zero Point convergence tolerance, strictly positive"""
+    try:
+        result = float(value)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        raise argparse.ArgumentTypeError("Invalid convergence tolerance {0}".format(value))
+    return result
+
+
+def vrounds(value: str) -> int:
+    """Number of rounds, at least one"""
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if not result >= 1:
+        raise argparse.ArgumentTypeError("Invalid number of rounds {0}".format(value))
+    return result
+
+
+def vprovisional(value: str) -> int:
+    """Samples needed for provisional statistics, at least two for a standard deviation"""
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if not result >= 2:
+        raise argparse.ArgumentTypeError("Invalid provisional samples {0}".format(value))
+    return result
+
+
+def vprecision(value: str) -> float:
+    """Zero Point standard error in magnitudes, strictly positive"""
+    try:
+        result = float(value)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        raise argparse.ArgumentTypeError("Invalid precision {0}".format(value))
+    return result
@@ -2,15 +2,17 @@
 # Third-party library imports
 # ----------------------------
 
-from sqlalchemy import select
-from zptessdao.asyncio import Config
+import decouple
 
 # --------------
 # local imports
 # -------------
 
 from ..dao import Session
+from .config import ConfigCache
+
+# Process wide, every controller shares the same config properties
+config_cache = ConfigCache(snapshot=decouple.config("CONFIG_SNAPSHOT", default=None))
 
 async def load_config(session: Session, section: str, prop: str) -> str | None:
-    q = select(Config.value).where(Config.section == section, Config.prop == prop)
-    return (await session.scalars(q)).one_or_none()
\ No newline at end of file
+    return await config_cache.get(session, section, prop)
@@ -0,0 +1,218 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+from __future__ import annotations
+
+import time
+import logging
+
+from datetime import datetime
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from sqlalchemy import select
+from lica.asyncio.photometer import Role
+from zptessdao.asyncio import Summary, Round
+from zptessdao.constants import Calibration, CentralTendency
+
+# --------------
+# local imports
+# -------------
+
+from ..dao import Session
+from .photometer import util
+from .photometer import summary
+from ..lazy import lazy_import
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# Only loaded by the batched benchmark
+np = lazy_import("numpy")
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def summary_stats(
+    session: Mapping[str, Any],
+    best: Callable,
+    overlaps: Callable,
+) -> Tuple[Any, ...]:
+    """Summary statistics of a stored session, as the calibrators compute them"""
+    zero_points = [round(zp, 2) for zp in session["zero_points"]]
+    result = [best(zero_points)]
+    for role in (Role.REF, Role.TEST):
+        result.append(best(session["freqs"][role]))
+        result.append(overlaps(session["intervals"][role]))
+    return tuple(result)
+
+
+def session_arrays(sessions: Sequence[Mapping[str, Any]]) -> List[Tuple[Any, ...]]:
+    """
+    Groups the sessions by their number of rounds into 2D arrays, one row per session:
+    indices, zero points and, per role, frequencies and round windows in microseconds
+    """
+    groups = defaultdict(list)
+    for i, item in enumerate(sessions):
+        key = (len(item["zero_points"]),) + tuple(len(item["freqs"][role]) for role in Role)
+        groups[key].append(i)
+    batches = list()
+    for indices in groups.values():
+        batch = [indices, np.round([sessions[i]["zero_points"] for i in indices], 2)]
+        for role in (Role.REF, Role.TEST):
+            batch.append(np.array([sessions[i]["freqs"][role] for i in indices], dtype=np.float64))
+            tstamps = [
+                t for i in indices for interval in sessions[i]["intervals"][role] for t in interval
+            ]
+            batch.append(summary.epoch_us(tstamps).reshape(len(indices), -1, 2))
+        batches.append(tuple(batch))
+    return batches
+
+
+def batched_summary_stats(batches: Sequence[Tuple[Any, ...]]) -> List[Tuple[np.ndarray, ...]]:
+    """Same as summary_stats() for the session arrays, a batch of sessions at a time"""
+    results = list()
+    for _, zero_points, ref_freqs, ref_t, test_freqs, test_t in batches:
+        results.append(
+            (
+                summary.best_rows(zero_points),
+                summary.best_rows(ref_freqs),
+                summary.overlaps_rows(ref_t),
+                summary.best_rows(test_freqs),
+                summary.overlaps_rows(test_t),
+            )
+        )
+    return results
+
+
+def unbatch(batches: Sequence[Tuple[Any, ...]], results: Sequence[Tuple[np.ndarray, ...]]):
+    """Batched results back to the summary_stats() format, in the original session order"""
+    unbatched = dict()
+    for batch, (zero_points, ref_freqs, ref_overlaps, test_freqs, test_overlaps) in zip(
+        batches, results
+    ):
+        columns = (
+            _best_column(*zero_points),
+            _best_column(*ref_freqs),
+            _overlaps_column(ref_overlaps),
+            _best_column(*test_freqs),
+            _overlaps_column(test_overlaps),
+        )
+        for i, result in zip(batch[0], zip(*columns)):
+            unbatched[i] = result
+    return [unbatched[i] for i in sorted(unbatched)]
+
+
+def _overlaps_column(overlaps: np.ndarray) -> List[List[float | None]]:
+    return [[None if np.isnan(T) else float(T) for T in row] for row in overlaps]
+
+
+def _best_column(is_mode: np.ndarray, values: np.ndarray) -> List[Tuple[Any, float]]:
+    return [
+        (CentralTendency.MODE if m else CentralTendency.MEDIAN, float(v))
+        for m, v in zip(is_mode, values)
+    ]
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Controller:
+    """Benchmarks the summary statistics against the recorded calibration sessions"""
+
+    def __init__(self, begin_tstamp: datetime, end_tstamp: datetime, repeat: int = 10):
+        self.begin_tstamp = begin_tstamp
+        self.end_tstamp = end_tstamp
+        self.repeat = repeat
+
+    async def query_sessions(self) -> Sequence[Mapping[str, Any]]:
+        """Rounds of the automatic calibration sessions in the time span, grouped by session"""
+        async with Session() as session:
+            async with session.begin():
+                q = (
+                    select(
+                        Summary.session,
+                        Round.role,
+                        Round.zero_point,
+                        Round.freq,
+                        Round.begin_tstamp,
+                        Round.end_tstamp,
+                    )
+                    .join(Summary, Round.summ_id == Summary.id)
+                    .where(
+                        Summary.session.between(self.begin_tstamp, self.end_tstamp),
+                        Summary.calibration == Calibration.AUTO,
+                    )
+                    .order_by(Summary.session, Round.role, Round.seq)
+                )
+                rows = (await session.execute(q)).all()
+        sessions = defaultdict(
+            lambda: {
+                "zero_points": list(),
+                "freqs": defaultdict(list),
+                "intervals": defaultdict(list),
+            }
+        )
+        for meas_session, role, zero_point, freq, begin_tstamp, end_tstamp in rows:
+            item = sessions[meas_session]
+            if role == Role.TEST:
+                item["zero_points"].append(zero_point)
+            item["freqs"][role].append(freq)
+            item["intervals"][role].append((begin_tstamp, end_tstamp))
+        # Sessions missing results cannot be compared
+        return [
+            item
+            for item in sessions.values()
+            if None not in item["zero_points"]
+            and all(None not in freqs for freqs in item["freqs"].values())
+        ]
+
+    def run(self, sessions: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+        """Checks the implementations give the same results and times them"""
+        implementations = {
+            "reference": lambda: [
+                summary_stats(item, util.best, util.overlaps) for item in sessions
+            ],
+            "session arrays": lambda: session_arrays(sessions),
+        }
+        batches = session_arrays(sessions)
+        expected = implementations["reference"]()
+        mismatches = {
+            "batched": sum(
+                1
+                for a, b in zip(expected, unbatch(batches, batched_summary_stats(batches)))
+                if a != b
+            )
+        }
+        # The batched statistics are timed apart from the arrays they work on
+        implementations["batched"] = lambda: batched_summary_stats(batches)
+        timings = dict()
+        for name, implementation in implementations.items():
+            t0 = time.perf_counter()
+            for _ in range(self.repeat):
+                implementation()
+            timings[name] = (time.perf_counter() - t0) / (self.repeat * max(len(sessions), 1))
+        return {"sessions": len(sessions), "mismatches": mismatches, "timings": timings}
@@ -0,0 +1,180 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import logging
+from enum import StrEnum
+from typing import Any, BinaryIO, Sequence, Tuple
+
+# ----------------
+# Module constants
+# ----------------
+
+
+class Format(StrEnum):
+    CSV = "csv"
+    PARQUET = "parquet"
+    ARROW = "arrow"  # Arrow IPC file format, a.k.a. Feather v2
+
+
+EXTENSION = {
+    Format.CSV: ".csv",
+    Format.PARQUET: ".parquet",
+    Format.ARROW: ".arrow",
+}
+
+# Column name -> type, with the names of the exporter queries
+SUMMARY_COLUMNS = (
+    ("model", "string"),
+    ("name", "string"),
+    ("mac", "string"),
+    ("firmware", "string"),
+    ("sensor", "string"),
+    ("session", "timestamp"),
+    ("calibration", "string"),
+    ("calversion", "string"),
+    ("ref_mag", "float"),
+    ("ref_freq", "float"),
+    ("test_freq", "float"),
+    ("test_mag", "float"),
+    ("mag_diff", "float"),
+    ("raw_zero_point", "float"),
+    ("zp_offset", "float"),
+    ("zero_point", "float"),
+    ("prev_zp", "float"),
+    ("filter", "string"),
+    ("plug", "string"),
+    ("box", "string"),
+    ("collector", "string"),
+    ("author", "string"),
+    ("comment", "string"),
+)
+
+ROUND_COLUMNS = (
+    ("model", "string"),
+    ("name", "string"),
+    ("mac", "string"),
+    ("session", "timestamp"),
+    ("role", "string"),
+    ("round", "int32"),
+    ("freq", "float"),
+    ("stddev", "float"),
+    ("mag", "float"),
+    ("zero_point", "float"),
+    ("nsamples", "int32"),
+    ("duration", "float"),
+)
+
+SAMPLE_COLUMNS = (
+    ("model", "string"),
+    ("name", "string"),
+    ("mac", "string"),
+    ("session", "timestamp"),
+    ("role", "string"),
+    ("round", "int32"),
+    ("tstamp", "timestamp"),
+    ("freq", "float"),
+    ("temp_box", "float"),
+    ("seq", "int64"),
+)
+
+# Parquet codecs. Strings repeat a lot and are dictionary encoded anyway,
+# so a fast codec is enough for them, numbers are better served by zstd
+STRING_CODEC = "snappy"
+NUMBER_CODEC = "zstd"
+# Arrow IPC files only compress the whole record batches
+ARROW_CODEC = "zstd"
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def require_pyarrow() -> Tuple[Any, Any]:
+    """pyarrow is an optional dependency, only imported when exporting to columnar formats"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet and Arrow exports need pyarrow, install zptess[arrow]") from e
+    return pyarrow, pyarrow.parquet
+
+
+def schema(columns: Sequence[Tuple[str, str]]) -> Any:
+    pa, _ = require_pyarrow()
+    types = {
+        "string": pa.string(),
+        "timestamp": pa.timestamp("us", tz="UTC"),  # Naive database timestamps are UTC
+        "float": pa.float64(),
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+# -------
+# Classes
+# -------
+
+
+class TableWriter:
+    """
+    Writes rows of the exporter queries as record batches of a typed schema,
+    either to a Parquet file or to an Arrow IPC file.
+    """
+
+    def __init__(self, sink: str | BinaryIO, columns: Sequence[Tuple[str, str]], fmt: Format):
+        pa, pq = require_pyarrow()
+        self._pa = pa
+        self._columns = columns
+        self.schema = schema(columns)
+        if fmt == Format.PARQUET:
+            strings = [name for name, kind in columns if kind == "string"]
+            self._writer = pq.ParquetWriter(
+                sink,
+                self.schema,
+                use_dictionary=strings,
+                compression={
+                    name: STRING_CODEC if kind == "string" else NUMBER_CODEC
+                    for name, kind in columns
+                },
+            )
+        elif fmt == Format.ARROW:
+            options = pa.ipc.IpcWriteOptions(compression=ARROW_CODEC)
+            self._writer = pa.ipc.new_file(sink, self.schema, options=options)
+        else:
+            raise ValueError(f"Not a columnar format: {fmt}")
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> None:
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        arrays = list()
+        for (_, kind), values, field in zip(self._columns, columns, self.schema):
+            if kind == "string":
+                # Enumerations as written in the CSV files
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_batch(self._pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
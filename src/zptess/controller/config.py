@@ -0,0 +1,159 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import json
+import logging
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from sqlalchemy import select, event
+from zptessdao.asyncio import Config
+
+# --------------
+# local imports
+# -------------
+
+from ..dao import engine, Session
+
+# ----------------
+# Module constants
+# ----------------
+
+# (section, property) -> value
+ConfigMap = Mapping[Tuple[str, str], str | None]
+
+# Sections holding credentials, never written to the snapshot
+SECRET_SECTIONS = ("smtp",)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------
+# Classes
+# -------
+
+
+class ConfigCache:
+    """
+    The whole config table, read in a single query on first use and kept for the process.
+    Any Config row written through the ORM invalidates it.
+    The optional JSON snapshot is reused by later processes
+    as long as the database file has not changed since it was written.
+    The snapshot leaves out the secret sections, which are then queried on first use.
+    """
+
+    def __init__(self, snapshot: str | None = None):
+        self.snapshot = snapshot
+        self._config: ConfigMap | None = None
+        self._secrets = False  # Whether the secret sections are loaded
+        for name in ("after_insert", "after_update", "after_delete"):
+            event.listen(Config, name, self._on_write)
+
+    def invalidate(self) -> None:
+        self._config = None
+
+    async def load(self, session: Session, secrets: bool = False) -> ConfigMap:
+        if self._config is None:
+            config = self._read_snapshot()
+            self._secrets = config is None
+            if config is None:
+                config = await self._query(session)
+                self._write_snapshot(config)
+            self._config = MappingProxyType(config)
+        if secrets and not self._secrets:
+            config = dict(self._config)
+            config.update(await self._query(session, SECRET_SECTIONS))
+            self._config = MappingProxyType(config)
+            self._secrets = True
+        return self._config
+
+    async def get(self, session: Session, section: str, prop: str) -> str | None:
+        config = await self.load(session, secrets=section in SECRET_SECTIONS)
+        return config.get((section, prop))
+
+    async def section(self, session: Session, section: str) -> Dict[str, str | None]:
+        config = await self.load(session, secrets=section in SECRET_SECTIONS)
+        return {p: v for (s, p), v in config.items() if s == section}
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _on_write(self, mapper: Any, connection: Any, target: Config) -> None:
+        log.debug("Config [%s] %s written, cache invalidated", target.section, target.prop)
+        self.invalidate()
+
+    async def _query(
+        self, session: Session, sections: Tuple[str, ...] | None = None
+    ) -> Dict[Tuple[str, str], str | None]:
+        q = select(Config.section, Config.prop, Config.value)
+        if sections is not None:
+            q = q.where(Config.section.in_(sections))
+        rows = (await session.execute(q)).all()
+        log.debug("Loaded %d config properties from the database", len(rows))
+        return {(section, prop): value for section, prop, value in rows}
+
+    def _db_key(self) -> List[List[Any]] | None:
+        """Database files status, the WAL file included, as the snapshot key"""
+        if engine.url.get_backend_name() != "sqlite" or not engine.url.database:
+            return None
+        paths = (engine.url.database, engine.url.database + "-wal")
+        return [
+            [path, st.st_mtime_ns, st.st_size]
+            for path, st in ((path, os.stat(path)) for path in paths if os.path.exists(path))
+        ]
+
+    def _read_snapshot(self) -> Dict[Tuple[str, str], str | None] | None:
+        if self.snapshot is None or not os.path.exists(self.snapshot):
+            return None
+        key = self._db_key()
+        try:
+            with open(self.snapshot) as fd:
+                contents = json.load(fd)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring config snapshot %s: %s", self.snapshot, e)
+            return None
+        if key is None or contents.get("key") != key:
+            return None
+        log.debug("Loaded config properties from snapshot %s", self.snapshot)
+        return {(section, prop): value for section, prop, value in contents["config"]}
+
+    def _write_snapshot(self, config: Dict[Tuple[str, str], str | None]) -> None:
+        key = self._db_key()
+        if self.snapshot is None or key is None:
+            return
+        contents = {
+            "key": key,
+            "config": [
+                [section, prop, value]
+                for (section, prop), value in config.items()
+                if section not in SECRET_SECTIONS
+            ],
+        }
+        tmp_path = self.snapshot + ".tmp"
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)  # Stale, and maybe with looser permissions
+            # Only readable by the owner, whatever the umask
+            flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+            with os.fdopen(os.open(tmp_path, flags, 0o600), "w") as fd:
+                json.dump(contents, fd, indent=2)
+            os.replace(tmp_path, self.snapshot)
+        except OSError as e:
+            log.warning("Config snapshot %s not written: %s", self.snapshot, e)
@@ -11,7 +11,7 @@
 import logging
 
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 # ---------------------------
 # Third-party library imports
@@ -26,6 +26,7 @@ from zptessdao.asyncio import SampleView
 # -------------
 
 from ..dao import Session
+from .photometer.ring import Reading
 from ..constants import FreqSequence, TimeSequence, NameSequence
 
 # -----------------------
@@ -60,3 +61,21 @@ class Controller:
                 samples = (await session.execute(q)).all()
                 log.info("found %d %s samples", len(samples), role)
                 return zip(*samples)
+
+    async def readings(self, session_id: datetime, role: Role) -> list[Reading]:
+        """Unique samples from session, in timestamp order, as ring buffer readings"""
+        async with Session() as session:
+            async with session.begin():
+                q = (
+                    select(SampleView.tstamp, SampleView.freq, SampleView.seq, SampleView.temp_box)
+                    .distinct()
+                    .where(SampleView.session == session_id, SampleView.role == role)
+                    .order_by(SampleView.tstamp)
+                )
+                rows = (await session.execute(q)).all()
+        log.debug("found %d %s samples in session %s", len(rows), role, session_id)
+        # Timestamps are stored as naive UTC datetimes
+        return [
+            Reading(tstamp=tstamp.replace(tzinfo=timezone.utc), freq=freq, seq=seq, tamb=tamb)
+            for tstamp, freq, seq, tamb in rows
+        ]
@@ -8,35 +8,29 @@
 # System wide imports
 # -------------------
 
+import io
 import os
 import csv
 import glob
+import time
+import queue
+import asyncio
 import zipfile
 import logging
 import itertools
 import contextlib
 
-import ssl
-import smtplib
-
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-
-
 from datetime import datetime
-from typing import Sequence, Tuple, Any
+from typing import AsyncIterator, Awaitable, BinaryIO, Iterable, Sequence, TextIO, Tuple, Any
 
 # -------------------
 # Third party imports
 # -------------------
 
-import aiohttp
-from sqlalchemy import select, func, cast, Integer
+from sqlalchemy import Select, select, func, cast, Integer
 
 
-from zptessdao.asyncio import SummaryView, RoundsView, SampleView, Config, Batch
+from zptessdao.asyncio import SummaryView, RoundsView, SampleView, Batch
 from zptessdao.constants import Calibration
 
 # --------------
@@ -44,6 +38,17 @@ from zptessdao.constants import Calibration
 # -------------
 
 from ..dao import Session
+from . import config_cache
+from .columnar import (
+    Format,
+    EXTENSION,
+    TableWriter,
+    require_pyarrow,
+    SUMMARY_COLUMNS,
+    ROUND_COLUMNS,
+    SAMPLE_COLUMNS,
+)
+from ..lazy import lazy_import
 
 
 SUMMARY_EXPORT_HEADERS = (
@@ -87,6 +92,19 @@ ROUND_EXPORT_HEADERS = (
     "\u0394T (s.)",
 )
 
+# Samples fetched from the database at a time when streaming them
+PARTITION_SIZE = 10000
+# Partitions waiting to be written, so that memory stays bounded when the disk lags behind
+PIPE_DEPTH = 4
+
+# ZIP file compression methods by name
+COMPRESSION = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
 SAMPLE_EXPORT_HEADERS = (
     "Model",
     "Name",
@@ -100,6 +118,13 @@ SAMPLE_EXPORT_HEADERS = (
     "Sequence #",
 )
 
+# Exported table -> CSV headers, typed columns
+TABLES = {
+    "summary": (SUMMARY_EXPORT_HEADERS, SUMMARY_COLUMNS),
+    "rounds": (ROUND_EXPORT_HEADERS, ROUND_COLUMNS),
+    "samples": (SAMPLE_EXPORT_HEADERS, SAMPLE_COLUMNS),
+}
+
 # -----------------------
 # Module global variables
 # -----------------------
@@ -107,6 +132,9 @@ SAMPLE_EXPORT_HEADERS = (
 # get the module logger
 log = logging.getLogger(__name__.split(".")[-1])
 
+# Only needed to check the Internet connection before sending emails
+aiohttp = lazy_import("aiohttp")
+
 
 # -------------------
 # Auxiliary functions
@@ -125,6 +153,14 @@ def email_send(
     password: str,
     confidential: bool = False,
 ):
+    # The email stack is only imported when actually sending
+    import ssl
+    import smtplib
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     msg_receivers = receivers
     receivers = receivers.split(sep=",")
     message = MIMEMultipart()
@@ -168,6 +204,32 @@ def email_send(
         server.sendmail(sender, receivers, message.as_string())
 
 
+async def feed(
+    partitions: AsyncIterator[Sequence[Tuple[Any]]],
+    pipe: queue.Queue,
+    writer: asyncio.Task,
+) -> int:
+    """Producer end of a pipe, always closed with a None partition"""
+    nrows = 0
+    try:
+        async with contextlib.aclosing(partitions):
+            async for rows in partitions:
+                if writer.done():
+                    break  # Failed, its error is raised by the caller
+                # Blocks while the pipe is full
+                await asyncio.to_thread(pipe.put, rows)
+                nrows += len(rows)
+    finally:
+        await asyncio.to_thread(pipe.put, None)
+    return nrows
+
+
+def drain(pipe: queue.Queue) -> None:
+    """Keeps the producer from blocking on a full pipe once the writer has failed"""
+    while pipe.get() is not None:
+        pass
+
+
 # -----------------
 # Auxiliary classes
 # -----------------
@@ -180,11 +242,18 @@ class Controller:
         filename_prefix: str,
         begin_tstamp: datetime = None,
         end_tstamp: datetime = None,
+        fmt: Format = Format.CSV,
+        latest: bool = True,
     ):
         self.begin_tstamp = begin_tstamp
         self.end_tstamp = end_tstamp
+        # Only the latest summary per photometer in the time span
+        self.latest = latest
         self.base_dir = base_dir if os.path.isabs(base_dir) else os.path.abspath(base_dir)
         self.filename_prefix = filename_prefix
+        self.fmt = fmt
+        if fmt != Format.CSV:
+            require_pyarrow()  # Fails early rather than within the export tasks
 
     # ----------
     # Public API
@@ -239,108 +308,263 @@ class Controller:
                         SummaryView.upd_flag == True,  # noqa: E712
                     ).order_by(cast(func.substr(SummaryView.name, 6), Integer), SummaryView.session)
                 summaries = (await session.execute(q)).all()
-                summaries = self._filter_latest_summary(summaries)
+                if self.latest:
+                    summaries = self._filter_latest_summary(summaries)
         return summaries
 
+    def _rounds_query(self) -> Select:
+        t0 = self.begin_tstamp
+        t1 = self.end_tstamp
+        return (
+            select(
+                RoundsView.model,
+                RoundsView.name,
+                RoundsView.mac,
+                RoundsView.session,
+                RoundsView.role,
+                RoundsView.round,
+                RoundsView.freq,
+                RoundsView.stddev,
+                RoundsView.mag,
+                RoundsView.zero_point,
+                RoundsView.nsamples,
+                RoundsView.duration,
+            )
+            # complicated filter because stars3 always has upd_flag = False
+            .where(
+                RoundsView.session.between(t0, t1)
+                & (
+                    (RoundsView.upd_flag == True)  # noqa: E712
+                    | ((RoundsView.upd_flag == False) & (RoundsView.name == "stars3"))  # noqa: E712
+                )
+            )
+            .order_by(RoundsView.session, RoundsView.round)
+        )
+
     async def query_rounds(self) -> Sequence[Tuple[Any]]:
         async with Session() as session:
             async with session.begin():
-                t0 = self.begin_tstamp
-                t1 = self.end_tstamp
-                q = (
-                    select(
-                        RoundsView.model,
-                        RoundsView.name,
-                        RoundsView.mac,
-                        RoundsView.session,
-                        RoundsView.role,
-                        RoundsView.round,
-                        RoundsView.freq,
-                        RoundsView.stddev,
-                        RoundsView.mag,
-                        RoundsView.zero_point,
-                        RoundsView.nsamples,
-                        RoundsView.duration,
-                    )
-                    # complicated filter because stars3 always has upd_flag = False
-                    .where(
-                        RoundsView.session.between(t0, t1)
-                        & (
-                            (RoundsView.upd_flag == True)  # noqa: E712
-                            | ((RoundsView.upd_flag == False) & (RoundsView.name == "stars3"))  # noqa: E712
-                        )
-                    )
-                    .order_by(RoundsView.session, RoundsView.round)
-                )
-                rounds = (await session.execute(q)).all()
+                rounds = (await session.execute(self._rounds_query())).all()
         return rounds
 
+    def _samples_query(self) -> Select:
+        t0 = self.begin_tstamp
+        t1 = self.end_tstamp
+        return (
+            select(
+                SampleView.model,
+                SampleView.name,
+                SampleView.mac,
+                SampleView.session,
+                SampleView.role,
+                SampleView.round,
+                SampleView.tstamp,
+                SampleView.freq,
+                SampleView.temp_box,
+                SampleView.seq,
+            )
+            # complicated filter because stars3 always has upd_flag = False
+            .where(
+                SampleView.session.between(t0, t1)
+                & (
+                    (SampleView.upd_flag == True)  # noqa: E712
+                    | ((SampleView.upd_flag == False) & (SampleView.name == "stars3"))  # noqa: E712
+                )
+            )
+            .order_by(SampleView.session, SampleView.round, SampleView.tstamp)
+        )
+
     async def query_samples(self) -> Sequence[Tuple[Any]]:
         async with Session() as session:
             async with session.begin():
-                t0 = self.begin_tstamp
-                t1 = self.end_tstamp
-                q = (
-                    select(
-                        SampleView.model,
-                        SampleView.name,
-                        SampleView.mac,
-                        SampleView.session,
-                        SampleView.role,
-                        SampleView.round,
-                        SampleView.tstamp,
-                        SampleView.freq,
-                        SampleView.temp_box,
-                        SampleView.seq,
-                    )
-                    # complicated filter because stars3 always has upd_flag = False
-                    .where(
-                        SampleView.session.between(t0, t1)
-                        & (
-                            (SampleView.upd_flag == True)  # noqa: E712
-                            | ((SampleView.upd_flag == False) & (SampleView.name == "stars3"))  # noqa: E712
-                        )
-                    )
-                    .order_by(SampleView.session, SampleView.round, SampleView.tstamp)
-                )
-                rounds = (await session.execute(q)).all()
+                rounds = (await session.execute(self._samples_query())).all()
         return rounds
 
     def export_summaries(self, summaries: Sequence[Tuple[Any]]) -> None:
-        csv_path = os.path.join(self.base_dir, f"summary_{self.filename_prefix}.csv")
-        log.info("exporting %s", os.path.basename(csv_path))
-        with open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=";")
-            csv_writer.writerow(SUMMARY_EXPORT_HEADERS)
-            for summary in summaries:
-                csv_writer.writerow(summary)
+        self._export("summary", summaries)
 
     def export_rounds(self, rounds: Sequence[Tuple[Any]]) -> None:
-        csv_path = os.path.join(self.base_dir, f"rounds_{self.filename_prefix}.csv")
-        log.info("exporting %s", os.path.basename(csv_path))
-        with open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=";")
-            csv_writer.writerow(ROUND_EXPORT_HEADERS)
-            for round_ in rounds:
-                csv_writer.writerow(round_)
+        self._export("rounds", rounds)
 
     def export_samples(self, samples: Sequence[Tuple[Any]]) -> None:
-        csv_path = os.path.join(self.base_dir, f"samples_{self.filename_prefix}.csv")
-        log.info("exporting %s", os.path.basename(csv_path))
-        with open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=";")
-            csv_writer.writerow(SAMPLE_EXPORT_HEADERS)
-            for sample in samples:
-                csv_writer.writerow(sample)
+        self._export("samples", samples)
+
+    async def stream_rounds(self, partition: int = PARTITION_SIZE) -> str:
+        """Same as export_rounds(await query_rounds()), streamed as stream_samples()"""
+        return await self._stream(self._rounds_query(), "rounds", partition)
+
+    async def stream_samples(self, partition: int = PARTITION_SIZE) -> str:
+        """
+        Same as export_samples(await query_samples()) but the samples are streamed from
+        the database in partitions, written by a worker thread as they arrive,
+        so that memory stays flat whatever the time span. Returns the file path.
+        """
+        return await self._stream(self._samples_query(), "samples", partition)
+
+    async def export(self, compression: int = zipfile.ZIP_STORED) -> str:
+        """
+        Summaries, rounds and samples exported concurrently, each query on its own
+        pooled connection and each CSV file written by its own worker thread.
+        CSV files are added to the ZIP file as they are completed. Returns the ZIP file path.
+        """
+        zip_path = self._zip_path()
+        log.info("Creating ZIP File: '%s'", zip_path)
+        lock = asyncio.Lock()  # ZipFile objects are not thread safe
+
+        async def export_and_pack(export: Awaitable[str]) -> None:
+            csv_path = await export
+            async with lock:
+                await asyncio.to_thread(zip_file.write, csv_path, self._arcname(csv_path))
+
+        with zipfile.ZipFile(zip_path, "w", compression=compression) as zip_file:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(export_and_pack(self._export_summaries()))
+                tg.create_task(export_and_pack(self.stream_rounds()))
+                tg.create_task(export_and_pack(self.stream_samples()))
+        return zip_path
+
+    async def export_zip(
+        self, compression: int = zipfile.ZIP_DEFLATED, partition: int = PARTITION_SIZE
+    ) -> str:
+        """
+        Same as export() but the rows are streamed straight into compressed ZIP members,
+        without intermediate files. The queries still run concurrently but a ZIP file
+        is written one member at a time, so a single worker thread writes them in turn
+        while the other queries wait on their pipes. Returns the ZIP file path.
+        """
+        zip_path = self._zip_path()
+        log.info("Creating ZIP File: '%s'", zip_path)
+        members = ("summary", "rounds", "samples")
+        pipes = [queue.Queue(maxsize=PIPE_DEPTH) for _ in members]
+        writer = asyncio.create_task(
+            asyncio.to_thread(self._write_zip, zip_path, compression, members, pipes)
+        )
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for kind, pipe in zip(members, pipes):
+                    tg.create_task(feed(self.partitions(kind, partition), pipe, writer))
+        finally:
+            await writer
+        return zip_path
+
+    def partitions(
+        self, kind: str, partition: int = PARTITION_SIZE
+    ) -> AsyncIterator[Sequence[Tuple[Any]]]:
+        """Rows of the summary, rounds or samples table, a partition at a time"""
+        if kind == "summary":
+            return self._summary_partitions()
+        q = self._rounds_query() if kind == "rounds" else self._samples_query()
+        return self._partitions(q, partition)
+
+    def _path(self, kind: str) -> str:
+        return os.path.join(self.base_dir, f"{kind}_{self.filename_prefix}{EXTENSION[self.fmt]}")
+
+    def _zip_path(self) -> str:
+        return os.path.join(os.path.dirname(self.base_dir), self.filename_prefix + ".zip")
+
+    def _arcname(self, path: str) -> str:
+        """Path inside the ZIP file, the same as pack() gives"""
+        return os.path.join(os.path.basename(self.base_dir), os.path.basename(path))
+
+    async def _export_summaries(self) -> str:
+        # Few rows, but the latest summary per photometer needs them all
+        summaries = await self.query_summaries()
+        await asyncio.to_thread(self.export_summaries, summaries)
+        return self._path("summary")
+
+    async def _summary_partitions(self) -> AsyncIterator[Sequence[Tuple[Any]]]:
+        yield await self.query_summaries()
+
+    async def _partitions(self, q: Select, partition: int) -> AsyncIterator[Sequence[Tuple[Any]]]:
+        async with Session() as session:
+            async with session.begin():
+                result = await session.stream(q.execution_options(yield_per=partition))
+                async for rows in result.partitions():
+                    yield rows
+
+    async def _stream(self, q: Select, kind: str, partition: int) -> str:
+        path = self._path(kind)
+        log.info("exporting %s", os.path.basename(path))
+        pipe = queue.Queue(maxsize=PIPE_DEPTH)
+        writer = asyncio.create_task(asyncio.to_thread(self._write_partitions, path, kind, pipe))
+        try:
+            nrows = await feed(self._partitions(q, partition), pipe, writer)
+        finally:
+            await writer
+        log.info("exported %d rows to %s", nrows, os.path.basename(path))
+        return path
+
+    def _export(self, kind: str, rows: Sequence[Tuple[Any]]) -> None:
+        path = self._path(kind)
+        log.info("exporting %s", os.path.basename(path))
+        with self._open(path) as sink:
+            self._write_rows(sink, kind, [rows])
+
+    def _open(self, path: str) -> TextIO | BinaryIO:
+        return open(path, "w") if self.fmt == Format.CSV else open(path, "wb")
+
+    def _write_partitions(self, path: str, kind: str, pipe: queue.Queue) -> None:
+        """Writer end of the pipe, until a None partition is received"""
+        pending = [pipe]
+        try:
+            with self._open(path) as sink:
+                self._write_rows(sink, kind, iter(pipe.get, None))
+                pending.remove(pipe)
+        except Exception:
+            for pipe in pending:
+                drain(pipe)
+            raise
+
+    def _write_zip(
+        self,
+        zip_path: str,
+        compression: int,
+        members: Sequence[str],
+        pipes: Sequence[queue.Queue],
+    ) -> None:
+        """Writer end of the pipes, one ZIP member per pipe"""
+        pending = list(pipes)
+        try:
+            with zipfile.ZipFile(zip_path, "w", compression=compression) as zip_file:
+                for kind, pipe in zip(members, pipes):
+                    arcname = self._arcname(self._path(kind))
+                    log.info("exporting %s", arcname)
+                    # Dated as the files pack() zips
+                    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                    zinfo.compress_type = compression
+                    zinfo.external_attr = 0o644 << 16
+                    # Size unknown beforehand, samples may well exceed the 2 GiB limit
+                    member = zip_file.open(zinfo, "w", force_zip64=True)
+                    with io.TextIOWrapper(member) if self.fmt == Format.CSV else member as sink:
+                        self._write_rows(sink, kind, iter(pipe.get, None))
+                        pending.remove(pipe)  # Its None partition already taken
+        except Exception:
+            for pipe in pending:
+                drain(pipe)
+            raise
+
+    def _write_rows(
+        self, sink: TextIO | BinaryIO, kind: str, partitions: Iterable[Sequence[Tuple[Any]]]
+    ) -> None:
+        headers, columns = TABLES[kind]
+        if self.fmt == Format.CSV:
+            csv_writer = csv.writer(sink, delimiter=";")
+            csv_writer.writerow(headers)
+            for rows in partitions:
+                csv_writer.writerows(rows)
+        else:
+            with TableWriter(sink, columns, self.fmt) as table_writer:
+                for rows in partitions:
+                    table_writer.write(rows)
 
     def pack(self) -> str:
         """Pack all files in the ZIP file given by options"""
         parent_dir = os.path.dirname(self.base_dir)
-        zip_file = os.path.join(parent_dir, self.filename_prefix + ".zip")
+        zip_file = self._zip_path()
         log.info("Creating ZIP File: '%s'", zip_file)
         file_paths = [
             os.path.join(os.path.basename(self.base_dir), fname)
-            for fname in glob.glob("*.csv", root_dir=self.base_dir)
+            for fname in glob.glob("*" + EXTENSION[self.fmt], root_dir=self.base_dir)
         ]
         with contextlib.chdir(parent_dir):
             with zipfile.ZipFile(zip_file, "w") as myzip:
@@ -365,14 +589,11 @@ class Controller:
         # Read email configuration
         smtp_keys = set(("host", "port", "sender", "password", "receivers"))
         async with Session() as session:
-            async with session.begin():
-                q = select(Config).where(Config.section == "smtp").order_by(Config.prop)
-                configs = (await session.scalars(q)).all()
-        properties = set(cfg.prop for cfg in configs)
+            self.mail_cfg = await config_cache.section(session, "smtp")
+        properties = set(self.mail_cfg)
         if properties != smtp_keys:
             missing = smtp_keys - properties
             raise Exception("Missing properies in the database: %s", missing)
-        self.mail_cfg = dict(map(lambda cfg: (cfg.prop, cfg.value), configs))
         self.mail_cfg["port"] = int(self.mail_cfg["port"])
 
     def send_email(self, zip_file_path: str) -> bool:
@@ -0,0 +1,108 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import re
+import sys
+import logging
+import subprocess
+from typing import Any, Dict, List, Sequence, Tuple
+
+# ----------------
+# Module constants
+# ----------------
+
+# Command line entry points, whose startup time is measured by default
+MODULES = (
+    "zptess.cli.reader",
+    "zptess.cli.multi",
+    "zptess.cli.calibrate",
+    "zptess.cli.writer",
+    "zptess.cli.batch",
+    "zptess.cli.tools",
+    "zptess.cli.plot",
+)
+
+# Heavy dependencies that must only be imported when actually used
+LAZY_MODULES = ("matplotlib", "aiohttp", "numpy", "smtplib", "email.mime")
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)\s*$")
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def importtime(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Imports the module in a fresh interpreter with -X importtime.
+    Returns (package, self µs, cumulative µs) of every module loaded.
+    Only modules actually executed are listed, lazy ones show up when first used.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = list()
+    for line in proc.stderr.splitlines():
+        matchobj = IMPORTTIME_RE.match(line)
+        if matchobj:
+            result.append((matchobj.group(3), int(matchobj.group(1)), int(matchobj.group(2))))
+    return result
+
+
+def loaded(lazy: str, packages: Sequence[str]) -> bool:
+    return any(package == lazy or package.startswith(lazy + ".") for package in packages)
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Controller:
+    """Measures the import time of the command line entry points"""
+
+    def __init__(self, modules: Sequence[str] = MODULES, repeat: int = 5, top: int = 10):
+        self.modules = modules
+        self.repeat = repeat
+        self.top = top
+
+    def measure(self, module: str) -> Dict[str, Any]:
+        """Best of several runs, the others being disturbed by disk caches and the like"""
+        best = None
+        for _ in range(max(self.repeat, 1)):
+            timings = importtime(module)
+            total = next((cumulative for name, _, cumulative in timings if name == module), 0)
+            if best is None or total < best[0]:
+                best = (total, timings)
+        total, timings = best
+        return {
+            "module": module,
+            "total": total / 1e6,
+            "heaviest": [
+                (name, cumulative / 1e6)
+                for name, _, cumulative in sorted(timings, key=lambda t: t[2], reverse=True)
+                if name != module
+            ][: self.top],
+            "eager": [name for name in LAZY_MODULES if loaded(name, [t[0] for t in timings])],
+        }
+
+    def run(self) -> List[Dict[str, Any]]:
+        return [self.measure(module) for module in self.modules]
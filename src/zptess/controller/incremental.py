@@ -0,0 +1,244 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import csv
+import glob
+import json
+import queue
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping, Sequence, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from sqlalchemy import select, func
+from zptessdao.asyncio import Batch
+
+# --------------
+# local imports
+# -------------
+
+from ..dao import Session
+from .columnar import Format, EXTENSION, TableWriter
+from .exporter import (
+    Controller as Exporter,
+    TABLES,
+    PARTITION_SIZE,
+    PIPE_DEPTH,
+    feed,
+    drain,
+)
+
+# ----------------
+# Module constants
+# ----------------
+
+STATE_FILE = "watermark.json"
+
+# Session timestamps are stored with microsecond resolution,
+# the next session after the watermark starts one microsecond later at least
+TICK = timedelta(microseconds=1)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class MonthlyFile:
+    """Rows of a table in a month, appended to a CSV file or written to a new columnar file"""
+
+    def __init__(self, path: str, kind: str, fmt: Format):
+        headers, columns = TABLES[kind]
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if fmt == Format.CSV:
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            self._file = open(path, "a")
+            self._csv_writer = csv.writer(self._file, delimiter=";")
+            if new:
+                self._csv_writer.writerow(headers)
+            self._table_writer = None
+        else:
+            self._file = open(path, "wb")
+            self._table_writer = TableWriter(self._file, columns, fmt)
+
+    def write(self, rows: Sequence[Tuple[Any]]) -> None:
+        if self._table_writer is None:
+            self._csv_writer.writerows(rows)
+        else:
+            self._table_writer.write(rows)
+
+    def close(self) -> None:
+        if self._table_writer is not None:
+            self._table_writer.close()
+        self._file.close()
+
+
+class Controller:
+    """
+    Incremental export of the calibration sessions into monthly partitions,
+    <base dir>/<table>/month=YYYY-MM/. Only sessions newer than the watermark of each
+    table are exported, up to the end of the latest closed batch, so that sessions
+    still being calibrated are left for the next run. New rows are appended to the CSV file
+    of their month or, for the columnar formats, written to a new file per run.
+    The watermarks are kept in a JSON file together with the size of every exported file,
+    which are rolled back at the start of the next run if an export was interrupted.
+    Every updated summary is exported, not only the latest one per photometer as in a full
+    export, as the latest summary in a run depends on how far the previous run went.
+    """
+
+    def __init__(self, base_dir: str, fmt: Format = Format.CSV):
+        self.base_dir = base_dir if os.path.isabs(base_dir) else os.path.abspath(base_dir)
+        self.fmt = fmt
+        self.state_path = os.path.join(self.base_dir, STATE_FILE)
+
+    async def horizon(self) -> datetime | None:
+        """End of the latest closed batch, sessions up to then are complete"""
+        async with Session() as session:
+            async with session.begin():
+                end_tstamp = (await session.scalars(select(func.max(Batch.end_tstamp)))).one()
+        # Sessions are stored as naive UTC timestamps
+        if end_tstamp is not None and end_tstamp.tzinfo is not None:
+            end_tstamp = end_tstamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return end_tstamp
+
+    async def run(self, partition: int = PARTITION_SIZE) -> Dict[str, int]:
+        """Exports the new sessions of every table, returns the number of new rows per table"""
+        state = await asyncio.to_thread(self._load_state)
+        await asyncio.to_thread(self._rollback, state["files"])
+        horizon = await self.horizon()
+        if horizon is None:
+            log.info("No closed batch to export")
+            return dict()
+        run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        tasks = dict()
+        async with asyncio.TaskGroup() as tg:
+            for kind in TABLES:
+                watermark = state["watermarks"].get(kind)
+                watermark = datetime.fromisoformat(watermark) if watermark else None
+                tasks[kind] = tg.create_task(
+                    self._export(kind, watermark, horizon, run_id, partition)
+                )
+        nrows = dict()
+        for kind, task in tasks.items():
+            nrows[kind], files = task.result()
+            # Even with no new rows, as nothing older than the horizon can show up later
+            state["watermarks"][kind] = horizon.isoformat(sep=" ")
+            state["files"].update(files)
+        # Committed only when all the tables are exported
+        await asyncio.to_thread(self._save_state, state)
+        return nrows
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    async def _export(
+        self,
+        kind: str,
+        watermark: datetime | None,
+        horizon: datetime,
+        run_id: str,
+        partition: int,
+    ) -> Tuple[int, Dict[str, int]]:
+        log.info("exporting %s sessions after %s up to %s", kind, watermark, horizon)
+        exporter = Exporter(
+            base_dir=self.base_dir,
+            filename_prefix=run_id,
+            begin_tstamp=watermark + TICK if watermark else datetime.min,
+            end_tstamp=horizon,
+            fmt=self.fmt,
+            latest=False,
+        )
+        pipe = queue.Queue(maxsize=PIPE_DEPTH)
+        writer = asyncio.create_task(asyncio.to_thread(self._append, kind, run_id, pipe))
+        try:
+            await feed(exporter.partitions(kind, partition), pipe, writer)
+        finally:
+            result = await writer
+        return result
+
+    def _append(self, kind: str, run_id: str, pipe: queue.Queue) -> Tuple[int, Dict[str, int]]:
+        """
+        Writer end of the pipe, rows sorted out to their monthly files.
+        Returns the rows written and the size of the files written.
+        """
+        index = [name for name, _ in TABLES[kind][1]].index("session")
+        nrows = 0
+        monthly = dict()
+        try:
+            for rows in iter(pipe.get, None):
+                rows = sorted(rows, key=lambda row: row[index])
+                for month, group in itertools.groupby(
+                    rows, key=lambda row: row[index].strftime("%Y-%m")
+                ):
+                    path = self._month_path(kind, month, run_id)
+                    if path not in monthly:
+                        monthly[path] = MonthlyFile(path, kind, self.fmt)
+                    group = list(group)
+                    monthly[path].write(group)
+                    nrows += len(group)
+        except Exception:
+            drain(pipe)
+            raise
+        finally:
+            for month_file in monthly.values():
+                month_file.close()
+        sizes = {os.path.relpath(path, self.base_dir): os.path.getsize(path) for path in monthly}
+        log.info("exported %d %s rows to %d files", nrows, kind, len(monthly))
+        return nrows, sizes
+
+    def _month_path(self, kind: str, month: str, run_id: str) -> str:
+        directory = os.path.join(self.base_dir, kind, f"month={month}")
+        if self.fmt == Format.CSV:
+            return os.path.join(directory, f"{kind}{EXTENSION[self.fmt]}")
+        return os.path.join(directory, f"{kind}_{run_id}{EXTENSION[self.fmt]}")
+
+    def _load_state(self) -> Dict[str, Any]:
+        if not os.path.exists(self.state_path):
+            return {"format": str(self.fmt), "watermarks": dict(), "files": dict()}
+        with open(self.state_path) as fd:
+            state = json.load(fd)
+        if state["format"] != self.fmt:
+            raise RuntimeError(
+                f"{self.base_dir} holds an incremental {state['format']} export, not {self.fmt}"
+            )
+        return state
+
+    def _save_state(self, state: Mapping[str, Any]) -> None:
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(state, fd, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def _rollback(self, files: Mapping[str, int]) -> None:
+        """Undoes what an interrupted export left behind, as the watermarks were not updated"""
+        pattern = os.path.join(self.base_dir, "*", "month=*", "*" + EXTENSION[self.fmt])
+        for path in glob.glob(pattern):
+            relpath = os.path.relpath(path, self.base_dir)
+            size = files.get(relpath)
+            if size is None:
+                log.warning("Removing %s, left by an interrupted export", relpath)
+                os.remove(path)
+            elif os.path.getsize(path) > size:
+                log.warning("Truncating %s, appended by an interrupted export", relpath)
+                os.truncate(path, size)
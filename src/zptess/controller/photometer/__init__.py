@@ -1,19 +1,61 @@
 # Re-export classes
+# Imported on first use, so that each command only loads the controllers it needs
 
-from .base import Controller
-from .reader import Controller as Reader
-from .writer import Controller as Writer
-from .volatile import Controller as VolatileCalibrator
-from .persistent import Controller as PersistentCalibrator
-from .types import Event, RoundStatistics, RoundStatsType
-
-__all__ = [
-    "Controller",
-    "Reader",
-    "Writer",
-    "VolatileCalibrator",
-    "PersistentCalibrator",
-    "Event",
-    "RoundStatistics",
-    "RoundStatsType",
-]
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .base import Controller
+    from .reader import Controller as Reader
+    from .writer import Controller as Writer
+    from .volatile import Controller as VolatileCalibrator
+    from .persistent import Controller as PersistentCalibrator
+    from .replay import Controller as ReplayCalibrator
+    from .multi import Controller as MultiCalibrator
+    from .types import Event, RoundStatistics, RoundStatsType, RingType, Robust, Stage
+    from .ring import Reading
+    from .journal import Journal
+    from .clock import Clock, VirtualClock
+    from .profiler import Profiler
+    from .metrics import Metrics, MetricsServer, MetricsDump
+
+# Exported name -> (module, name in module)
+EXPORTS = {
+    "Controller": (".base", "Controller"),
+    "Reader": (".reader", "Controller"),
+    "Writer": (".writer", "Controller"),
+    "VolatileCalibrator": (".volatile", "Controller"),
+    "PersistentCalibrator": (".persistent", "Controller"),
+    "ReplayCalibrator": (".replay", "Controller"),
+    "MultiCalibrator": (".multi", "Controller"),
+    "Event": (".types", "Event"),
+    "RoundStatistics": (".types", "RoundStatistics"),
+    "RoundStatsType": (".types", "RoundStatsType"),
+    "RingType": (".types", "RingType"),
+    "Robust": (".types", "Robust"),
+    "Stage": (".types", "Stage"),
+    "Reading": (".ring", "Reading"),
+    "Journal": (".journal", "Journal"),
+    "Clock": (".clock", "Clock"),
+    "VirtualClock": (".clock", "VirtualClock"),
+    "Profiler": (".profiler", "Profiler"),
+    "Metrics": (".metrics", "Metrics"),
+    "MetricsServer": (".metrics", "MetricsServer"),
+    "MetricsDump": (".metrics", "MetricsDump"),
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module, attr = EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value  # Later lookups do not get here
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -28,6 +28,9 @@ from lica.asyncio.photometer import Role, Message as PhotMessage, Model as PhotM
 from .. import load_config
 from ...dao import engine, Session
 from .builder import PhotometerBuilder
+from .clock import Clock
+from .profiler import NullProfiler
+from .metrics import Metrics, DecoderMeter
 
 # ----------------
 # Module constants
@@ -62,13 +65,20 @@ class Controller(ABC):
         self,
         ref_params: Mapping[str, Any] | None = None,
         test_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
     ):
         self.param = {Role.REF: ref_params, Role.TEST: test_params}
+        self.clock = clock or Clock()
         self.roles = list()
         self.photometer = dict()
         self.ring = dict()
         self.phot_info = dict()
         self.phot_task = dict()
+        # Photometers read and metered on our behalf by another controller
+        self.shared = set()
+        self.profiler = NullProfiler()
+        self.metrics = Metrics()
+        self._last_seq = dict()
         if ref_params is not None:
             self.roles.append(Role.REF)
         if test_params is not None:
@@ -88,7 +98,7 @@ class Controller(ABC):
             self.roles,
         )
         # Use engine parameter for the reference photometer when using database info
-        builder = PhotometerBuilder(engine)
+        builder = PhotometerBuilder(engine, self.clock)
         async with Session() as session:
             for role in self.roles:
                 val_db = await load_config(session, SECTION[role], "model")
@@ -103,6 +113,10 @@ class Controller(ABC):
                 val_db = await load_config(session, SECTION[role], "endpoint")
                 val_arg = self.param[role]["endpoint"]
                 self.param[role]["endpoint"] = val_arg if val_arg is not None else val_db
+                if role in self.photometer:
+                    # Already attached, i.e. a photometer shared with other controllers
+                    self.shared.add(role)
+                    continue
                 self.photometer[role] = builder.build(
                     self.param[role]["model"],
                     role,
@@ -110,6 +124,10 @@ class Controller(ABC):
                     self.param[role]["strict"],
                 )
                 logging.getLogger(str(role)).setLevel(self.param[role]["log_level"])
+                self.photometer[role].decoder = DecoderMeter(
+                    self.metrics, role.name.lower(), self.photometer[role].decoder
+                )
+                self.profiler.instrument(role, self.photometer[role])
 
     async def info(self, role: Role) -> Dict[str, Any]:
         log = logging.getLogger(role.tag())
@@ -119,7 +137,7 @@ class Controller(ABC):
             log.error("Failed contacting %s photometer", role.tag())
             raise
         else:
-            phot_info["endpoint"] = role.endpoint()
+            phot_info["endpoint"] = self.param[role]["endpoint"] or role.endpoint()
             phot_info["sensor"] = phot_info["sensor"] or self.param[role]["sensor"].value
             v = phot_info["freq_offset"] or 0.0
             phot_info["freq_offset"] = float(v)
@@ -136,9 +154,12 @@ class Controller(ABC):
         async with self.photometer[role]:
             while i < num_messages:
                 reading = await anext(self.photometer[role].readings)
+                if role not in self.shared:
+                    self._readings_metrics(role, reading)
                 if reading is not None:
                     i += 1
                     yield role, reading
+                    self.profiler.done(role)
 
     async def write_zp(self, zero_point: float) -> float:
         """May raise asyncio.exceptions.TimeoutError in particular"""
@@ -146,6 +167,17 @@ class Controller(ABC):
         stored_zero_point = (await self.photometer[Role.TEST].get_info())["zp"]
         return stored_zero_point
 
+    def _readings_metrics(self, role: Role, message: PhotMessage | None) -> None:
+        """Counts a reading. Messages discarded by the decoder are counted by the decoder meter"""
+        if message is None:
+            return
+        label = role.name.lower()
+        self.metrics.inc("zptess_readings_total", role=label)
+        seq, last = message.get("seq"), self._last_seq.get(role)
+        if seq is not None and last is not None and seq > last + 1:
+            self.metrics.inc("zptess_readings_dropped_total", seq - last - 1, role=label)
+        self._last_seq[role] = seq
+
     @abstractmethod
     async def calibrate(self) -> float:
         """Calibrate the test photometer against the refrence photometer returnoing a Zero Point"""
@@ -8,6 +8,9 @@
 # System wide imports
 # -------------------
 
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 # ---------------------
 # Third party libraries
@@ -17,27 +20,53 @@ from lica.misc import chop
 from lica.asyncio.photometer import Role, Model
 from lica.asyncio.photometer.protocol import UdpProtocol, TcpProtocol, SerialProtocol
 from lica.asyncio.photometer.payload import JsonPayload, OldPayload
-from lica.asyncio.photometer.photinfo import HTMLInfo, DBaseInfo
-from lica.asyncio.photometer.photometer import Photometer
+
+# --------------
+# local imports
+# -------------
+
+from .clock import Clock, VirtualClock
+from .simulator import SimProtocol, SimInfo, SimParams
+from ...lazy import lazy_import
+
+if TYPE_CHECKING:
+    from lica.asyncio.photometer.photometer import Photometer
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# Both import aiohttp, only needed to get the photometer info through HTTP,
+# so they are loaded when the first photometer is built
+lica_photometer = lazy_import("lica.asyncio.photometer.photometer")
+photinfo = lazy_import("lica.asyncio.photometer.photinfo")
 
 
 class PhotometerBuilder:
-    def __init__(self, engine=None):
+    def __init__(self, engine=None, clock: Clock | None = None):
         self._engine = engine
+        self._clock = clock
 
     def build(
         self, model: Model, role: Role, endpoint: str | None = None, strict: bool = False
     ) -> Photometer:
         url = role.endpoint() if endpoint is None else endpoint
-        transport, name, number = chop(url, sep=":")
+        transport, name, number, *unit = chop(url, sep=":")
+        if isinstance(self._clock, VirtualClock) and transport != "sim":
+            raise ValueError(
+                f"{transport} photometers cannot run on a virtual clock, only sim ones"
+            )
+        photometer = lica_photometer.Photometer(role)
+        if transport == "sim":
+            unit = int(unit[0]) if unit else 1
+            return self._build_simulated(photometer, model, role, name, number, unit, strict)
         number = int(number) if number else 80
-        photometer = Photometer(role)
 
         if role == Role.REF:
             assert model is Model.TESSW, "Reference photometer model should be TESS-W"
             assert transport == "serial", "Reference photometer should use a serial transport"
             assert self._engine is not None, "Database engine is needed for the REF photometer"
-            info_obj = DBaseInfo(logger=photometer.log, engine=self._engine)
+            info_obj = photinfo.DBaseInfo(logger=photometer.log, engine=self._engine)
             transport_obj = SerialProtocol(logger=photometer.log, port=name, baudrate=number)
             decoder_obj = OldPayload(logger=photometer.log, strict=strict)
         else:
@@ -50,15 +79,52 @@ class PhotometerBuilder:
                 )
             elif transport == "tcp":
                 assert model is Model.TESSW, "Test photometer using TCP should be a TESS-W model"
-                info_obj = HTMLInfo(logger=photometer.log, addr=name)
+                info_obj = photinfo.HTMLInfo(logger=photometer.log, addr=name)
                 transport_obj = TcpProtocol(logger=photometer.log, host=name, port=number)
                 decoder_obj = OldPayload(logger=photometer.log, strict=strict)
             elif transport == "udp":
                 assert model is Model.TESSW, "Test photometer using UDP should be a TESS-W model"
-                info_obj = HTMLInfo(logger=photometer.log, addr=name)
+                info_obj = photinfo.HTMLInfo(logger=photometer.log, addr=name)
                 transport_obj = UdpProtocol(logger=photometer.log, local_port=number)
                 decoder_obj = JsonPayload(logger=photometer.log, strict=strict)
             else:
                 raise ValueError(f"Transport {transport} not known")
         photometer.attach(transport_obj, info_obj, decoder_obj)
         return photometer
+
+    def _build_simulated(
+        self,
+        photometer: Photometer,
+        model: Model,
+        role: Role,
+        fmt: str,
+        rate: str,
+        unit: int,
+        strict: bool,
+    ) -> Photometer:
+        assert model is Model.TESSW, "Simulated photometers are TESS-W models"
+        params = SimParams.from_env(role)
+        if role == Role.REF:
+            # The reference Zero Point still comes from the database
+            assert self._engine is not None, "Database engine is needed for the REF photometer"
+            info_obj = photinfo.DBaseInfo(logger=photometer.log, engine=self._engine)
+        else:
+            info_obj = SimInfo(logger=photometer.log, params=params, role=role, unit=unit)
+        fmt = fmt or "json"
+        if fmt not in ("json", "old"):
+            raise ValueError(f"Simulated payload format {fmt} not known")
+        transport_obj = SimProtocol(
+            logger=photometer.log,
+            role=role,
+            fmt=fmt,
+            rate=float(rate) if rate else 1.0,
+            params=params,
+            clock=self._clock,
+            unit=unit,
+        )
+        if fmt == "old":
+            decoder_obj = OldPayload(logger=photometer.log, strict=strict)
+        else:
+            decoder_obj = JsonPayload(logger=photometer.log, strict=strict)
+        photometer.attach(transport_obj, info_obj, decoder_obj)
+        return photometer
@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+
+from datetime import datetime, timedelta, timezone
+
+# ----------------
+# Module constants
+# ----------------
+
+# Event loop iterations without new sleepers before the virtual time jumps ahead
+SETTLE_ITERATIONS = 8
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------
+# Classes
+# -------
+
+
+class Clock:
+    """Wall clock. Used by default by the controllers"""
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Simulated clock for replays, simulations and regression runs.
+    Sleeping tasks are woken up in deadline order. Time jumps straight to the
+    next deadline once no other task has gone to sleep for a few event loop
+    iterations, so nobody really waits. Tasks waiting on real I/O do not
+    hold the virtual time back.
+    """
+
+    def __init__(self, start: datetime | None = None, settle: int = SETTLE_ITERATIONS):
+        self._start = start or datetime.now(timezone.utc)
+        self._elapsed = 0.0
+        self._sleepers = list()  # heap of (deadline, arrival order, future)
+        self._order = itertools.count()
+        self._settle = settle
+        self._ticks = 0
+        self._scheduled = False
+
+    def now(self) -> datetime:
+        return self._start + timedelta(seconds=self._elapsed)
+
+    def monotonic(self) -> float:
+        return self._elapsed
+
+    async def sleep(self, seconds: float) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        deadline = self._elapsed + max(seconds, 0.0)
+        heapq.heappush(self._sleepers, (deadline, next(self._order), future))
+        self._ticks = self._settle
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._advance, loop)
+        await future
+
+    def _advance(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._ticks > 0:
+            # Let every runnable task reach its next await first
+            self._ticks -= 1
+            loop.call_soon(self._advance, loop)
+            return
+        while self._sleepers and self._sleepers[0][2].done():
+            heapq.heappop(self._sleepers)  # Cancelled sleepers
+        if not self._sleepers:
+            self._scheduled = False
+            return
+        deadline = self._sleepers[0][0]
+        self._elapsed = max(self._elapsed, deadline)
+        while self._sleepers and self._sleepers[0][0] <= deadline:
+            _, _, future = heapq.heappop(self._sleepers)
+            if not future.done():
+                future.set_result(None)
+        self._ticks = self._settle
+        loop.call_soon(self._advance, loop)
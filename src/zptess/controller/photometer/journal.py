@@ -0,0 +1,219 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import json
+import math
+import struct
+import logging
+from enum import Enum, IntEnum
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Mapping, Tuple
+
+# -------------------
+# Third party imports
+# -------------------
+
+from lica.asyncio.photometer import Role, Model as PhotModel, Sensor
+from zptessdao.constants import CentralTendency
+
+# --------------
+# local imports
+# -------------
+
+from .ring import Reading
+from .types import RingType, Robust
+
+# ----------------
+# Module constants
+# ----------------
+
+MAGIC = b"ZPJ1"
+
+# Magic number and JSON header length
+PREAMBLE = struct.Struct("<4sI")
+
+# Fixed size records: kind, role, timestamp, frequency, sequence number, box temperature.
+# Round records use the sequence number field for the round number.
+RECORD = struct.Struct("<BBddqd")
+
+
+class Record(IntEnum):
+    READING = 1
+    ROUND = 2
+    END = 3
+
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def _enum_value(obj: Any) -> Any:
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def journal_path(directory: str, meas_session: datetime) -> str:
+    return os.path.join(directory, f"zptess-{meas_session.strftime('%Y%m%dT%H%M%S')}.journal")
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Journal:
+    """
+    Append-only binary journal of a calibration session.
+    Every reading entering a ring buffer and every round boundary is recorded
+    as it happens, so that an interrupted session can be replayed and resumed.
+    """
+
+    def __init__(self, path: str, file):
+        self.path = path
+        self._file = file
+
+    # ------------
+    # Writing side
+    # ------------
+
+    @classmethod
+    def create(cls, directory: str, meas_session: datetime, header: Mapping[str, Any]) -> "Journal":
+        path = journal_path(directory, meas_session)
+        header = json.dumps(dict(header, session=meas_session.isoformat()), default=_enum_value)
+        header = header.encode("utf-8")
+        file = open(path, "xb")
+        file.write(PREAMBLE.pack(MAGIC, len(header)))
+        file.write(header)
+        file.flush()
+        os.fsync(file.fileno())
+        log.info("Journaling calibration session to %s", path)
+        return cls(path, file)
+
+    @classmethod
+    def reopen(cls, path: str) -> "Journal":
+        """Opens an existing journal to keep appending records"""
+        offset, nrecords = cls._layout(path)
+        file = open(path, "r+b")
+        # Discard any partially written record left by the interruption
+        file.truncate(offset + nrecords * RECORD.size)
+        file.seek(0, os.SEEK_END)
+        return cls(path, file)
+
+    def reading(self, role: Role, reading: Reading) -> None:
+        tamb = reading.tamb if reading.tamb is not None else math.nan
+        row = RECORD.pack(
+            Record.READING, role, reading.tstamp.timestamp(), reading.freq, reading.seq, tamb
+        )
+        self._file.write(row)
+        self._file.flush()
+
+    def round(self, current: int) -> None:
+        self._file.write(RECORD.pack(Record.ROUND, 0, 0.0, 0.0, current, 0.0))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self, complete: bool = True) -> None:
+        if complete:
+            self._file.write(RECORD.pack(Record.END, 0, 0.0, 0.0, 0, 0.0))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    # ------------
+    # Reading side
+    # ------------
+
+    @staticmethod
+    def header(path: str) -> Dict[str, Any]:
+        with open(path, "rb") as file:
+            magic, length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a calibration journal")
+            return json.loads(file.read(length).decode("utf-8"))
+
+    @staticmethod
+    def session(path: str) -> datetime:
+        return datetime.fromisoformat(Journal.header(path)["session"])
+
+    @staticmethod
+    def params(path: str) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        """Reference, test and common controller parameters used by the journaled session"""
+        header = Journal.header(path)
+        ref_params, test_params, common_params = header["ref"], header["test"], header["common"]
+        for params in (ref_params, test_params):
+            params["model"] = PhotModel(params["model"])
+            params["sensor"] = Sensor(params["sensor"])
+        common_params["central"] = CentralTendency(common_params["central"])
+        common_params["ring"] = RingType(common_params["ring"])
+        if common_params.get("robust") is not None:
+            common_params["robust"] = Robust(common_params["robust"])
+        return ref_params, test_params, common_params
+
+    @classmethod
+    def validate(cls, path: str, mac: str) -> Dict[str, Any]:
+        """
+        Checks that the journal can be resumed by the given test photometer,
+        before anything is done on its behalf. Returns the journal header.
+        """
+        header = cls.header(path)
+        if header["mac"][str(Role.TEST)] != mac:
+            raise RuntimeError(f"Journal {path} does not belong to test photometer {mac}")
+        offset, nrecords = cls._layout(path)
+        if nrecords > 0:
+            with open(path, "rb") as file:
+                file.seek(offset + (nrecords - 1) * RECORD.size)
+                kind = RECORD.unpack(file.read(RECORD.size))[0]
+            if kind == Record.END:
+                raise RuntimeError(f"Journal {path} belongs to a completed calibration")
+        return header
+
+    @classmethod
+    def records(cls, path: str) -> Iterator[Tuple[Record, Role | None, Reading | int | None]]:
+        """
+        Yields (Record.READING, role, reading), (Record.ROUND, None, round number)
+        and (Record.END, None, None) tuples in journal order.
+        """
+        offset, nrecords = cls._layout(path)
+        with open(path, "rb") as file:
+            file.seek(offset)
+            for _ in range(nrecords):
+                kind, role, tstamp, freq, seq, tamb = RECORD.unpack(file.read(RECORD.size))
+                if kind == Record.READING:
+                    reading = Reading(
+                        tstamp=datetime.fromtimestamp(tstamp, timezone.utc),
+                        freq=freq,
+                        seq=seq,
+                        tamb=None if math.isnan(tamb) else tamb,
+                    )
+                    yield Record.READING, Role(role), reading
+                elif kind == Record.ROUND:
+                    yield Record.ROUND, None, seq
+                else:
+                    yield Record.END, None, None
+
+    @staticmethod
+    def _layout(path: str) -> Tuple[int, int]:
+        """Offset of the first record and number of complete records"""
+        with open(path, "rb") as file:
+            magic, length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a calibration journal")
+        offset = PREAMBLE.size + length
+        return offset, (os.path.getsize(path) - offset) // RECORD.size
@@ -0,0 +1,227 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import json
+import math
+import asyncio
+import logging
+import collections
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+# ----------------
+# Module constants
+# ----------------
+
+# Name -> (Prometheus type, help)
+METRICS = {
+    "zptess_readings_total": ("counter", "Readings received"),
+    "zptess_readings_rejected_total": ("counter", "Duplicated readings rejected by the decoder"),
+    "zptess_readings_held_total": (
+        "counter",
+        "Readings held back by the decoder until the next one arrives",
+    ),
+    "zptess_readings_dropped_total": ("counter", "Readings missing in the sequence numbers"),
+    "zptess_decode_errors_total": ("counter", "Payloads the decoder could not parse"),
+    "zptess_rounds_total": ("counter", "Calibration rounds taken"),
+    "zptess_round_duration_seconds": ("summary", "Round samples time window"),
+    "zptess_zero_point": ("gauge", "Zero point of the last round"),
+    "zptess_db_save_duration_seconds": ("summary", "Database writes duration"),
+    "zptess_db_queue_depth": ("gauge", "Events waiting to be written to the database"),
+}
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain"  # Prometheus text exposition format, version 0.0.4
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# -------
+# Classes
+# -------
+
+
+class Metrics:
+    """
+    Counters, gauges and summaries (sum and count) of a calibration bench,
+    each one with optional labels, i.e. the photometer role.
+    Collectors are called right before rendering, for values kept elsewhere.
+    """
+
+    def __init__(self):
+        self._values: Dict[Tuple[str, Labels], float] = collections.defaultdict(float)
+        self._collectors: List[Callable[["Metrics"], None]] = list()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        self._values[name, _labels(labels)] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        self._values[name, _labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        self._values[f"{name}_sum", key] += value
+        self._values[f"{name}_count", key] += 1
+
+    def collector(self, func: Callable[["Metrics"], None]) -> None:
+        self._collectors.append(func)
+
+    def collect(self) -> Dict[Tuple[str, Labels], float]:
+        for func in self._collectors:
+            func(self)
+        return dict(self._values)
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        values = self.collect()
+        lines = list()
+        for name, (kind, text) in METRICS.items():
+            samples = sorted(
+                (key, value)
+                for key, value in values.items()
+                if key[0] == name or key[0] in (f"{name}_sum", f"{name}_count")
+            )
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (sample, labels), value in samples:
+                tags = ",".join(f'{k}="{v}"' for k, v in labels)
+                value = _value(value)
+                lines.append(f"{sample}{{{tags}}} {value}" if tags else f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON friendly values, labels joined as in Prometheus"""
+        values = self.collect()
+        result = collections.defaultdict(dict)
+        for (name, labels), value in sorted(values.items()):
+            result[name][",".join(f"{k}={v}" for k, v in labels)] = value
+        return {"tstamp": datetime.now(timezone.utc).isoformat(), "metrics": dict(result)}
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving the metrics in Prometheus text format"""
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "localhost"):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self) -> None:
+        from aiohttp import web  # Only when serving, it takes long to import
+
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, self._handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Serving metrics on http://%s:%d%s", self.host, self.port, METRICS_PATH)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handler(self, request: Any) -> Any:
+        from aiohttp import web
+
+        return web.Response(text=self.metrics.prometheus(), content_type=CONTENT_TYPE)
+
+
+class DecoderMeter:
+    """
+    Counts why the decoder discarded a message. The decoders release every reading
+    one message late, comparing it with the next one, so a discarded message is
+    either a payload that could not be parsed, a duplicated reading or the first
+    reading, held back as there is nothing to compare it with yet.
+    """
+
+    def __init__(self, metrics: Metrics, label: str, decoder: Any):
+        self._metrics = metrics
+        self._label = label
+        self._decoder = decoder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._decoder, name)
+
+    def decode(self, data: str, tstamp: datetime) -> Dict[str, Any] | None:
+        before = self._previous()
+        message = self._decoder.decode(data=data, tstamp=tstamp)
+        if message is None and data.strip():
+            previous = self._previous()
+            if previous is before:
+                self._metrics.inc("zptess_decode_errors_total", role=self._label)
+            elif before is None:
+                self._metrics.inc("zptess_readings_held_total", role=self._label)
+            else:
+                self._metrics.inc("zptess_readings_rejected_total", role=self._label)
+        return message
+
+    def _previous(self) -> Dict[str, Any] | None:
+        """Reading held by the decoder, if any"""
+        return self._decoder.qprev[0] if self._decoder.qprev else None
+
+
+class MetricsDump:
+    """Periodic dump of the metrics to a JSON file, replaced atomically"""
+
+    def __init__(self, metrics: Metrics, path: str, period: float):
+        self.metrics = metrics
+        self.path = path
+        self.period = period
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._dump_task())
+        log.info("Dumping metrics to %s every %s s.", self.path, self.period)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.dump()  # Final values
+
+    def dump(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(self.metrics.snapshot(), fd, indent=2)
+        os.replace(tmp_path, self.path)
+
+    async def _dump_task(self) -> None:
+        while True:
+            await asyncio.sleep(self.period)
+            self.dump()
+
+
+# ----------------
+# Module functions
+# ----------------
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _value(value: float) -> str:
+    """Prometheus sample value, with no precision lost"""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return "%d" % value if value.is_integer() else repr(value)
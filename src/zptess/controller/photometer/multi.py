@@ -0,0 +1,235 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+from __future__ import annotations
+
+import logging
+import asyncio
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Sequence
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from lica.asyncio.photometer import Role
+
+if TYPE_CHECKING:
+    from lica.asyncio.photometer.photometer import Photometer
+
+# --------------
+# local imports
+# -------------
+
+from .base import Controller as BaseController
+from .volatile import Controller as VolatileCalibrator
+from .persistent import Controller as PersistentCalibrator
+from .clock import Clock
+
+# ----------------
+# Module constants
+# ----------------
+
+ONE_SECOND = timedelta(seconds=1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Tap:
+    """
+    Stands in for a photometer shared by several calibrators.
+    Readings fanned out to the tap are only queued while it is open,
+    as if it were the real device. Once the shared photometer fails,
+    the error is raised to whoever reads from the tap.
+    Samples are unique by (tstamp, role), so every tap shifts the reading
+    timestamps by its own offset for each session to store its own samples.
+    """
+
+    def __init__(self, photometer: Photometer, offset: timedelta = timedelta(0)):
+        self.photometer = photometer
+        self.offset = offset
+        self.role = photometer.role
+        self.log = photometer.log
+        self._queue = asyncio.Queue()
+        self._open = False
+        self._error = None
+
+    def put(self, message: Mapping[str, Any]) -> None:
+        if self._open:
+            if self.offset:
+                message = dict(message, tstamp=message["tstamp"] + self.offset)
+            self._queue.put_nowait(message)
+
+    def fail(self, error: BaseException) -> None:
+        self._error = error
+        self._queue.put_nowait(None)  # Wakes up a pending reader
+
+    async def __aenter__(self) -> "Tap":
+        self._open = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool | None:
+        self._open = False
+        return False
+
+    @property
+    def readings(self) -> "Tap":
+        return self
+
+    def __aiter__(self) -> "Tap":
+        return self
+
+    async def __anext__(self) -> Mapping[str, Any]:
+        if self._error is None:
+            message = await self._queue.get()
+        if self._error is not None:
+            raise RuntimeError(f"Shared {self.role} photometer failed: {self._error}")
+        return message
+
+    async def get_info(self, timeout=5) -> Dict[str, Any]:
+        return await self.photometer.get_info(timeout)
+
+    async def save_zero_point(self, zero_point: float) -> None:
+        raise NotImplementedError("Zero Point of a shared photometer cannot be written")
+
+
+class Controller(BaseController):
+    """
+    Calibrates several test photometers at once against a single reference photometer.
+    Reference readings are fanned out to one calibrator per test photometer,
+    each one with its own calibration session.
+    """
+
+    def __init__(
+        self,
+        ref_params: Mapping[str, Any] | None = None,
+        test_params: Sequence[Mapping[str, Any]] = (),
+        common_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
+    ):
+        super().__init__(ref_params, None, clock)
+        self.test_params = test_params
+        self.common_param = common_params
+        self.calibrators = list()
+        self.taps = list()
+        # Calibration sessions, one per test photometer
+        self.sessions = list()
+
+    # ==========
+    # Public API
+    # ==========
+
+    async def init(self) -> None:
+        await super().init()
+        persist = self.common_param["persist"]
+        factory = PersistentCalibrator if persist else VolatileCalibrator
+        db_lock = asyncio.Lock()
+        for i, test_params in enumerate(self.test_params):
+            calibrator = factory(
+                ref_params=dict(self.param[Role.REF]),
+                test_params=dict(test_params),
+                common_params=self.common_param,
+                clock=self.clock,
+            )
+            # A microsecond is well below the reading timestamps accuracy
+            tap = Tap(self.photometer[Role.REF], offset=i * ONE_MICROSECOND)
+            calibrator.photometer[Role.REF] = tap
+            calibrator.profiler = self.profiler
+            calibrator.metrics = self.metrics
+            await calibrator.init()
+            if persist:
+                calibrator.db_lock = db_lock
+            self.calibrators.append(calibrator)
+            self.taps.append(tap)
+
+    async def info(self, role: Role) -> Dict[str, Any]:
+        phot_info = await super().info(role)
+        for calibrator in self.calibrators:
+            calibrator.phot_info[role] = dict(phot_info)
+        return phot_info
+
+    async def calibrate(self) -> Sequence[float | Exception]:
+        """
+        Calibrate all the Test photometers against the Reference Photometer
+        and return their final Zero Points, in test photometer order.
+        A failed calibration does not stop the others and its exception
+        is returned in place of the Zero Point.
+        """
+        log.info("Calibrating %d test photometers", len(self.calibrators))
+        fanout_task = asyncio.create_task(self._fanout_task())
+        tasks = list()
+        try:
+            for calibrator in self.calibrators:
+                await self._start_session(calibrator)
+                tasks.append(asyncio.create_task(calibrator.calibrate()))
+            gather_task = asyncio.gather(*tasks, return_exceptions=True)
+            # The fan-out task only ever ends by failing
+            await asyncio.wait([gather_task, fanout_task], return_when=asyncio.FIRST_COMPLETED)
+            # The taps have already passed on a reference photometer failure
+            results = await gather_task
+        finally:
+            for task in tasks:
+                task.cancel()
+            fanout_task.cancel()
+            await asyncio.wait(tasks + [fanout_task])
+        if not fanout_task.cancelled() and fanout_task.exception() is not None:
+            log.error("Reading the %s photometer: %s", Role.REF, fanout_task.exception())
+        for calibrator, result in zip(self.calibrators, results):
+            if isinstance(result, Exception):
+                name = calibrator.phot_info[Role.TEST]["name"]
+                log.error("Calibration of %s failed: %s", name, result)
+        return results
+
+    # ===========
+    # Private API
+    # ===========
+
+    async def _start_session(self, calibrator: VolatileCalibrator) -> None:
+        """
+        Summaries are unique by (session, role), so every test photometer needs its own
+        calibration session. Calibrations are started one second apart at most,
+        each session being the actual time its calibration started.
+        """
+        session = self.clock.now().replace(microsecond=0)
+        if self.sessions and session <= self.sessions[-1]:
+            wait = self.sessions[-1] + ONE_SECOND - self.clock.now()
+            await self.clock.sleep(wait.total_seconds())
+            session = self.clock.now().replace(microsecond=0)
+        calibrator.meas_session = session
+        self.sessions.append(session)
+
+    async def _fanout_task(self) -> None:
+        """Reads the reference photometer on behalf of all calibrators"""
+        try:
+            async with self.photometer[Role.REF]:
+                while True:
+                    msg = await anext(self.photometer[Role.REF].readings)
+                    self._readings_metrics(Role.REF, msg)
+                    if msg is not None:
+                        for tap in self.taps:
+                            tap.put(msg)
+        except Exception as e:
+            for tap in self.taps:
+                tap.fail(e)
+            raise
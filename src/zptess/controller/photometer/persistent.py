@@ -9,21 +9,25 @@
 # -------------------
 from __future__ import annotations
 
+import time
 import logging
 import asyncio
+from datetime import datetime
+from operator import attrgetter
 from collections import defaultdict
 
-from typing import Any, Mapping, Dict, List
+from typing import Any, Collection, Mapping, Dict, List, Tuple
 
 
 # ---------------------------
 # Third-party library imports
 # ----------------------------
 
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete
 from pubsub import pub
 from lica.asyncio.photometer import Role
 from zptessdao.asyncio import Photometer, Summary, Round, Sample
+from zptessdao.model import SamplesRounds
 from zptessdao.constants import Calibration
 
 # --------------
@@ -33,7 +37,10 @@ from zptessdao.constants import Calibration
 from ...dao import Session
 from ..batch import get_open_batch
 from .volatile import Controller as VolatileCalibrator
-from .types import Event
+from .types import Event, Stage
+from .ring import Reading
+from .journal import Journal
+from .clock import Clock
 
 from ... import __version__
 
@@ -67,10 +74,17 @@ class Controller(VolatileCalibrator):
         ref_params: Mapping[str, Any] | None = None,
         test_params: Mapping[str, Any] | None = None,
         common_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
     ):
-        super().__init__(ref_params, test_params, common_params)
+        super().__init__(ref_params, test_params, common_params, clock)
         self.db_queue = asyncio.Queue()
         self.batch = None
+        self.summ_ids = dict()
+        self.round_samples = dict()
+        self.prev_sample_ids = dict()
+        self._nsamples = defaultdict(int)
+        # Set when the reference photometer is shared with other calibrators
+        self.db_lock = asyncio.Lock()
 
     # ==========
     # Public API
@@ -80,13 +94,31 @@ class Controller(VolatileCalibrator):
         await super().init()
         async with Session() as session:
             self.batch = await get_open_batch(session)
+        self.bulk = self.common_param["bulk"]
+        self.stream = self.common_param["stream"]
+        # Streamed samples are only kept in memory for plotting afterwards
+        self.keep_samples = self.common_param.get("plot", True)
         self.db_task = asyncio.create_task(self.db_writer_task())
+        self.metrics.collector(
+            lambda metrics: metrics.set("zptess_db_queue_depth", self.db_queue.qsize())
+        )
 
     async def calibrate(self) -> float:
         zp = await super().calibrate()
         await asyncio.wait([self.db_task])
         return zp
 
+    async def resume(self, path: str) -> float:
+        # Nothing is deleted unless the journal can be resumed
+        Journal.validate(path, self.phot_info[Role.TEST]["mac"])
+        self.meas_session = Journal.session(path)
+        if self.stream:
+            # Only streamed sessions store anything before they end
+            await self._purge_session()
+        zp = await super().resume(path)
+        await asyncio.wait([self.db_task])
+        return zp
+
     async def write_zp(self, zero_point: float) -> float:
         """May raise asyncio.exceptions.TimeoutError in particular"""
         stored_zero_point = None
@@ -104,9 +136,13 @@ class Controller(VolatileCalibrator):
                 for db_summary in db_summaries:
                     db_summary.upd_flag = False if db_summary.role == Role.REF else updated
                     if not updated:
-                        db_summary.comment = f"{self.phot_info[Role.TEST]['name']} not updated because of HTTP Timeout"
+                        msg = f"{self.phot_info[Role.TEST]['name']} not updated because of HTTP Timeout"
+                        db_summary.comment = self._comment(db_summary.comment, msg)
         return stored_zero_point
 
+    def nsamples(self, role: Role) -> int:
+        return self._nsamples[role] if self.stream else super().nsamples(role)
+
     async def not_updated(self, zero_point: float, msg: str):
         """What to do when the Zero Point is not updated by the client code"""
         async with Session() as session:
@@ -115,7 +151,7 @@ class Controller(VolatileCalibrator):
                 db_summaries = (await session.scalars(q)).all()
                 for db_summary in db_summaries:
                     db_summary.upd_flag = False
-                    db_summary.comment = msg
+                    db_summary.comment = self._comment(db_summary.comment, msg)
 
     # ===========
     # Private API
@@ -143,6 +179,9 @@ class Controller(VolatileCalibrator):
             "event": Event.ROUND,
             "info": round_info,
         }
+        if self.stream:
+            msg["samples"] = dict(self.round_samples)
+            msg["tstamps"] = {role: self.time_intervals[role][-1] for role in self.roles}
         self.db_queue.put_nowait(msg)
 
     def _on_summary(self, summary_info: Mapping[str, Any]) -> None:
@@ -150,11 +189,26 @@ class Controller(VolatileCalibrator):
         msg = {"event": Event.SUMMARY, "info": summary_info}
         self.db_queue.put_nowait(msg)
 
+    def _on_round_samples(self, role: Role, samples: Collection[Reading]) -> None:
+        if not self.stream:
+            super()._on_round_samples(role, samples)
+            return
+        # Only the current round is kept. Rounds are contiguous windows,
+        # so the samples not in the previous round are the new ones
+        prev_samples = self.round_samples.get(role, ())
+        self._nsamples[role] += sum(1 for sample in samples if sample not in prev_samples)
+        self.round_samples[role] = samples
+        if self.keep_samples:
+            self._unique_samples[role].update(samples)
+
     # ----------------------------------
     # Coroutines to be turned into Tasks
     # ----------------------------------
 
     async def db_writer_task(self) -> None:
+        if self.stream:
+            await self.db_streaming_task()
+            return
         self.db_active = True
         self.temp_round_info = list()
         self.temp_round_samples = list()
@@ -169,17 +223,71 @@ class Controller(VolatileCalibrator):
                 self.temp_summary = msg["info"]
             else:
                 try:
-                    await self._save_all()
+                    t0 = time.monotonic()
+                    t = self.profiler.now()
+                    async with self.db_lock:
+                        await self._save_all()
+                    self.profiler.record(None, Stage.DATABASE, t)
+                    self.metrics.observe("zptess_db_save_duration_seconds", time.monotonic() - t0)
                 except Exception as e:
                     log.error(e)
                     log.critical(
                         "Probably an incomplete manual purge forgot table samples_rounds_t references"
                     )
 
+    async def db_streaming_task(self) -> None:
+        """Writes each calibration event to the database as soon as it arrives"""
+        self.db_active = True
+        while self.db_active:
+            msg = await self.db_queue.get()
+            event = msg["event"]
+            try:
+                t0 = time.monotonic()
+                t = self.profiler.now()
+                async with self.db_lock:
+                    if event == Event.CAL_START:
+                        await self._stream_start()
+                    elif event == Event.ROUND:
+                        await self._stream_round(msg["info"], msg["samples"], msg["tstamps"])
+                    elif event == Event.SUMMARY:
+                        await self._stream_summary(msg["info"])
+                    else:
+                        self.db_active = False
+                self.profiler.record(None, Stage.DATABASE, t)
+                self.metrics.observe("zptess_db_save_duration_seconds", time.monotonic() - t0)
+            except Exception as e:
+                log.error("Streaming %s to database: %s", event, e)
+
     # ----------------------
     # Private helper methods
     # ----------------------
 
+    async def _purge_session(self) -> None:
+        """Deletes whatever a streamed session stored before being interrupted"""
+        async with Session() as session:
+            async with session.begin():
+                q = select(Summary.id).where(Summary.session == self.meas_session)
+                summ_ids = (await session.scalars(q)).all()
+                if not summ_ids:
+                    return
+                round_ids = select(Round.id).where(Round.summ_id.in_(summ_ids))
+                stmt = delete(SamplesRounds).where(SamplesRounds.c.round_id.in_(round_ids))
+                await session.execute(stmt)
+                await session.execute(delete(Sample).where(Sample.summ_id.in_(summ_ids)))
+                await session.execute(delete(Round).where(Round.summ_id.in_(summ_ids)))
+                await session.execute(delete(Summary).where(Summary.id.in_(summ_ids)))
+        log.warning("Discarded partially stored session %s", self.meas_session)
+
+    def _comment(self, comment: str | None, msg: str | None) -> str | None:
+        """Appends to the calibration comment, i.e. the reason to stop the rounds"""
+        if not msg:
+            return comment
+        return f"{comment}. {msg}" if comment else msg
+
+    def _estimator(self) -> str | None:
+        """Robust estimator note, as the rounds central tendency column cannot tell it"""
+        return f"{self.robust} central tendency" if self.robust is not None else None
+
     async def _save_photometers(self, session: Session) -> Dict[Role, Photometer]:
         phot = dict()
         for role in self.roles:
@@ -196,56 +304,88 @@ class Controller(VolatileCalibrator):
                 session.add(phot[role])
         return phot
 
+    def _summary_values(self, role: Role) -> Dict[str, Any]:
+        """Summary columns known before the calibration starts"""
+        return dict(
+            session=self.meas_session,
+            role=role,
+            calibration=Calibration.AUTO,
+            calversion=__version__,
+            author=self.author,
+            zp_offset=self.zp_offset if role == Role.TEST else 0,
+            prev_zp=self.phot_info[role]["zp"] if role == Role.TEST else self.zp_abs,
+        )
+
+    def _summary_results(self, summary_info: Mapping[str, Any], role: Role) -> Dict[str, Any]:
+        """Summary columns only known at the end of the calibration"""
+        return dict(
+            zero_point=summary_info["best_zero_point"] if role == Role.TEST else self.zp_abs,
+            zero_point_method=summary_info["best_zero_point_method"] if role == Role.TEST else None,
+            freq=summary_info["best_freq"][role],
+            freq_method=summary_info["best_freq_method"][role],
+            mag=summary_info["best_mag"][role],
+            nrounds=len(summary_info["zero_point_seq"]),
+            comment=self._comment(summary_info["stop_reason"], self._estimator()),
+        )
+
     def _save_summaries(
         self, session: Session, photometers: Dict[Role, Photometer]
     ) -> Dict[Role, Summary]:
         db_summary = dict()
         for role, phot in photometers.items():
             db_summary[role] = Summary(
-                session=self.meas_session,
-                role=role,
-                calibration=Calibration.AUTO,
-                calversion=__version__,
-                author=self.author,
-                zp_offset=self.zp_offset if role == Role.TEST else 0,
-                prev_zp=self.phot_info[role]["zp"] if role == Role.TEST else self.zp_abs,
-                zero_point=self.temp_summary["best_zero_point"]
-                if role == Role.TEST
-                else self.zp_abs,
-                zero_point_method=self.temp_summary["best_zero_point_method"]
-                if role == Role.TEST
-                else None,
-                freq=self.temp_summary["best_freq"][role],
-                freq_method=self.temp_summary["best_freq_method"][role],
-                mag=self.temp_summary["best_mag"][role],
-                nrounds=self.nrounds,
+                **self._summary_values(role),
+                **self._summary_results(self.temp_summary, role),
                 photometer=phot,  # This is really a many to one relationship
                 batch=self.batch,  # Optional many-to-one relationships (NULLS are allowed)
             )
             session.add(db_summary[role])
         return db_summary
 
+    def _round_values(
+        self,
+        round_info: Mapping[str, Any],
+        role: Role,
+        samples: Collection[Reading],
+        tstamps: Tuple[datetime, datetime],
+    ) -> Dict[str, Any]:
+        return dict(
+            seq=round_info["current"],
+            role=role,
+            freq=round_info["stats"][role][0],
+            stddev=round_info["stats"][role][1],
+            mag=round_info["stats"][role][2],
+            central=self.central,
+            zp_fict=self.zp_fict,
+            zero_point=round_info["zero_point"] if role == Role.TEST else None,
+            nsamples=len(samples),
+            begin_tstamp=tstamps[0],
+            end_tstamp=tstamps[1],
+            duration=(tstamps[1] - tstamps[0]).total_seconds(),
+        )
+
+    def _sample_values(self, sample: Reading, role: Role) -> Dict[str, Any]:
+        return dict(
+            tstamp=sample.tstamp,
+            role=role,
+            seq=sample.seq,
+            freq=sample.freq,
+            temp_box=sample.tamb,
+        )
+
     def _save_rounds(
         self, session: Session, db_summaries: Dict[Role, Summary]
     ) -> Dict[Role, List[Round]]:
         db_rounds = defaultdict(list)
         for i, round_info in enumerate(self.temp_round_info):
             for role, summary in db_summaries.items():
-                samples = self.accum_samples[role][i]
-                tstamps = self.time_intervals[role][i]
                 r = Round(
-                    seq=round_info["current"],
-                    role=role,
-                    freq=round_info["stats"][role][0],
-                    stddev=round_info["stats"][role][1],
-                    mag=round_info["stats"][role][2],
-                    central=self.central,
-                    zp_fict=self.zp_fict,
-                    zero_point=round_info["zero_point"] if role == Role.TEST else None,
-                    nsamples=len(samples),
-                    begin_tstamp=tstamps[0],
-                    end_tstamp=tstamps[1],
-                    duration=(tstamps[1] - tstamps[0]).total_seconds(),
+                    **self._round_values(
+                        round_info,
+                        role,
+                        self.accum_samples[role][i],
+                        self.time_intervals[role][i],
+                    ),
                     summary=summary,  # This is really a 1:N relationship
                 )
                 db_rounds[role].append(r)
@@ -260,38 +400,71 @@ class Controller(VolatileCalibrator):
         db_rounds: Dict[Role, List[Round]],
     ) -> Dict[Role, List[Sample]]:
         db_samples = dict()
-        samples = defaultdict(set)
-        # This double loop accumulate unique samples
-        # dispersed in the rounds
         for role, summary in db_summaries.items():
-            for q in self.accum_samples[role]:
-                samples[role].update(q)
+            samples = sorted(self.unique_samples(role), key=attrgetter("key"))
             db_samples[role] = [
-                Sample(
-                    tstamp=sample["tstamp"],
-                    role=role,
-                    seq=sample["seq"],
-                    freq=sample["freq"],
-                    temp_box=sample["tamb"],
-                    summary=summary,
-                )
-                for sample in samples[role]
+                Sample(**self._sample_values(sample, role), summary=summary) for sample in samples
             ]
             # Adding the database sample objects to the summary
             for s in db_samples[role]:
                 log.debug(s)
                 session.add(s)
-        # Now assign the samples to the corresponding round
-        # The final list of unique samples is tested against the list of round samples
-        # and added to the database round object if so.
-        # A bit tricky (3-level for loop)
-        for role in self.roles:
-            for sample, db_sample in zip(samples[role], db_samples[role]):
-                for i, db_round in enumerate(db_rounds[role]):
-                    if sample in self.accum_samples[role][i]:
-                        db_round.samples.append(db_sample)
+            # Now assign the samples to the corresponding rounds
+            # using the round windows recorded when each round was taken.
+            for i, j in self.round_index[role].memberships(samples):
+                db_rounds[role][j].samples.append(db_samples[role][i])
         return db_samples
 
+    async def _bulk_save_rounds(
+        self, session: Session, db_summaries: Dict[Role, Summary]
+    ) -> Dict[Role, List[int]]:
+        """Multi-row INSERT of all rounds, returning their primary keys in round order"""
+        round_ids = dict()
+        for role, summary in db_summaries.items():
+            rows = [
+                dict(
+                    self._round_values(
+                        round_info,
+                        role,
+                        self.accum_samples[role][i],
+                        self.time_intervals[role][i],
+                    ),
+                    summ_id=summary.id,
+                )
+                for i, round_info in enumerate(self.temp_round_info)
+            ]
+            # RETURNING order is not guaranteed for multi-row INSERTs,
+            # so primary keys are matched back by round number
+            stmt = insert(Round).returning(Round.seq, Round.id)
+            ids = dict((await session.execute(stmt, rows)).tuples().all())
+            round_ids[role] = [ids[row["seq"]] for row in rows]
+        return round_ids
+
+    async def _bulk_save_samples(
+        self,
+        session: Session,
+        db_summaries: Dict[Role, Summary],
+        round_ids: Dict[Role, List[int]],
+    ) -> Dict[Role, List[int]]:
+        """Multi-row INSERT of all samples and their samples_rounds links"""
+        sample_ids = dict()
+        for role, summary in db_summaries.items():
+            samples = sorted(self.unique_samples(role), key=attrgetter("key"))
+            rows = [
+                dict(self._sample_values(sample, role), summ_id=summary.id) for sample in samples
+            ]
+            # Same as above, primary keys are matched back by timestamp.
+            # Timestamps come back from the database as naive UTC datetimes.
+            stmt = insert(Sample).returning(Sample.tstamp, Sample.id)
+            ids = dict((await session.execute(stmt, rows)).tuples().all())
+            sample_ids[role] = [ids[row["tstamp"].replace(tzinfo=None)] for row in rows]
+            links = [
+                {"round_id": round_ids[role][j], "sample_id": sample_ids[role][i]}
+                for i, j in self.round_index[role].memberships(samples)
+            ]
+            await session.execute(insert(SamplesRounds), links)
+        return sample_ids
+
     async def _save_all(self):
         async with Session() as session:
             async with session.begin():
@@ -301,10 +474,89 @@ class Controller(VolatileCalibrator):
                 db_summaries = self._save_summaries(session, db_photometers)
                 log.info("Saving %d summary entries", len(db_summaries))
                 log.debug(db_summaries)
-                db_rounds = self._save_rounds(session, db_summaries)
+                if self.bulk:
+                    await session.flush()  # We need the summary primary keys
+                    db_rounds = await self._bulk_save_rounds(session, db_summaries)
+                else:
+                    db_rounds = self._save_rounds(session, db_summaries)
                 log.info("Saving %d %s round entries", len(db_rounds[Role.REF]), Role.REF)
                 log.info("Saving %d %s round entries", len(db_rounds[Role.TEST]), Role.TEST)
-                db_samples = self._save_samples(session, db_summaries, db_rounds)
+                if self.bulk:
+                    db_samples = await self._bulk_save_samples(session, db_summaries, db_rounds)
+                else:
+                    db_samples = self._save_samples(session, db_summaries, db_rounds)
                 log.info("Saving %d %s sample entries", len(db_samples[Role.REF]), Role.REF)
                 log.info("Saving %d %s sample entries", len(db_samples[Role.TEST]), Role.TEST)
         self.db_active = False
+
+    async def _stream_start(self) -> None:
+        """Photometers and the summaries skeleton, before any round is taken"""
+        async with Session() as session:
+            async with session.begin():
+                db_photometers = await self._save_photometers(session)
+                db_summaries = dict()
+                for role, phot in db_photometers.items():
+                    db_summaries[role] = Summary(
+                        **self._summary_values(role), photometer=phot, batch=self.batch
+                    )
+                    session.add(db_summaries[role])
+                await session.flush()  # We need the summary primary keys
+                self.summ_ids = {role: summary.id for role, summary in db_summaries.items()}
+        log.info("Streaming calibration results to database. Summaries %s", self.summ_ids)
+
+    async def _stream_round(
+        self,
+        round_info: Mapping[str, Any],
+        round_samples: Mapping[Role, Collection[Reading]],
+        round_tstamps: Mapping[Role, Tuple[datetime, datetime]],
+    ) -> None:
+        """Saves a round, its new samples and its samples_rounds links"""
+        async with Session() as session:
+            async with session.begin():
+                for role, summ_id in self.summ_ids.items():
+                    samples = sorted(round_samples[role], key=attrgetter("key"))
+                    values = self._round_values(round_info, role, samples, round_tstamps[role])
+                    stmt = insert(Round).values(**values, summ_id=summ_id).returning(Round.id)
+                    round_id = (await session.execute(stmt)).scalar_one()
+                    # Samples shared with the previous round are already stored
+                    prev_ids = self.prev_sample_ids.get(role, dict())
+                    new_samples = [sample for sample in samples if sample.key not in prev_ids]
+                    ids = dict()
+                    if new_samples:
+                        rows = [
+                            dict(self._sample_values(sample, role), summ_id=summ_id)
+                            for sample in new_samples
+                        ]
+                        # Timestamps come back from the database as naive UTC datetimes.
+                        stmt = insert(Sample).returning(Sample.tstamp, Sample.id)
+                        ids = dict((await session.execute(stmt, rows)).tuples().all())
+                    sample_ids = {
+                        sample.key: prev_ids.get(sample.key)
+                        or ids[sample.tstamp.replace(tzinfo=None)]
+                        for sample in samples
+                    }
+                    links = [
+                        {"round_id": round_id, "sample_id": sample_id}
+                        for sample_id in sample_ids.values()
+                    ]
+                    await session.execute(insert(SamplesRounds), links)
+                    self.prev_sample_ids[role] = sample_ids
+                    log.debug(
+                        "Streamed %s round %d with %d new samples",
+                        role,
+                        round_info["current"],
+                        len(new_samples),
+                    )
+
+    async def _stream_summary(self, summary_info: Mapping[str, Any]) -> None:
+        """Fills in the final results of the summaries created at the start"""
+        async with Session() as session:
+            async with session.begin():
+                for role, summ_id in self.summ_ids.items():
+                    stmt = (
+                        update(Summary)
+                        .where(Summary.id == summ_id)
+                        .values(**self._summary_results(summary_info, role))
+                    )
+                    await session.execute(stmt)
+        self.prev_sample_ids.clear()
@@ -0,0 +1,194 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+from __future__ import annotations
+
+import time
+import collections
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from lica.asyncio.photometer import Role
+
+if TYPE_CHECKING:
+    from lica.asyncio.photometer.photometer import Photometer
+
+# --------------
+# local imports
+# -------------
+
+from .types import Stage
+
+# ----------------
+# Module constants
+# ----------------
+
+# Linear sub-buckets per power of two, i.e. values kept within 1/64 relative precision
+SUB_BITS = 7
+SUB_BUCKETS = 1 << SUB_BITS
+
+PERCENTILES = (50, 99)
+
+# -------
+# Classes
+# -------
+
+
+class Histogram:
+    """
+    HDR style histogram of latencies in nanoseconds.
+    Buckets are powers of two split in linear sub-buckets,
+    so recording a value is constant time and memory does not grow with the samples.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.max = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, value: int) -> None:
+        value = max(value, 0)
+        shift = max(value.bit_length() - SUB_BITS, 0)
+        self.counts[(shift << SUB_BITS) + (value >> shift)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> int:
+        """Highest value of the bucket holding the percentile, never above the maximum"""
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                shift, sub = key >> SUB_BITS, key & (SUB_BUCKETS - 1)
+                return min(((sub + 1) << shift) - 1, self.max)
+        return self.max
+
+
+class Profiler:
+    """
+    Per role and stage latency histograms of the readings pipeline.
+    Transport and decoder are wrapped so that their stages are timed inside
+    the photometer itself. The controllers time the rest of the stages.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[Role | None, Stage], Histogram] = collections.defaultdict(
+            Histogram
+        )
+        # Monotonic time of the bytes that released the last message, per role
+        self.arrival: Dict[Role, int] = dict()
+        # Transports timestamp the arrival with the wall clock
+        self._offset = time.time_ns() - time.monotonic_ns()
+
+    def instrument(self, role: Role, photometer: Photometer) -> None:
+        photometer.transport = TransportProbe(self, role, photometer.transport)
+        photometer.decoder = DecoderProbe(self, role, photometer.decoder)
+
+    def now(self) -> int:
+        return time.monotonic_ns()
+
+    def monotonic(self, tstamp: datetime) -> int:
+        """Wall clock timestamp as monotonic nanoseconds"""
+        return int(tstamp.timestamp() * 1e9) - self._offset
+
+    def record(self, role: Role | None, stage: Stage, t0: int) -> int:
+        """Records the time elapsed since t0 and returns the current time"""
+        t = time.monotonic_ns()
+        self.histograms[role, stage].record(t - t0)
+        return t
+
+    def done(self, role: Role) -> None:
+        """The last reading of the role has been fully handled"""
+        if role in self.arrival:
+            self.record(role, Stage.TOTAL, self.arrival[role])
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Latency percentiles and maximum per role and stage, in nanoseconds"""
+        rows = list()
+        roles = (Role.REF, Role.TEST, None)
+        for role in roles:
+            for stage in Stage:
+                histogram = self.histograms.get((role, stage))
+                if not histogram:
+                    continue
+                row = {"role": role, "stage": stage, "count": len(histogram)}
+                for p in PERCENTILES:
+                    row[f"p{p}"] = histogram.percentile(p)
+                row["max"] = histogram.max
+                rows.append(row)
+        return rows
+
+
+class NullProfiler(Profiler):
+    """Does nothing, so that the pipeline code need not check for a profiler"""
+
+    def instrument(self, role: Role, photometer: Photometer) -> None:
+        pass
+
+    def now(self) -> int:
+        return 0
+
+    def record(self, role: Role | None, stage: Stage, t0: int) -> int:
+        return 0
+
+    def done(self, role: Role) -> None:
+        pass
+
+
+class TransportProbe:
+    """Times the wait between the bytes arrival and the reading task getting them"""
+
+    def __init__(self, profiler: Profiler, role: Role, transport: Any):
+        self._profiler = profiler
+        self._role = role
+        self._transport = transport
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._transport, name)
+
+    def __aiter__(self) -> "TransportProbe":
+        return self
+
+    async def __anext__(self) -> Tuple[datetime, str]:
+        tstamp, message = await anext(self._transport)
+        now = self._profiler.now()
+        arrival = min(self._profiler.monotonic(tstamp), now)
+        self._profiler.arrival[self._role] = arrival
+        self._profiler.record(self._role, Stage.TRANSPORT, arrival)
+        return tstamp, message
+
+
+class DecoderProbe:
+    """Times the decoding and how long the decoder holds a message before releasing it"""
+
+    def __init__(self, profiler: Profiler, role: Role, decoder: Any):
+        self._profiler = profiler
+        self._role = role
+        self._decoder = decoder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._decoder, name)
+
+    def decode(self, data: str, tstamp: datetime) -> Dict[str, Any] | None:
+        t0 = self._profiler.now()
+        message = self._decoder.decode(data=data, tstamp=tstamp)
+        self._profiler.record(self._role, Stage.DECODE, t0)
+        if message is not None:
+            held = self._profiler.monotonic(message["tstamp"])
+            self._profiler.record(self._role, Stage.HOLD, held)
+        return message
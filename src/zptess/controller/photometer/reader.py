@@ -23,6 +23,7 @@ from lica.asyncio.photometer import Role
 # -------------
 
 from .base import Controller as BaseController
+from .clock import Clock
 from .ring import RingBuffer
 
 # ----------------
@@ -56,8 +57,9 @@ class Controller(BaseController):
         self,
         ref_params: Mapping[str, Any] | None = None,
         test_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
     ):
-        super().__init__(ref_params, test_params)
+        super().__init__(ref_params, test_params, clock)
 
     async def calibrate(self) -> float:
         """Calibrate the test photometer against the refrence photometer retirnoing a Zero Point"""
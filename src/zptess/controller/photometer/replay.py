@@ -0,0 +1,226 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import heapq
+import logging
+import statistics
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Mapping, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from sqlalchemy import select
+from lica.asyncio.photometer import Role
+from zptessdao.asyncio import Photometer, Summary, Round
+
+# --------------
+# local imports
+# -------------
+
+from .ring import ring_buffer, Reading
+from .volatile import Controller as VolatileCalibrator, SECTION
+from .clock import Clock
+from .. import load_config
+from ..dbsamples import Controller as Sampler
+from ...dao import Session
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Controller(VolatileCalibrator):
+    """
+    Offline Photometer Calibration Controller.
+    Recalibrates a stored session by feeding its samples through the ring buffers
+    in timestamp order. Time between rounds is measured in sample timestamps,
+    so there is no waiting at all.
+    """
+
+    def __init__(
+        self,
+        session_id: datetime,
+        common_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
+    ):
+        # There are no photometers to talk to, but both roles are present
+        super().__init__(dict(), dict(), common_params, clock)
+        self.meas_session = session_id
+        self.stream = None
+        self.position = 0
+        self._cursor = None  # Replay time, as the newest sample timestamp fed
+        self.schedule = list()
+        self.summary_info = None
+        self.stored_zero_point = None
+        self.stored_zero_point_method = None
+
+    # ==========
+    # Public API
+    # ==========
+
+    async def init(self) -> None:
+        """Default parameters are those of the stored session, not those in the config table"""
+        log.info(
+            "Initializing %s controller for session %s",
+            self.__class__.__name__,
+            self.meas_session,
+        )
+        async with Session() as session:
+            q = (
+                select(Summary, Photometer)
+                .join(Photometer, Photometer.id == Summary.phot_id)
+                .where(Summary.session == self.meas_session)
+            )
+            summaries = dict()
+            for summary, phot in (await session.execute(q)).all():
+                summaries[summary.role] = summary
+                self.phot_info[summary.role] = {
+                    "name": phot.name,
+                    "mac": phot.mac,
+                    "model": phot.model,
+                    "sensor": phot.sensor,
+                    "firmware": phot.firmware,
+                    "freq_offset": phot.freq_offset or 0.0,
+                    "zp": summary.prev_zp,
+                }
+            if set(summaries) != set(self.roles):
+                raise RuntimeError(f"Session {self.meas_session} not found or incomplete")
+            q = (
+                select(Round)
+                .where(Round.summ_id.in_(summary.id for summary in summaries.values()))
+                .order_by(Round.seq)
+            )
+            rounds = (await session.scalars(q)).all()
+            if not rounds:
+                raise RuntimeError(f"Session {self.meas_session} has no rounds")
+            val_arg = self.common_param["period"]
+            if val_arg is None:
+                # Same round times as in the stored session
+                self.schedule = self._stored_schedule(rounds)
+                val_arg = await self._stored_period(session)
+            self.period = val_arg
+        val_arg = self.common_param["buffer"]
+        self.capacity = val_arg if val_arg is not None else rounds[0].nsamples
+        val_arg = self.common_param["central"]
+        self.central = val_arg if val_arg is not None else rounds[0].central
+        val_arg = self.common_param["zp_fict"]
+        self.zp_fict = val_arg if val_arg is not None else rounds[0].zp_fict
+        val_arg = self.common_param["rounds"]
+        self.nrounds = val_arg if val_arg is not None else summaries[Role.TEST].nrounds
+        val_arg = self.common_param["zp_offset"]
+        self.zp_offset = val_arg if val_arg is not None else summaries[Role.TEST].zp_offset
+        self.author = summaries[Role.TEST].author
+        self.stored_zero_point = summaries[Role.TEST].zero_point
+        self.stored_zero_point_method = summaries[Role.TEST].zero_point_method
+        # The absolute ZP is the one stored for the reference photometer
+        self.zp_abs = summaries[Role.REF].zero_point
+        self.persist = False
+        self.update = False
+        self.journal_dir = None
+        self.ring_type = self.common_param["ring"]
+        sampler = Sampler()
+        readings = dict()
+        self._robust_params()
+        for role in self.roles:
+            self.ring[role] = ring_buffer(
+                self.ring_type,
+                capacity=self.capacity,
+                central=self.central,
+                robust=self.robust,
+                kappa=self.kappa,
+                trim=self.trim,
+            )
+            readings[role] = await sampler.readings(self.meas_session, role)
+        self.stream = self._merge(readings)
+
+    async def calibrate(self) -> float:
+        self._on_calib_start()
+        self._feed()
+        self.is_calibrated = False
+        zero_points, freqs = await self._statistics()
+        final_zero_point = self._post_statistics(zero_points, freqs)
+        self._on_calib_end()
+        return final_zero_point
+
+    # ===========
+    # Private API
+    # ===========
+
+    def _merge(self, readings: Mapping[Role, List[Reading]]) -> List[Tuple[Role, Reading]]:
+        """Both photometers readings as a single stream, in timestamp order"""
+        streams = [[(role, reading) for reading in readings[role]] for role in self.roles]
+        return list(heapq.merge(*streams, key=lambda item: item[1].key))
+
+    def _feed(self, until: datetime | None = None) -> int:
+        """
+        Feeds readings up to a given timestamp or, by default, until buffers are filled.
+        Returns the number of readings fed.
+        """
+        start = self.position
+        while self.position < len(self.stream):
+            role, reading = self.stream[self.position]
+            if until is not None and reading.tstamp > until:
+                break
+            self.ring[role].append(reading)
+            self.position += 1
+            self._cursor = reading.tstamp
+            if until is None and all(len(self.ring[r]) == self.capacity for r in self.roles):
+                break
+        else:
+            if until is None or self.position == start:
+                raise RuntimeError(f"Session {self.meas_session} ran out of samples")
+        return self.position - start
+
+    def _on_summary(self, summary_info: Mapping[str, Any]) -> None:
+        self.summary_info = summary_info
+        super()._on_summary(summary_info)
+
+    async def _wait_period(self) -> None:
+        # Time only advances as samples timestamps do
+        i = len(self.zero_points)
+        if i < len(self.schedule):
+            until = self.schedule[i]
+        else:
+            until = self._cursor + timedelta(seconds=self.period)
+        self._feed(until=until)
+        self._cursor = until
+
+    def _stored_schedule(self, rounds: List[Round]) -> List[datetime]:
+        """Round times, taken as the newest sample in any of the round windows"""
+        ends = defaultdict(list)
+        for r in rounds:
+            ends[r.seq].append(r.end_tstamp)
+        return [max(ends[seq]).replace(tzinfo=timezone.utc) for seq in sorted(ends)]
+
+    async def _stored_period(self, session: Session) -> float:
+        """Period between rounds as seen in the stored round times"""
+        gaps = [(t1 - t0).total_seconds() for t0, t1 in zip(self.schedule, self.schedule[1:])]
+        if gaps:
+            return statistics.median(gaps)
+        return float(await load_config(session, SECTION[Role.TEST], "period"))
@@ -8,28 +8,49 @@
 # System wide imports
 # -------------------
 
+from __future__ import annotations
+
+import math
+import bisect
 import logging
 import statistics
 import collections
-from datetime import datetime
-from typing import Tuple, Mapping, Set, Any
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Tuple, List, Set, Sequence, Iterator, Any
 
 # -------------------
 # Third party imports
 # -------------------
 
+from lica.asyncio.photometer import Message
 from zptessdao.constants import CentralTendency
 
 # --------------
 # local imports
 # -------------
 
+from .types import RingType, Robust
+from ...lazy import lazy_import
 
 # ----------------
 # Module constants
 # ----------------
 
-Message = Mapping[str, Any]
+# Columns kept by the NumPy ring buffer. Timestamps are POSIX seconds (UTC)
+READING_DTYPE = [("tstamp", "f8"), ("freq", "f8"), ("seq", "i8"), ("tamb", "f8")]
+
+# Robust estimators defaults
+KAPPA = 3.0  # Sigma clipping threshold, in standard deviations
+TRIM = 0.1  # Fraction trimmed at each end of the sorted samples
+CLIP_ITERATIONS = 5
+
+# Central tendency kind of the robust estimators, as recorded in the database
+ROBUST_CENTRAL = {
+    Robust.SIGMA_CLIP: CentralTendency.MEAN,
+    Robust.TRIMMED: CentralTendency.MEAN,
+    Robust.HODGES_LEHMANN: CentralTendency.MEDIAN,
+}
 
 # -----------------------
 # Module global variables
@@ -38,6 +59,9 @@ Message = Mapping[str, Any]
 # get the root logger
 log = logging.getLogger(__name__.split(".")[-1])
 
+# Only loaded by the NumPy ring buffer
+np = lazy_import("numpy")
+
 # -------
 # Classes
 # -------
@@ -45,27 +69,72 @@ log = logging.getLogger(__name__.split(".")[-1])
 # which are usually shared between rounds
 
 
-class UniqueReading(dict):
-    """A hashable, subclaased dictionary based on the "tstamp" keyword and value"""
+@dataclass(frozen=True, slots=True, eq=False)
+class Reading:
+    """A compact, immutable reading, hashed by its timestamp in milliseconds"""
 
-    def __init__(self, *args, **kwargs):
-        self.update(*args, **kwargs)
+    tstamp: datetime
+    freq: float
+    seq: int
+    tamb: float | None
+    key: int = field(init=False, repr=False)
 
-    def __getitem__(self, key):
-        return dict.__getitem__(self, key)
+    def __post_init__(self):
+        object.__setattr__(self, "key", int(self.tstamp.timestamp() * 1000))
 
-    def __setitem__(self, key, val):
-        dict.__setitem__(self, key, val)
+    def __hash__(self):
+        return self.key
 
-    def __repr__(self):
-        return "%s(%s)" % (type(self).__name__, dict.__repr__(self))
+    def __eq__(self, other):
+        if not isinstance(other, Reading):
+            return NotImplemented
+        return self.key == other.key
 
-    def __hash__(self):
-        return int(dict.__getitem__(self, "tstamp").timestamp() * 1000)
+    def __getitem__(self, name: str) -> Any:
+        """Keeps the photometer message style access, i.e. reading["freq"]"""
+        return getattr(self, name)
+
+    @classmethod
+    def from_message(cls, message: Message) -> "Reading":
+        return cls(
+            tstamp=message["tstamp"],
+            freq=message["freq"],
+            seq=message["seq"],
+            tamb=message["tamb"],
+        )
+
+
+class RoundIndex:
+    """
+    Sample to rounds membership index.
+    Rounds are contiguous windows of the readings stream, so each round
+    is fully described by the keys of its first and last readings.
+    """
+
+    def __init__(self):
+        self._windows = list()
+
+    def __len__(self) -> int:
+        return len(self._windows)
 
-    def update(self, *args, **kwargs):
-        for k, v in dict(*args, **kwargs).items():
-            self[k] = v
+    def add(self, first: Reading, last: Reading) -> None:
+        """Register a new round window, in round order"""
+        self._windows.append((first.key, last.key))
+
+    def memberships(self, samples: Sequence[Reading]) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (sample index, round index) pairs for samples sorted by key.
+        Window boundaries never go backwards, so a single sweep is enough.
+        """
+        lo = 0
+        nrounds = len(self._windows)
+        for i, sample in enumerate(samples):
+            while lo < nrounds and self._windows[lo][1] < sample.key:
+                lo += 1
+            j = lo
+            while j < nrounds and self._windows[j][0] <= sample.key:
+                yield i, j
+                j += 1
 
 
 class RingBuffer:
@@ -73,9 +142,15 @@ class RingBuffer:
         self,
         capacity: int = 75,
         central: CentralTendency = CentralTendency.MEDIAN,
+        robust: Robust | None = None,
+        kappa: float = KAPPA,
+        trim: float = TRIM,
     ):
         self._buffer = collections.deque([], capacity)
         self._central = central
+        self._robust = robust
+        self._kappa = kappa
+        self._trim = trim
         if central == CentralTendency.MEDIAN:
             self._central_func = statistics.median_low
         elif central == CentralTendency.MEAN:
@@ -86,26 +161,457 @@ class RingBuffer:
     def __len__(self) -> int:
         return len(self._buffer)
 
-    def __getitem__(self, i: int) -> Message:
+    def __getitem__(self, i: int) -> Reading:
         return self._buffer[i]
 
     def capacity(self) -> int:
         return self._buffer.maxlen
 
-    def pop(self) -> Message:
+    def pop(self) -> Reading:
         return self._buffer.popleft()
 
-    def append(self, item: Message) -> None:
+    def append(self, item: Reading) -> None:
         self._buffer.append(item)
 
-    def copy(self) -> Set[Message]:
-        return set(UniqueReading(item) for item in self._buffer)
+    def copy(self) -> Set[Reading]:
+        # Readings are immutable, so they can be shared instead of copied
+        return set(self._buffer)
 
     def intervals(self) -> Tuple[datetime, datetime]:
-        return self._buffer[0]["tstamp"], self._buffer[-1]["tstamp"]
+        return self._buffer[0].tstamp, self._buffer[-1].tstamp
 
     def statistics(self) -> Tuple[float, float]:
-        frequencies = tuple(item["freq"] for item in self._buffer)
+        frequencies = tuple(item.freq for item in self._buffer)
+        if self._robust is not None:
+            return robust_statistics(sorted(frequencies), self._robust, self._kappa, self._trim)
         central = self._central_func(frequencies)
         stdev = statistics.stdev(frequencies, central)
         return central, stdev
+
+
+class SortedRingBuffer(RingBuffer):
+    """
+    Ring buffer backed by a sorted multiset of frequencies.
+    The deque keeps the arrival order for eviction while the sorted list
+    and the running sums are updated on each append/eviction, so that
+    round statistics do not need a full pass over the buffer.
+    The sums of both trimmed tails are kept as well for the trimmed mean.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 75,
+        central: CentralTendency = CentralTendency.MEDIAN,
+        robust: Robust | None = None,
+        kappa: float = KAPPA,
+        trim: float = TRIM,
+    ):
+        super().__init__(capacity, central, robust, kappa, trim)
+        self._sorted = list()
+        self._counts = collections.Counter()
+        self._ntrim = 0
+        self._reset_sums()
+
+    def pop(self) -> Reading:
+        item = self._buffer.popleft()
+        self._remove(item.freq)
+        return item
+
+    def append(self, item: Reading) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self._remove(self._buffer[0].freq)
+        self._buffer.append(item)
+        self._insert(item.freq)
+
+    def statistics(self) -> Tuple[float, float]:
+        n = len(self._sorted)
+        if n < 2:
+            raise statistics.StatisticsError("stdev requires at least two data points")
+        if self._robust is not None:
+            sums = (self._shift, self._sum, self._sumsq)
+            tails = (self._low, self._high) if self._robust == Robust.TRIMMED else None
+            return robust_statistics(
+                self._sorted, self._robust, self._kappa, self._trim, sums, tails
+            )
+        if self._central == CentralTendency.MEDIAN:
+            central = self._sorted[(n - 1) // 2]
+        elif self._central == CentralTendency.MEAN:
+            central = self._shift + self._sum / n
+        else:
+            central = self._mode()
+        # sum((x - c)^2) expanded over the shifted running sums
+        c = central - self._shift
+        ssq = self._sumsq - 2 * c * self._sum + n * c * c
+        stdev = math.sqrt(max(ssq, 0.0) / (n - 1))
+        return central, stdev
+
+    # ---------------
+    # Private methods
+    # ---------------
+
+    def _reset_sums(self) -> None:
+        # Sums are kept around a shift value to avoid catastrophic cancellation
+        self._shift = self._sorted[0] if self._sorted else 0.0
+        self._sum = math.fsum(x - self._shift for x in self._sorted)
+        self._sumsq = math.fsum((x - self._shift) ** 2 for x in self._sorted)
+        n = len(self._sorted)
+        self._low = _range_sums(self._sorted, 0, self._ntrim, self._shift)
+        self._high = _range_sums(self._sorted, n - self._ntrim, n, self._shift)
+        self._updates = 0
+
+    def _insert(self, freq: float) -> None:
+        if not self._sorted:
+            self._shift = freq
+        i = bisect.bisect_right(self._sorted, freq)
+        self._sorted.insert(i, freq)
+        self._counts[freq] += 1
+        d = freq - self._shift
+        self._sum += d
+        self._sumsq += d * d
+        if self._robust == Robust.TRIMMED:
+            # The new value may enter a tail, pushing its innermost value out
+            n, k = len(self._sorted), self._ntrim
+            if i < k:
+                self._low = self._tail(self._low, freq, self._sorted[k])
+            if i >= n - k:
+                self._high = self._tail(self._high, freq, self._sorted[n - k - 1])
+            self._retrim()
+        self._tally()
+
+    def _remove(self, freq: float) -> None:
+        i = bisect.bisect_left(self._sorted, freq)
+        del self._sorted[i]
+        self._counts[freq] -= 1
+        if self._counts[freq] == 0:
+            del self._counts[freq]
+        d = freq - self._shift
+        self._sum -= d
+        self._sumsq -= d * d
+        if self._robust == Robust.TRIMMED:
+            # The next inner value takes the place of a value leaving a tail
+            n, k = len(self._sorted), self._ntrim
+            if i < k:
+                self._low = self._tail(self._low, self._sorted[k - 1], freq)
+            if i >= n + 1 - k:
+                self._high = self._tail(self._high, self._sorted[n - k], freq)
+            self._retrim()
+        self._tally()
+
+    def _tail(self, tail: Tuple[float, float], x: float, y: float) -> Tuple[float, float]:
+        """Tail sums with x entering and y leaving"""
+        dx, dy = x - self._shift, y - self._shift
+        return tail[0] + dx - dy, tail[1] + dx * dx - dy * dy
+
+    def _retrim(self) -> None:
+        """
+        Grows or shrinks both tails to the trimmed fraction of the current size.
+        The shift value itself adds nothing to the tail sums.
+        """
+        n = len(self._sorted)
+        k = _ntrim(n, self._trim)
+        while self._ntrim < k:
+            self._low = self._tail(self._low, self._sorted[self._ntrim], self._shift)
+            self._high = self._tail(self._high, self._sorted[n - 1 - self._ntrim], self._shift)
+            self._ntrim += 1
+        while self._ntrim > k:
+            self._ntrim -= 1
+            self._low = self._tail(self._low, self._shift, self._sorted[self._ntrim])
+            self._high = self._tail(self._high, self._shift, self._sorted[n - 1 - self._ntrim])
+
+    def _tally(self) -> None:
+        # Recompute the running sums once per buffer turnaround
+        # so that rounding errors do not accumulate forever
+        self._updates += 1
+        if self._updates > 2 * self._buffer.maxlen:
+            self._reset_sums()
+
+    def _mode(self) -> float:
+        top = max(self._counts.values())
+        candidates = set(x for x, count in self._counts.items() if count == top)
+        if len(candidates) == 1:
+            return candidates.pop()
+        # Same tie breaking as statistics.mode(): first value seen in the buffer
+        return next(item.freq for item in self._buffer if item.freq in candidates)
+
+
+class ReadingWindow:
+    """
+    Read-only snapshot of a round as a structured NumPy array.
+    Reading objects are only created when iterated.
+    """
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __iter__(self) -> Iterator[Reading]:
+        return (_as_reading(row) for row in self.array)
+
+    def __contains__(self, item: Reading) -> bool:
+        tstamps = self.array["tstamp"]
+        t = item.tstamp.timestamp()
+        i = np.searchsorted(tstamps, t)
+        return i < len(tstamps) and tstamps[i] == t
+
+
+class NumpyRingBuffer:
+    """
+    Ring buffer storing readings in preallocated NumPy columns.
+    Every row is written twice, at i and i + capacity, so that the
+    current contents are always a contiguous, zero-copy slice.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 75,
+        central: CentralTendency = CentralTendency.MEDIAN,
+        robust: Robust | None = None,
+        kappa: float = KAPPA,
+        trim: float = TRIM,
+    ):
+        self._data = np.zeros(2 * capacity, dtype=READING_DTYPE)
+        self._capacity = capacity
+        self._start = 0
+        self._len = 0
+        self._central = central
+        self._robust = robust
+        self._kappa = kappa
+        self._trim = trim
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> Reading:
+        if not -self._len <= i < self._len:
+            raise IndexError("ring buffer index out of range")
+        return _as_reading(self.window()[i])
+
+    def capacity(self) -> int:
+        return self._capacity
+
+    def pop(self) -> Reading:
+        item = self[0]
+        self._start = (self._start + 1) % self._capacity
+        self._len -= 1
+        return item
+
+    def append(self, item: Reading) -> None:
+        if self._len == self._capacity:
+            i = self._start
+            self._start = (self._start + 1) % self._capacity
+        else:
+            i = (self._start + self._len) % self._capacity
+            self._len += 1
+        row = (
+            item.tstamp.timestamp(),
+            item.freq,
+            item.seq,
+            item.tamb if item.tamb is not None else math.nan,
+        )
+        self._data[i] = row
+        self._data[i + self._capacity] = row
+
+    def window(self) -> np.ndarray:
+        """Zero-copy, read-only view of the current buffer contents, oldest first"""
+        view = self._data[self._start : self._start + self._len]
+        view.flags.writeable = False
+        return view
+
+    def copy(self) -> ReadingWindow:
+        return ReadingWindow(self.window().copy())
+
+    def intervals(self) -> Tuple[datetime, datetime]:
+        tstamps = self.window()["tstamp"]
+        return _as_datetime(tstamps[0]), _as_datetime(tstamps[-1])
+
+    def statistics(self) -> Tuple[float, float]:
+        frequencies = self.window()["freq"]
+        n = len(frequencies)
+        if n < 2:
+            raise statistics.StatisticsError("stdev requires at least two data points")
+        if self._robust is not None:
+            return robust_statistics(
+                np.sort(frequencies).tolist(), self._robust, self._kappa, self._trim
+            )
+        if self._central == CentralTendency.MEDIAN:
+            k = (n - 1) // 2
+            central = float(np.partition(frequencies, k)[k])
+        elif self._central == CentralTendency.MEAN:
+            central = float(frequencies.mean())
+        else:
+            values, first, counts = np.unique(frequencies, return_index=True, return_counts=True)
+            # Same tie breaking as statistics.mode(): first value seen in the buffer
+            ties = counts == counts.max()
+            central = float(values[ties][np.argmin(first[ties])])
+        stdev = math.sqrt(float(np.square(frequencies - central).sum()) / (n - 1))
+        return central, stdev
+
+
+# ----------------
+# Module functions
+# ----------------
+
+
+def _as_datetime(tstamp: float) -> datetime:
+    return datetime.fromtimestamp(tstamp, timezone.utc)
+
+
+def _as_reading(row: np.void) -> Reading:
+    tamb = float(row["tamb"])
+    return Reading(
+        tstamp=_as_datetime(row["tstamp"]),
+        freq=float(row["freq"]),
+        seq=int(row["seq"]),
+        tamb=None if math.isnan(tamb) else tamb,
+    )
+
+
+def _range_sums(values: Sequence[float], lo: int, hi: int, shift: float) -> Tuple[float, float]:
+    """Shifted sum and sum of squares of the values[lo:hi]"""
+    d = [x - shift for x in values[lo:hi]]
+    return math.fsum(d), math.fsum(x * x for x in d)
+
+
+def _ntrim(n: int, trim: float) -> int:
+    """Values trimmed at each end of n values, always keeping two for the standard deviation"""
+    return max(min(int(trim * n), (n - 2) // 2), 0)
+
+
+def _stdev(n: int, s1: float, s2: float, c: float) -> float:
+    """Standard deviation around c from n values shifted sums, c being shifted too"""
+    return math.sqrt(max(s2 - 2 * c * s1 + n * c * c, 0.0) / (n - 1))
+
+
+def _walsh_limits(values: Sequence[float], pivot: float, strict: bool) -> List[int]:
+    """
+    Last column j >= i of each row i whose Walsh average (values[i] + values[j]) / 2
+    is below (or equal) the pivot, i - 1 if none. Rows and columns are sorted,
+    so the limit only moves left and a single sweep is enough.
+    """
+    n = len(values)
+    j = n - 1
+    limits = list()
+    for i in range(n):
+        while j >= i:
+            average = (values[i] + values[j]) / 2
+            if average < pivot or (average == pivot and not strict):
+                break
+            j -= 1
+        limits.append(max(j, i - 1))
+    return limits
+
+
+def hodges_lehmann(values: Sequence[float]) -> float:
+    """
+    Low median of the Walsh averages (x[i] + x[j]) / 2, i <= j, of the sorted values,
+    selected without building all of them (Monahan's algorithm). Each row of the
+    triangle of averages keeps its active column range, pruned at every step around
+    the weighted median of the active rows' middle elements.
+    """
+    n = len(values)
+    k = (n * (n + 1) // 2 - 1) // 2
+    lo = list(range(n))
+    hi = [n - 1] * n
+    while True:
+        rows = [i for i in range(n) if lo[i] <= hi[i]]
+        active = sum(hi[i] - lo[i] + 1 for i in rows)
+        below = sum(lo[i] - i for i in range(n))
+        if active <= n:
+            averages = sorted(
+                (values[i] + values[j]) / 2 for i in rows for j in range(lo[i], hi[i] + 1)
+            )
+            return averages[k - below]
+        middles = sorted(
+            ((values[i] + values[(lo[i] + hi[i]) // 2]) / 2, hi[i] - lo[i] + 1) for i in rows
+        )
+        weight = 0
+        for pivot, w in middles:
+            weight += w
+            if 2 * weight >= active:
+                break
+        le = _walsh_limits(values, pivot, strict=False)
+        lt = _walsh_limits(values, pivot, strict=True)
+        n_le = sum(le[i] - i + 1 for i in range(n))
+        n_lt = sum(lt[i] - i + 1 for i in range(n))
+        if n_lt <= k < n_le:
+            return pivot
+        if k < n_lt:
+            hi = [min(hi[i], lt[i]) for i in range(n)]
+        else:
+            lo = [max(lo[i], le[i] + 1) for i in range(n)]
+
+
+def robust_statistics(
+    values: Sequence[float],
+    robust: Robust,
+    kappa: float = KAPPA,
+    trim: float = TRIM,
+    sums: Tuple[float, float, float] | None = None,
+    tails: Tuple[Tuple[float, float], Tuple[float, float]] | None = None,
+) -> Tuple[float, float]:
+    """
+    Robust central tendency and standard deviation of the sorted values.
+    The standard deviation is taken over the values kept by the estimator.
+    Sums are the (shift, sum, sum of squares) of the shifted values and tails the
+    shifted (sum, sum of squares) of the trimmed tails, computed here when not given.
+    Only the few rejected values are visited when the sums are given.
+    """
+    n = len(values)
+    if n < 2:
+        raise statistics.StatisticsError("stdev requires at least two data points")
+    if sums is None:
+        sums = (values[0],) + _range_sums(values, 0, n, values[0])
+    shift, s1, s2 = sums
+    if robust == Robust.HODGES_LEHMANN:
+        central = hodges_lehmann(values)
+        return central, _stdev(n, s1, s2, central - shift)
+    if robust == Robust.TRIMMED:
+        k = _ntrim(n, trim)
+        if tails is None:
+            tails = (_range_sums(values, 0, k, shift), _range_sums(values, n - k, n, shift))
+        (l1, l2), (h1, h2) = tails
+        a, b = k, n - k
+    else:
+        # Iterative clipping around the median of the kept values
+        a, b = 0, n
+        for _ in range(CLIP_ITERATIONS):
+            l1, l2 = _range_sums(values, 0, a, shift)
+            h1, h2 = _range_sums(values, b, n, shift)
+            m = b - a
+            mean = (s1 - l1 - h1) / m
+            sigma = _stdev(m, s1 - l1 - h1, s2 - l2 - h2, mean)
+            median = values[a + (m - 1) // 2]
+            lo = max(a, bisect.bisect_left(values, median - kappa * sigma))
+            hi = min(b, bisect.bisect_right(values, median + kappa * sigma))
+            if (lo, hi) == (a, b) or hi - lo < 2:
+                break
+            a, b = lo, hi
+        l1, l2 = _range_sums(values, 0, a, shift)
+        h1, h2 = _range_sums(values, b, n, shift)
+    m = b - a
+    s1, s2 = s1 - l1 - h1, s2 - l2 - h2
+    mean = s1 / m
+    return shift + mean, _stdev(m, s1, s2, mean)
+
+
+RING_BUFFERS = {
+    RingType.DEQUE: RingBuffer,
+    RingType.SORTED: SortedRingBuffer,
+    RingType.NUMPY: NumpyRingBuffer,
+}
+
+
+def ring_buffer(
+    ring_type: RingType,
+    capacity: int = 75,
+    central: CentralTendency = CentralTendency.MEDIAN,
+    robust: Robust | None = None,
+    kappa: float = KAPPA,
+    trim: float = TRIM,
+) -> RingBuffer | SortedRingBuffer | NumpyRingBuffer:
+    """Ring buffer factory"""
+    return RING_BUFFERS[ring_type](
+        capacity=capacity, central=central, robust=robust, kappa=kappa, trim=trim
+    )
@@ -0,0 +1,223 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import json
+import math
+import random
+
+from logging import Logger
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+# ---------------------
+# Third party libraries
+# ---------------------
+
+import decouple
+from lica.asyncio.photometer import Role
+
+# --------------
+# local imports
+# -------------
+
+from .clock import Clock
+
+# ----------------
+# Module constants
+# ----------------
+
+# MAC addresses reserved for documentation (RFC 7042), 00:00:5E:00:53:00 to FF.
+# The reference photometer takes the first one, test photometer units the next ones.
+SIM_MAC_PREFIX = "00:00:5E:00:53"
+SIM_UNITS = 254
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def sim_identity(role: Role, unit: int = 1) -> Tuple[str, str]:
+    """Name and MAC address of a simulated photometer unit"""
+    number = 1 if role == Role.REF else 1 + unit
+    return f"sim-{role}-{unit}", f"{SIM_MAC_PREFIX}:{number:02X}"
+
+
+# -------
+# Classes
+# -------
+
+
+@dataclass(frozen=True, slots=True)
+class SimParams:
+    """Synthetic readings model. Read from SIM_REF_* or SIM_TEST_* settings"""
+
+    freq: float  # Mean frequency (Hz)
+    sigma: float  # Frequency standard deviation (Hz)
+    drift: float  # Mean frequency drift (Hz/hour)
+    jitter: float  # Reading period jitter, as a fraction of the period
+    dropout: float  # Probability of a lost reading
+    tamb: float  # Box temperature (°C)
+    zp: float  # Zero Point reported by the device
+    seed: int | None  # Random generator seed, for repeatable runs
+
+    @classmethod
+    def from_env(cls, role: Role) -> "SimParams":
+        prefix = f"SIM_{str(role).upper()}_"
+        seed = decouple.config(prefix + "SEED", default="")
+        freq = 10.0 if role == Role.REF else 10.5
+        return cls(
+            freq=decouple.config(prefix + "FREQ", default=freq, cast=float),
+            sigma=decouple.config(prefix + "SIGMA", default=0.02, cast=float),
+            drift=decouple.config(prefix + "DRIFT", default=0.0, cast=float),
+            jitter=decouple.config(prefix + "JITTER", default=0.05, cast=float),
+            dropout=decouple.config(prefix + "DROPOUT", default=0.0, cast=float),
+            tamb=decouple.config(prefix + "TAMB", default=20.0, cast=float),
+            zp=decouple.config(prefix + "ZP", default=20.50, cast=float),
+            seed=int(seed) if seed else None,
+        )
+
+
+class SimProtocol:
+    """
+    Photometer transport emitting synthetic TESS-W readings at a given rate,
+    either in the old serial payload format or in the JSON UDP payload format.
+    Pacing and timestamps come from the clock, so a virtual clock makes it run
+    as fast as the pipeline consumes readings.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        role: Role,
+        fmt: str,
+        rate: float,
+        params: SimParams,
+        clock: Clock | None = None,
+        unit: int = 1,
+    ):
+        self.log = logger
+        self.role = role
+        self.name, _ = sim_identity(role, unit)
+        self.fmt = fmt
+        self.period = 1.0 / rate
+        self.params = params
+        self.clock = clock or Clock()
+        self._random = random.Random(params.seed)
+        self._seq = 0
+        self._origin = None
+        self._start = None
+        self._n = 0
+        self._emitted = 0
+        self._dropped = 0
+        self.log.info("Using %s (%s payload at %g Hz)", self.__class__.__name__, fmt, rate)
+
+    # ----------------------
+    # The iterator interface
+    # ----------------------
+
+    def __aiter__(self) -> "SimProtocol":
+        return self
+
+    async def __anext__(self) -> Tuple[datetime, str]:
+        while True:
+            self._n += 1
+            self._seq += 1
+            jitter = self._random.gauss(0.0, self.params.jitter * self.period)
+            deadline = self._start + self._n * self.period + jitter
+            await self.clock.sleep(max(deadline - self.clock.monotonic(), 0.0))
+            if self._random.random() >= self.params.dropout:
+                break
+            self._dropped += 1
+        self._emitted += 1
+        tstamp = self.clock.now()
+        return tstamp, self._payload(self._frequency())
+
+    # -------------------
+    # Transport interface
+    # -------------------
+
+    async def open(self) -> None:
+        now = self.clock.monotonic()
+        if self._origin is None:
+            self._origin = now
+        self._start = now
+        self._n = 0
+
+    def close(self) -> None:
+        elapsed = self.clock.monotonic() - self._origin if self._origin is not None else 0.0
+        self.log.info(
+            "Simulated %d readings (%d dropped) in %.1f s (%.1f Hz)",
+            self._emitted,
+            self._dropped,
+            elapsed,
+            self._emitted / elapsed if elapsed > 0 else 0.0,
+        )
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _frequency(self) -> float:
+        hours = (self.clock.monotonic() - self._origin) / 3600
+        freq = self.params.freq + self.params.drift * hours
+        return max(self._random.gauss(freq, self.params.sigma), 0.001)
+
+    def _payload(self, freq: float) -> str:
+        tamb = self.params.tamb + self._random.gauss(0.0, 0.1)
+        tsky = tamb - 25.0 + self._random.gauss(0.0, 0.1)
+        if self.fmt == "old":
+            # Frequencies below 100 Hz are reported in mHz
+            if freq < 100:
+                freq_field = f"<fm {round(freq * 1000):05d}>"
+            else:
+                freq_field = f"<fH {round(freq):05d}>"
+            return (
+                f"{freq_field}<tA {round(tamb * 100):+05d}><tO {round(tsky * 100):+05d}>"
+                f"<mZ {round(self.params.zp * 100):+05d}>\r\n"
+            )
+        message = {
+            "udp": self._seq,
+            "rev": 2,
+            "name": self.name,
+            "freq": round(freq, 3),
+            "mag": round(self.params.zp - 2.5 * math.log10(freq), 2),
+            "tamb": round(tamb, 2),
+            "tsky": round(tsky, 2),
+            "wdBm": -50,
+            "ZP": self.params.zp,
+        }
+        return json.dumps(message)
+
+
+class SimInfo:
+    """Photometer information for a simulated test photometer"""
+
+    def __init__(self, logger: Logger, params: SimParams, role: Role = Role.TEST, unit: int = 1):
+        self.log = logger
+        self.role = role
+        self.name, self.mac = sim_identity(role, unit)
+        self.zp = params.zp
+        self.log.info("Using %s", self.__class__.__name__)
+
+    async def get_info(self, timeout: int = 4) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "mac": self.mac,
+            "zp": self.zp,
+            "firmware": "simulator",
+            "freq_offset": 0.0,
+            "model": "TESS-W",
+            "sensor": None,
+        }
+
+    async def save_zero_point(self, zero_point: float, timeout: int = 4) -> Dict[str, Any]:
+        self.zp = zero_point
+        return {"zp": zero_point}
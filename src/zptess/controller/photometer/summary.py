@@ -0,0 +1,82 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Tuple
+
+# ---------------------
+# Third party libraries
+# ---------------------
+
+# --------------
+# local imports
+# -------------
+
+from ...lazy import lazy_import
+
+# ----------------
+# Module constants
+# ----------------
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_US = timedelta(microseconds=1)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# Only loaded by the batched summary statistics benchmark (zp-tools benchmark)
+np = lazy_import("numpy")
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def epoch_us(tstamps: Sequence[datetime]) -> np.ndarray:
+    """Timestamps as integer microseconds since the epoch. Naive timestamps are taken as UTC"""
+    return np.array(
+        [((t if t.tzinfo else t.replace(tzinfo=timezone.utc)) - EPOCH) // ONE_US for t in tstamps],
+        dtype=np.int64,
+    )
+
+
+def best_rows(
+    values: Sequence[Sequence[float]] | np.ndarray, tolerance: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    util.best() for every row of a 2D array, i.e. the rounds of many sessions at once.
+    Values within the tolerance of each other are counted together for the mode,
+    the low median of the winning group being the mode.
+    Returns whether each row has a single mode and the mode or low median of each row.
+    """
+    s = np.sort(np.asarray(values, dtype=np.float64), axis=-1)
+    keys = np.round(s / tolerance) if tolerance > 0 else s
+    # Rows are short (the rounds), so pairwise comparisons are cheaper than sorting out runs
+    counts = (keys[:, :, None] == keys[:, None, :]).sum(axis=-1)
+    top = counts.max(axis=-1, keepdims=True)
+    is_mode = (counts == top).sum(axis=-1) == top[:, 0]
+    # First element of the winning group, in sorted order, then its low median
+    first = np.argmax(counts == top, axis=-1)
+    rows = np.arange(s.shape[0])
+    mode = s[rows, first + (top[:, 0] - 1) // 2]
+    median_low = s[:, (s.shape[-1] - 1) // 2]
+    return is_mode, np.where(is_mode, mode, median_low)
+
+
+def overlaps_rows(t: np.ndarray) -> np.ndarray:
+    """
+    Overlaps in seconds between consecutive round windows, given as integer microseconds
+    in a (..., rounds, 2) array. NaN when the windows do not overlap.
+    """
+    T = (t[..., :-1, 1] - t[..., 1:, 0]) / 1e6
+    return np.where(T > 0, T, np.nan)
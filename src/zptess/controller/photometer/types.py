@@ -27,3 +27,24 @@ class Event(StrEnum):
 	CAL_START = "calib_start_event"
 	CAL_END = "calib_end_event"
 
+
+class RingType(StrEnum):
+	DEQUE = "deque"
+	SORTED = "sorted"
+	NUMPY = "numpy"
+
+
+class Robust(StrEnum):
+	SIGMA_CLIP = "sigma-clip"
+	TRIMMED = "trimmed"
+	HODGES_LEHMANN = "hodges-lehmann"
+
+
+class Stage(StrEnum):
+	TRANSPORT = "transport"  # bytes arrival -> reading task resumed
+	DECODE = "decode"  # payload decoding
+	HOLD = "hold"  # decoder look-ahead: message arrival -> message released
+	RING = "ring"  # ring buffer append, journal included
+	DISPATCH = "dispatch"  # reading event listeners
+	DATABASE = "database"  # database write, for both roles
+	TOTAL = "total"  # bytes arrival -> reading fully handled
@@ -1,20 +1,23 @@
 import statistics
 
 
-from typing import  Sequence, Tuple
+from datetime import datetime
+from typing import Sequence, Tuple
 
 from zptessdao.constants import CentralTendency
 
+
 def mode(sequence: Sequence) -> float:
     try:
         result = statistics.multimode(sequence)
-        if len(result) != 1:     # To make it compatible with my previous software
+        if len(result) != 1:  # To make it compatible with my previous software
             raise statistics.StatisticsError
         result = result[0]
-    except AttributeError: # Previous to Python 3.8
+    except AttributeError:  # Previous to Python 3.8
         result = statistics.mode(sequence)
     return result
 
+
 def best(sequence: Sequence) -> Tuple[CentralTendency, float]:
     try:
         result = mode(sequence)
@@ -22,4 +25,13 @@ def best(sequence: Sequence) -> Tuple[CentralTendency, float]:
     except statistics.StatisticsError:
         result = statistics.median_low(sequence)
         central = CentralTendency.MEDIAN
-    return central, result
\ No newline at end of file
+    return central, result
+
+
+def overlaps(intervals: Sequence[Tuple[datetime, datetime]]) -> Sequence[float | None]:
+    """Overlap in seconds between each round window and the next one, None if they do not"""
+    result = list()
+    for i, t in enumerate(intervals[:-1]):
+        T = (t[1] - intervals[i + 1][0]).total_seconds()
+        result.append(None if T <= 0 else T)
+    return result
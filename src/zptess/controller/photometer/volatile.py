@@ -9,13 +9,12 @@
 # -------------------
 
 import math
-import datetime
 import logging
 import asyncio
 import statistics
 
 from collections import defaultdict
-from typing import Any, Mapping, Sequence
+from typing import Any, Collection, Mapping, Sequence
 
 
 # ---------------------------
@@ -31,10 +30,12 @@ from zptessdao.constants import CentralTendency
 # local imports
 # -------------
 
-from .util import best
-from .types import Event, RoundStatistics, SummaryStatistics
-from .ring import RingBuffer, Message
+from .util import best, overlaps
+from .types import Event, RoundStatistics, SummaryStatistics, Stage
+from .ring import ring_buffer, Reading, RoundIndex, KAPPA, TRIM, ROBUST_CENTRAL
+from .journal import Journal, Record
 from .base import Controller as BaseController
+from .clock import Clock
 from .. import load_config
 from ...dao import Session
 
@@ -46,6 +47,23 @@ from ...dao import Session
 
 SECTION = {Role.REF: "ref-stats", Role.TEST: "test-stats"}
 
+# Consecutive rounds with a stable best Zero Point before stopping early
+STABLE_ROUNDS = 3
+
+# Default target standard error of the provisional Zero Point (mag)
+PRECISION = 0.005
+
+# Magnitude error per unit of relative frequency error
+MAG_ERROR = 2.5 / math.log(10)
+
+# Provisional precision is never reached before filling this fraction of the ring buffers,
+# as a few quantized readings may well be all equal, with no dispersion at all
+MIN_FILL = 0.5
+
+# Frequency resolution of the readings (Hz). Their quantization error
+# is the least dispersion assumed for the provisional statistics
+QUANTUM = 0.001
+
 # -----------------------
 # Module global variables
 # -----------------------
@@ -72,19 +90,35 @@ class Controller(BaseController):
         ref_params: Mapping[str, Any] | None = None,
         test_params: Mapping[str, Any] | None = None,
         common_params: Mapping[str, Any] | None = None,
+        clock: Clock | None = None,
     ):
-        super().__init__(ref_params, test_params)
+        super().__init__(ref_params, test_params, clock)
         self.common_param = common_params
         self.period = None
         self.central = None
+        self.robust = None
+        self.kappa = None
+        self.trim = None
         self.nrounds = None
+        self.tolerance = None
+        self.stable_rounds = None
+        self.max_rounds = None
+        self.stop_reason = None
+        self.min_samples = None
+        self.precision = None
+        self.is_precise = False
+        self._provisional_tstamp = None
         self.zp_fict = None
         self.zp_offset = None
         self.zp_abs = None
         self.author = None
         self.accum_samples = defaultdict(list)
         self.time_intervals = defaultdict(list)
+        self.round_index = defaultdict(RoundIndex)
         self._unique_samples = defaultdict(set)
+        self.zero_points = list()
+        self.round_stats = list()
+        self.journal = None
 
     # ==========
     # Public API
@@ -92,7 +126,7 @@ class Controller(BaseController):
 
     async def init(self) -> None:
         await super().init()
-        self.meas_session = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.meas_session = self.clock.now().replace(microsecond=0)
         async with Session() as session:
             val_db = await load_config(session, SECTION[Role.TEST], "samples")
             val_arg = self.common_param["buffer"]
@@ -119,8 +153,32 @@ class Controller(BaseController):
             self.zp_abs = float(await load_config(session, "ref-device", "zp"))
         self.persist = self.common_param["persist"]
         self.update = self.common_param["update"]
+        self.ring_type = self.common_param["ring"]
+        self.journal_dir = self.common_param["journal"]
+        # Adaptive number of rounds, only when a convergence tolerance is given
+        self.tolerance = self.common_param.get("tolerance")
+        stable_rounds = self.common_param.get("stable")
+        self.stable_rounds = stable_rounds if stable_rounds is not None else STABLE_ROUNDS
+        max_rounds = self.common_param.get("max_rounds")
+        self.max_rounds = max_rounds if max_rounds is not None else 2 * self.nrounds
+        if self.max_rounds < self.nrounds:
+            raise ValueError(
+                f"Maximum number of rounds {self.max_rounds} below the {self.nrounds} rounds"
+            )
+        # Provisional statistics while filling, only when a minimum of samples is given
+        self.min_samples = self.common_param.get("provisional")
+        precision = self.common_param.get("precision")
+        self.precision = precision if precision is not None else PRECISION
+        self._robust_params()
         for role in self.roles:
-            self.ring[role] = RingBuffer(capacity=self.capacity, central=self.central)
+            self.ring[role] = ring_buffer(
+                self.ring_type,
+                capacity=self.capacity,
+                central=self.central,
+                robust=self.robust,
+                kappa=self.kappa,
+                trim=self.trim,
+            )
 
     async def calibrate(self) -> float:
         """
@@ -128,57 +186,151 @@ class Controller(BaseController):
         and return the final Zero Point to Write to the Test Photometer
         """
         self._on_calib_start()
-        # Waiting for both circular buffers to be filled
-        try:
-            async with asyncio.TaskGroup() as tg:
-                for role in self.roles:
-                    tg.create_task(self._fill_buffer_task(role))
-        except* Exception as eg:
-            log.error(eg.exceptions)
-        # launch the background buffer filling task and the stats task
-        try:
-            self.is_calibrated = False
-            async with asyncio.TaskGroup() as tg:
-                for role in self.roles:
-                    tg.create_task(self._producer_task(role))
-                stat_task = tg.create_task(self._statistics())
-        except* Exception as eg:
-            log.error(eg.exceptions)
-        zero_points, freqs = stat_task.result()
-        final_zero_point = self._post_statistics(zero_points, freqs)
-        self._on_calib_end()
-        return final_zero_point
+        if self.journal_dir is not None:
+            self.journal = Journal.create(self.journal_dir, self.meas_session, self._header())
+        return await self._calibrate()
+
+    async def resume(self, path: str) -> float:
+        """
+        Replays a calibration journal into the ring buffers, taking again its recorded
+        rounds, and continues calibrating with the remaining rounds
+        """
+        Journal.validate(path, self.phot_info[Role.TEST]["mac"])
+        self.meas_session = Journal.session(path)
+        self._on_calib_start()
+        nrounds = 0
+        for kind, role, item in Journal.records(path):
+            if kind == Record.READING:
+                self.ring[role].append(item)
+            elif kind == Record.ROUND:
+                self._take_round(nrounds)
+                nrounds += 1
+            else:
+                raise RuntimeError(f"Journal {path} has records after its end")
+        log.info("Resuming session %s after %d rounds", self.meas_session, nrounds)
+        self.journal = Journal.reopen(path)
+        return await self._calibrate(first_round=nrounds)
 
     async def not_updated(self, zero_point: float, msg: str):
         pass
 
-    def unique_samples(self, role: Role) -> set[Message]:
+    def unique_samples(self, role: Role) -> set[Reading]:
         return self._unique_samples[role]
 
+    def nsamples(self, role: Role) -> int:
+        """Number of unique samples used by the rounds"""
+        return len(self._unique_samples[role])
+
     # ===========
     # Private API
     # ===========
 
+    async def _calibrate(self, first_round: int = 0) -> float:
+        complete = False
+        try:
+            # Waiting for both circular buffers to be filled
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    for role in self.roles:
+                        tg.create_task(self._fill_buffer_task(role))
+            except* Exception as eg:
+                # No rounds without both buffers filled
+                raise eg.exceptions[0]
+            # launch the background buffer filling task and the stats task
+            try:
+                self.is_calibrated = False
+                async with asyncio.TaskGroup() as tg:
+                    for role in self.roles:
+                        tg.create_task(self._producer_task(role))
+                    stat_task = tg.create_task(self._statistics(first_round))
+            except* Exception as eg:
+                raise eg.exceptions[0]
+            zero_points, freqs = stat_task.result()
+            final_zero_point = self._post_statistics(zero_points, freqs)
+            complete = True
+        finally:
+            # An incomplete journal can still be resumed
+            if self.journal is not None:
+                self.journal.close(complete=complete)
+                self.journal = None
+        self._on_calib_end()
+        return final_zero_point
+
     async def _fill_buffer_task(self, role: Role) -> None:
-        """Finite task to fill the ring buffer"""
+        """Finite task to fill the ring buffer, or just enough for a precise first round"""
+        self.is_precise = False
         async with self.photometer[role]:
-            while len(self.ring[role]) < self.capacity:
+            while len(self.ring[role]) < self.capacity and not self.is_precise:
                 msg = await anext(self.photometer[role].readings)
+                self._readings_metrics(role, msg)
                 if msg is not None:
-                    self.ring[role].append(msg)
-                    pub.sendMessage(Event.READING, role=role, reading=msg)
+                    t = self.profiler.now()
+                    reading = Reading.from_message(msg)
+                    self.ring[role].append(reading)
+                    self._journal_reading(role, reading)
+                    t = self.profiler.record(role, Stage.RING, t)
+                    pub.sendMessage(Event.READING, role=role, reading=reading)
+                    self.profiler.record(role, Stage.DISPATCH, t)
+                    self.profiler.done(role)
+                    if self.min_samples is not None:
+                        self._provisional_round()
 
     async def _producer_task(self, role: Role) -> None:
         """This task continues to re-fill the buffer when statistics are being computed"""
         async with self.photometer[role]:
             while not self.is_calibrated:
                 msg = await anext(self.photometer[role].readings)
+                self._readings_metrics(role, msg)
                 if msg is not None:
-                    self.ring[role].append(msg)
+                    t = self.profiler.now()
+                    reading = Reading.from_message(msg)
+                    self.ring[role].append(reading)
+                    self._journal_reading(role, reading)
+                    self.profiler.record(role, Stage.RING, t)
+                    self.profiler.done(role)
 
     def _magnitude(self, role: Role, freq: float, freq_offset):
         return self.zp_fict - 2.5 * math.log10(freq - freq_offset)
 
+    async def _wait_period(self) -> None:
+        """Waits between rounds while the producer tasks keep filling the ring buffers"""
+        await self.clock.sleep(self.period)
+
+    def _journal_reading(self, role: Role, reading: Reading) -> None:
+        if self.journal is not None:
+            self.journal.reading(role, reading)
+
+    def _robust_params(self) -> None:
+        """Outlier rejecting estimator, replacing the central tendency when given"""
+        self.robust = self.common_param.get("robust")
+        kappa = self.common_param.get("kappa")
+        self.kappa = kappa if kappa is not None else KAPPA
+        trim = self.common_param.get("trim")
+        self.trim = trim if trim is not None else TRIM
+        if self.robust is not None:
+            # The kind of estimate stored along the rounds
+            self.central = ROBUST_CENTRAL[self.robust]
+
+    def _header(self) -> Mapping[str, Any]:
+        """Journal header, with the parameters actually used by this session"""
+        common_params = dict(
+            self.common_param,
+            buffer=self.capacity,
+            period=self.period,
+            central=self.central,
+            zp_fict=self.zp_fict,
+            rounds=self.nrounds,
+            zp_offset=self.zp_offset,
+            author=self.author,
+            journal=None,
+        )
+        return {
+            "ref": self.param[Role.REF],
+            "test": self.param[Role.TEST],
+            "common": common_params,
+            "mac": {str(role): self.phot_info[role]["mac"] for role in self.roles},
+        }
+
     # --------------------
     # Hooks implementation
     # --------------------
@@ -195,6 +347,10 @@ class Controller(BaseController):
     def _on_summary(self, summary_info: Mapping[str, Any]) -> None:
         pub.sendMessage(Event.SUMMARY, **summary_info)
 
+    def _on_round_samples(self, role: Role, samples: Collection[Reading]) -> None:
+        """Keeps the round samples snapshot until the end of calibration"""
+        self.accum_samples[role].append(samples)
+
     # ----------------------
     # Private helper methods
     # ----------------------
@@ -213,46 +369,112 @@ class Controller(BaseController):
         finally:
             return freq, stdev, mag
 
-    async def _statistics(self) -> SummaryStatistics:
-        zero_points = list()
-        stats = list()
+    def _provisional_round(self) -> None:
+        """
+        Statistics of the partially filled ring buffers. Published as round 0 once per
+        period, not stored. Filling stops when the Zero Point standard error is small enough.
+        """
+        if self.is_precise or any(len(self.ring[role]) < self.min_samples for role in self.roles):
+            return
+        stats_per_round = {role: self._round_statistics(role) for role in self.roles}
+        if any(stats[2] is None for stats in stats_per_round.values()):
+            return
+        error = math.hypot(
+            *(
+                MAG_ERROR
+                * max(stdev, QUANTUM / math.sqrt(12))
+                / (freq * math.sqrt(len(self.ring[role])))
+                for role, (freq, stdev, _) in stats_per_round.items()
+            )
+        )
+        filled = all(len(self.ring[role]) >= MIN_FILL * self.capacity for role in self.roles)
+        self.is_precise = filled and error <= self.precision
+        now = self.clock.monotonic()
+        if self.is_precise:
+            log.info(
+                "ZP standard error %.4f reached with %s samples",
+                error,
+                {str(role): len(self.ring[role]) for role in self.roles},
+            )
+        elif self._provisional_tstamp is not None and now - self._provisional_tstamp < self.period:
+            return
+        self._provisional_tstamp = now
+        mag_diff = stats_per_round[Role.REF][2] - stats_per_round[Role.TEST][2]
+        pub.sendMessage(
+            Event.ROUND,
+            current=0,
+            mag_diff=mag_diff,
+            zero_point=self.zp_abs + mag_diff,
+            stats=stats_per_round,
+        )
+
+    def _take_round(self, i: int) -> None:
+        stats_per_round = dict()
+        for role in self.roles:
+            stats_per_round[role] = self._round_statistics(role)
+            self._on_round_samples(role, self.ring[role].copy())
+            self.round_index[role].add(self.ring[role][0], self.ring[role][-1])
+            self.time_intervals[role].append(self.ring[role].intervals())
+            Ti, Tf = self.time_intervals[role][-1]
+            self.metrics.observe(
+                "zptess_round_duration_seconds", (Tf - Ti).total_seconds(), role=role.name.lower()
+            )
+        mag_diff = stats_per_round[Role.REF][2] - stats_per_round[Role.TEST][2]
+        self.zero_points.append(self.zp_abs + mag_diff)
+        self.metrics.inc("zptess_rounds_total")
+        self.metrics.set("zptess_zero_point", self.zero_points[i])
+        self.round_stats.append(stats_per_round)
+        if self.journal is not None:
+            self.journal.round(i + 1)
+        round_info = {
+            "current": i + 1,
+            "mag_diff": mag_diff,
+            "zero_point": self.zero_points[i],
+            "stats": stats_per_round,
+        }
+        self._on_round(round_info)
+
+    def _stop_reason(self, n: int) -> str | None:
+        """Reason to stop after n rounds, if any. Always None while rounds must go on"""
+        if self.tolerance is None:
+            return "fixed rounds" if n >= self.nrounds else None
+        K = self.stable_rounds
+        if n > K:
+            zero_points = [round(zp, 2) for zp in self.zero_points]
+            # Best Zero Point as it was after each of the last K+1 rounds
+            best_zero_points = [best(zero_points[:j])[1] for j in range(n - K, n + 1)]
+            if max(best_zero_points) - min(best_zero_points) <= self.tolerance:
+                return f"ZP converged within {self.tolerance} for {K} rounds"
+        if n >= self.max_rounds:
+            return f"ZP not converged after {n} rounds"
+        return None
+
+    async def _statistics(self, first_round: int = 0) -> SummaryStatistics:
         freqs = dict()
-        for i in range(0, self.nrounds):
-            stats_per_round = dict()
-            for role in self.roles:
-                stats_per_round[role] = self._round_statistics(role)
-                samples = self.ring[role].copy()
-                self.accum_samples[role].append(samples)
-                self._unique_samples[role].update(samples)
-                self.time_intervals[role].append(self.ring[role].intervals())
-            mag_diff = stats_per_round[Role.REF][2] - stats_per_round[Role.TEST][2]
-            zero_points.append(self.zp_abs + mag_diff)
-            stats.append(stats_per_round)
-            round_info = {
-                "current": i + 1,
-                "mag_diff": mag_diff,
-                "zero_point": zero_points[i],
-                "stats": stats_per_round,
-            }
-            self._on_round(round_info)
-            if i != self.nrounds - 1:
-                await asyncio.sleep(self.period)
-        zero_points = [round(zp, 2) for zp in zero_points]
+        i = first_round
+        # A resumed session may have taken all of its rounds before being interrupted
+        self.stop_reason = self._stop_reason(i) if i > 0 else None
+        while self.stop_reason is None:
+            # A resumed session also waits before its first round
+            # so that the ring buffers get fresh samples
+            if i > 0:
+                await self._wait_period()
+            self._take_round(i)
+            i += 1
+            self.stop_reason = self._stop_reason(i)
+        if self.tolerance is not None:
+            log.info("%s", self.stop_reason)
+        self.nrounds = i
+        zero_points = [round(zp, 2) for zp in self.zero_points]
         for role in self.roles:
-            freqs[role] = [stats_pr[role][0] for stats_pr in stats]
+            freqs[role] = [stats_pr[role][0] for stats_pr in self.round_stats]
+            # Round snapshots are de-duplicated once, not on every round
+            self._unique_samples[role].update(*self.accum_samples[role])
         self.is_calibrated = True  # So no more buffer filling
         return zero_points, freqs
 
     def _overlapping_windows(self) -> Mapping[Role, Sequence[float | None]]:
-        overlaps = defaultdict(list)
-        for role in self.roles:
-            for i, t in enumerate(self.time_intervals[role]):
-                if i < (self.nrounds - 1):
-                    next_t = self.time_intervals[role][i + 1]
-                    T = (t[1] - next_t[0]).total_seconds()
-                    T = None if T <= 0 else T
-                    overlaps[role].append(T)
-        return overlaps
+        return {role: overlaps(self.time_intervals[role][: self.nrounds]) for role in self.roles}
 
     def _post_statistics(self, zero_points, freqs) -> float:
         best_zp_method, best_zero_point = best(zero_points)
@@ -276,6 +498,7 @@ class Controller(BaseController):
             "best_zero_point_method": best_zp_method,
             "final_zero_point": final_zero_point,
             "overlapping_windows": overlap,
+            "stop_reason": self.stop_reason if self.tolerance is not None else None,
         }
         self._on_summary(summary_info)
         return final_zero_point
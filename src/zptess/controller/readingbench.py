@@ -0,0 +1,216 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import gc
+import math
+import time
+import random
+import logging
+import tracemalloc
+import collections
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Set, Tuple
+
+# --------------
+# local imports
+# -------------
+
+from .photometer.ring import Reading
+
+# ----------------
+# Module constants
+# ----------------
+
+# Synthetic TESS-W JSON messages at 1 Hz, as decoded by the photometer library
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+FREQ = 50.0
+JITTER = 0.5
+ZP = 20.50
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def messages(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Reproducible stream of synthetic photometer messages"""
+    rng = random.Random(seed)
+    result = list()
+    for i in range(n):
+        freq = round(FREQ + rng.gauss(0.0, JITTER), 3)
+        result.append(
+            {
+                "udp": i,
+                "rev": 2,
+                "name": "stars1",
+                "freq": freq,
+                "mag": round(ZP - 2.5 * math.log10(freq), 2),
+                "tamb": 20.0,
+                "tsky": -5.0,
+                "wdBm": -50,
+                "ZP": ZP,
+                "tstamp": START + timedelta(seconds=i),
+                "seq": i,
+            }
+        )
+    return result
+
+
+def unique_reading_session(
+    stream: Sequence[Mapping[str, Any]], capacity: int, starts: Sequence[int]
+) -> Tuple[List[Set[Any]], Set[Any]]:
+    """The calibrator rounds as they were: messages in the ring, a dict copy per round sample"""
+    ring = collections.deque([], capacity)
+    rounds = list()
+    unique = set()
+    j = 0
+    for i, message in enumerate(stream):
+        ring.append(message)
+        if j < len(starts) and i == starts[j]:
+            samples = set(UniqueReading(item) for item in ring)
+            rounds.append(samples)
+            unique.update(samples)
+            j += 1
+    return rounds, unique
+
+
+def reading_session(
+    stream: Sequence[Mapping[str, Any]], capacity: int, starts: Sequence[int]
+) -> Tuple[List[Set[Any]], Set[Any]]:
+    """The calibrator rounds as they are: readings converted once and shared by the rounds"""
+    ring = collections.deque([], capacity)
+    rounds = list()
+    unique = set()
+    j = 0
+    for i, message in enumerate(stream):
+        ring.append(Reading.from_message(message))
+        if j < len(starts) and i == starts[j]:
+            samples = set(ring)
+            rounds.append(samples)
+            unique.update(samples)
+            j += 1
+    return rounds, unique
+
+
+def memberships(rounds: Sequence[Set[Any]], unique: Set[Any]) -> int:
+    """Round membership checks of every unique sample, as the sample to rounds links need"""
+    return sum(1 for sample in unique for samples in rounds if sample in samples)
+
+
+# Both implementations of a calibration session, by reading record
+SESSIONS: Dict[str, Callable] = {
+    "UniqueReading": unique_reading_session,
+    "Reading": reading_session,
+}
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class UniqueReading(dict):
+    """
+    The dict based reading record that Reading replaced, kept as it was for comparison.
+    A hashable, subclaased dictionary based on the "tstamp" keyword and value
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, val):
+        dict.__setitem__(self, key, val)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, dict.__repr__(self))
+
+    def __hash__(self):
+        return int(dict.__getitem__(self, "tstamp").timestamp() * 1000)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+
+class Controller:
+    """
+    Runs the same simulated calibration session with the dict based UniqueReading
+    and with the slotted Reading record: round snapshots, sample de-duplication and
+    round membership checks. Measures the memory the session retains with tracemalloc
+    and times both phases, the best of several runs.
+    """
+
+    def __init__(
+        self,
+        rounds: int = 10,
+        capacity: int = 1000,
+        stride: int = 250,
+        repeat: int = 5,
+        seed: int = 0,
+    ):
+        self.capacity = capacity
+        self.repeat = repeat
+        # Rounds start once the buffer is filled, then every stride readings
+        self.starts = [capacity - 1 + k * stride for k in range(rounds)]
+        self.stream = messages(self.starts[-1] + 1, seed)
+
+    def memory(self, session: Callable) -> int:
+        """Bytes retained by the rounds and the unique samples at the end of the session"""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = session(self.stream, self.capacity, self.starts)
+            gc.collect()
+            retained, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del result
+        return retained
+
+    def timings(self, session: Callable) -> Tuple[float, float, Tuple[int, int]]:
+        """Best rounds and membership check times, with the unique samples and links count"""
+        best_rounds = best_links = None
+        for _ in range(max(self.repeat, 1)):
+            t0 = time.perf_counter()
+            rounds, unique = session(self.stream, self.capacity, self.starts)
+            t1 = time.perf_counter()
+            links = memberships(rounds, unique)
+            t2 = time.perf_counter()
+            best_rounds = t1 - t0 if best_rounds is None else min(best_rounds, t1 - t0)
+            best_links = t2 - t1 if best_links is None else min(best_links, t2 - t1)
+        return best_rounds, best_links, (len(unique), links)
+
+    def run(self) -> Dict[str, Any]:
+        memory = dict()
+        rounds = dict()
+        links = dict()
+        counts = dict()
+        for name, session in SESSIONS.items():
+            memory[name] = self.memory(session)
+            rounds[name], links[name], counts[name] = self.timings(session)
+        return {
+            "readings": len(self.stream),
+            "rounds": len(self.starts),
+            "memory": memory,
+            "snapshots": rounds,
+            "memberships": links,
+            "counts": counts,
+        }
@@ -0,0 +1,187 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import csv
+import asyncio
+import logging
+import multiprocessing
+
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Mapping, Sequence, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from sqlalchemy import select
+from lica.asyncio.photometer import Role
+from zptessdao.asyncio import Summary
+from zptessdao.constants import Calibration
+
+# --------------
+# local imports
+# -------------
+
+from ..dao import engine, Session
+from .photometer.replay import Controller as ReplayCalibrator
+
+# ----------------
+# Module constants
+# ----------------
+
+RECALIBRATION_EXPORT_HEADERS = (
+    "Session (UTC)",
+    "Name",
+    "MAC",
+    "Stored ZP",
+    "Stored Method",
+    "Recomputed ZP",
+    "Recomputed Method",
+    "Δ ZP",
+    "Central",
+    "# Samples",
+    "Period (s.)",
+    "Rounds",
+    "Error",
+)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+async def _recalibrate(
+    sessions: Sequence[datetime], common_params: Mapping[str, Any]
+) -> Sequence[Tuple[Any]]:
+    rows = list()
+    for session_id in sessions:
+        controller = ReplayCalibrator(session_id, common_params)
+        try:
+            await controller.init()
+            await controller.calibrate()
+        except Exception as e:
+            rows.append((session_id,) + (None,) * (len(RECALIBRATION_EXPORT_HEADERS) - 2) + (e,))
+            continue
+        summary_info = controller.summary_info
+        stored_zp = controller.stored_zero_point
+        new_zp = summary_info["best_zero_point"]
+        rows.append(
+            (
+                session_id,
+                controller.phot_info[Role.TEST]["name"],
+                controller.phot_info[Role.TEST]["mac"],
+                stored_zp,
+                controller.stored_zero_point_method,
+                new_zp,
+                summary_info["best_zero_point_method"],
+                round(new_zp - stored_zp, 2) if stored_zp is not None else None,
+                controller.robust or controller.central,
+                controller.capacity,
+                controller.period,
+                controller.nrounds,
+                None,
+            )
+        )
+    # Each worker process runs its own event loop, with its own database connections
+    await engine.dispose()
+    return rows
+
+
+def recalibrate(
+    sessions: Sequence[datetime], common_params: Mapping[str, Any]
+) -> Sequence[Tuple[Any]]:
+    """Worker process entry point. Recalibrates a chunk of sessions"""
+    return asyncio.run(_recalibrate(sessions, common_params))
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Controller:
+    def __init__(
+        self,
+        base_dir: str,
+        filename_prefix: str,
+        begin_tstamp: datetime,
+        end_tstamp: datetime,
+        common_params: Mapping[str, Any],
+        workers: int | None = None,
+        chunk_size: int = 8,
+    ):
+        self.begin_tstamp = begin_tstamp
+        self.end_tstamp = end_tstamp
+        self.base_dir = base_dir if os.path.isabs(base_dir) else os.path.abspath(base_dir)
+        self.filename_prefix = filename_prefix
+        self.common_params = common_params
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    # ----------
+    # Public API
+    # ----------
+
+    async def query_sessions(self) -> Sequence[datetime]:
+        """Automatic calibration sessions (i.e. with samples) in the time span"""
+        async with Session() as session:
+            async with session.begin():
+                q = (
+                    select(Summary.session)
+                    .where(
+                        Summary.session.between(self.begin_tstamp, self.end_tstamp),
+                        Summary.role == Role.TEST,
+                        Summary.calibration == Calibration.AUTO,
+                    )
+                    .order_by(Summary.session)
+                )
+                sessions = (await session.scalars(q)).all()
+        return sessions
+
+    async def recalibrate(self, sessions: Sequence[datetime]) -> Sequence[Tuple[Any]]:
+        """Fans out chunks of sessions to a pool of worker processes"""
+        loop = asyncio.get_running_loop()
+        chunks = [
+            sessions[i : i + self.chunk_size] for i in range(0, len(sessions), self.chunk_size)
+        ]
+        log.info(
+            "Recalibrating %d sessions in %d chunks with %d workers",
+            len(sessions),
+            len(chunks),
+            self.workers,
+        )
+        # Workers must not inherit the parent event loop nor its database connections
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            futures = [
+                loop.run_in_executor(pool, recalibrate, chunk, self.common_params)
+                for chunk in chunks
+            ]
+            results = await asyncio.gather(*futures)
+        return [row for rows in results for row in rows]
+
+    def export(self, rows: Sequence[Tuple[Any]]) -> str:
+        csv_path = os.path.join(self.base_dir, f"recalibration_{self.filename_prefix}.csv")
+        log.info("exporting %s", os.path.basename(csv_path))
+        with open(csv_path, "w") as csv_file:
+            csv_writer = csv.writer(csv_file, delimiter=";")
+            csv_writer.writerow(RECALIBRATION_EXPORT_HEADERS)
+            for row in rows:
+                csv_writer.writerow(row)
+        return csv_path
@@ -0,0 +1,147 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import time
+import random
+import logging
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+# ---------------------------
+# Third-party library imports
+# ----------------------------
+
+from zptessdao.constants import CentralTendency
+
+# --------------
+# local imports
+# -------------
+
+from .photometer.ring import ring_buffer, Reading
+from .photometer.types import RingType, Robust
+
+# ----------------
+# Module constants
+# ----------------
+
+# The deque ring buffer computes the statistics straight from the standard library
+REFERENCE = RingType.DEQUE
+
+# Relative tolerance between ring buffers. The sorted ring buffer keeps running sums
+# and the NumPy one sums in a different order, so the last few bits may differ
+TOLERANCE = 1e-6
+
+# Synthetic TESS-W readings: 1 Hz, frequency with a slow drift,
+# quantized to the millihertz as the photometers report it
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+FREQ = 50.0
+JITTER = 0.5
+DRIFT = 1e-4  # Hz per sample
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# get the module logger
+log = logging.getLogger(__name__.split(".")[-1])
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def readings(n: int, seed: int = 0) -> List[Reading]:
+    """Reproducible stream of synthetic readings"""
+    rng = random.Random(seed)
+    return [
+        Reading(
+            tstamp=START + timedelta(seconds=i),
+            freq=round(FREQ + DRIFT * i + rng.gauss(0.0, JITTER), 3),
+            seq=i,
+            tamb=20.0,
+        )
+        for i in range(n)
+    ]
+
+
+def close(a: float, b: float) -> bool:
+    return abs(a - b) <= TOLERANCE * max(abs(a), abs(b), 1.0)
+
+
+# -----------------
+# Auxiliary classes
+# -----------------
+
+
+class Controller:
+    """
+    Feeds the same reading stream to every ring buffer implementation,
+    taking the round statistics every few readings once the buffer is full,
+    checks they agree with the deque ring buffer and times them.
+    """
+
+    def __init__(
+        self,
+        nsamples: int = 20000,
+        capacity: int = 75,
+        stride: int = 5,
+        central: CentralTendency = CentralTendency.MEDIAN,
+        robust: Robust | None = None,
+        repeat: int = 5,
+        seed: int = 0,
+    ):
+        self.capacity = capacity
+        self.stride = stride
+        self.central = central
+        self.robust = robust
+        self.repeat = repeat
+        self.stream = readings(nsamples, seed)
+
+    def feed(self, ring_type: RingType) -> List[Tuple[float, float]]:
+        """Round statistics (central, stdev) along the stream"""
+        ring = ring_buffer(
+            ring_type, capacity=self.capacity, central=self.central, robust=self.robust
+        )
+        result = list()
+        for i, reading in enumerate(self.stream):
+            ring.append(reading)
+            if len(ring) == self.capacity and i % self.stride == 0:
+                result.append(ring.statistics())
+        return result
+
+    def mismatches(
+        self, expected: Sequence[Tuple[float, float]], results: Sequence[Tuple[float, float]]
+    ) -> int:
+        return sum(
+            1
+            for (c0, s0), (c1, s1) in zip(expected, results)
+            if not (close(c0, c1) and close(s0, s1))
+        ) + abs(len(expected) - len(results))
+
+    def run(self, ring_types: Sequence[RingType] = tuple(RingType)) -> Dict[str, Any]:
+        expected = self.feed(REFERENCE)
+        timings = dict()
+        mismatches = dict()
+        for ring_type in ring_types:
+            best = None
+            for _ in range(max(self.repeat, 1)):
+                t0 = time.perf_counter()
+                results = self.feed(ring_type)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            mismatches[ring_type] = self.mismatches(expected, results)
+            timings[ring_type] = best
+        return {
+            "samples": len(self.stream),
+            "rounds": len(expected),
+            "timings": timings,
+            "mismatches": mismatches,
+        }
@@ -0,0 +1,37 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sys
+import importlib.util
+from types import ModuleType
+
+# -------------------
+# Auxiliary functions
+# -------------------
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Module actually loaded on its first attribute access, for heavy dependencies
+    most commands never use. Modules already imported are returned as they are.
+    Registered in sys.modules, so later plain imports get the same lazy module.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,7 @@
+# Matplotlib takes long to import, so plots are only loaded when actually drawn
+
+from ..lazy import lazy_import
+
+plot = lazy_import(__name__ + ".plot")
+
+__all__ = ["plot"]